@@ -0,0 +1,348 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import command_runner
+
+DEFAULT_HOST = os.environ.get("ANDROID_ADB_SERVER_ADDRESS", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+ADB_PATH = "adb"
+
+
+class AdbError(RuntimeError):
+    """Raised when the ADB server rejects a request (replies with FAIL)."""
+
+
+class AdbClient:
+    """Talks to the ADB server over its TCP protocol instead of running the adb binary.
+
+    Every request is a 4 hex digit length followed by the request text (e.g. 'host:devices').
+    The server replies with 'OKAY' or 'FAIL', usually followed by a length-prefixed message.
+
+    The ADB server closes the connection after answering a 'host:' request, so each request
+    uses its own loopback socket. Opening one costs microseconds, where running the adb
+    binary forks a shell, the adb client and any text tools in the pipeline.
+
+    Args:
+        host: The address of the ADB server.
+        port: The port of the ADB server.
+        timeout: The socket timeout in seconds for every request.
+        adb_path: The adb binary, only used to start the ADB server if it is not running.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 10,
+                 adb_path: str = ADB_PATH):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.adb_path = adb_path
+
+    def _connect(self) -> socket.socket:
+        try:
+            return socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except ConnectionRefusedError:
+            # The adb binary starts the server on demand, so do the same
+            self.start_server()
+            return socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbError("ADB server closed the connection unexpectedly")
+            data += chunk
+        return bytes(data)
+
+    @classmethod
+    def _read_string(cls, sock: socket.socket) -> str:
+        length = int(cls._recv_exactly(sock, 4), 16)
+        return cls._recv_exactly(sock, length).decode(errors="replace")
+
+    @classmethod
+    def _send_request(cls, sock: socket.socket, request: str):
+        payload = request.encode()
+        sock.sendall(b"%04x" % len(payload) + payload)
+
+        status = cls._recv_exactly(sock, 4)
+        if status == b"FAIL":
+            raise AdbError(cls._read_string(sock))
+        if status != b"OKAY":
+            raise AdbError(f"Unexpected reply from ADB server: {status!r}")
+
+    def _query(self, request: str) -> str:
+        with self._connect() as sock:
+            self._send_request(sock, request)
+            return self._read_string(sock)
+
+    def version(self) -> int:
+        """Fetches the protocol version of the ADB server."""
+        return int(self._query("host:version"), 16)
+
+    @staticmethod
+    def _parse_devices(table: str) -> List[Tuple[str, str]]:
+        devices = []
+        for line in table.splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                devices.append((fields[0], fields[1]))
+        return devices
+
+    def devices(self) -> List[Tuple[str, str]]:
+        """Fetches every device known to the ADB server.
+
+        Returns:
+            A list of (serial, state) tuples, e.g. ('192.168.1.80:5555', 'device').
+        """
+        return self._parse_devices(self._query("host:devices"))
+
+    def track_devices(self, timeout: Optional[float] = None) -> Iterator[Dict[str, str]]:
+        """Streams the device table every time a device is added, removed or changes state.
+
+        Uses a single connection to the ADB server ('host:track-devices'). The current table
+        is yielded straight away, then again after every change.
+
+        Args:
+            timeout: The maximum time in seconds to keep streaming. If None, stream forever.
+
+        Yields:
+            Dictionaries mapping each device serial to its state.
+
+        Raises:
+            TimeoutError: If the timeout is reached while waiting for the next change.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._connect() as sock:
+            self._send_request(sock, "host:track-devices")
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a device state change")
+                    sock.settimeout(remaining)
+                else:
+                    sock.settimeout(None)
+                yield dict(self._parse_devices(self._read_string(sock)))
+
+    def get_state(self, serial: str) -> str:
+        """Fetches the state of a single device (e.g. 'device', 'unauthorized', 'offline')."""
+        return self._query(f"host-serial:{serial}:get-state")
+
+    def connect(self, address: str) -> str:
+        """Asks the ADB server to connect to a device over TCP/IP.
+
+        Args:
+            address: The address of the device, e.g. '192.168.1.80:5555'.
+
+        Returns:
+            The outcome reported by the server, worded exactly as `adb connect` prints it.
+        """
+        return self._query(f"host:connect:{address}")
+
+    def disconnect(self, address: str) -> str:
+        """Asks the ADB server to disconnect from a device.
+
+        Returns:
+            The outcome reported by the server, e.g. 'disconnected 192.168.1.80'.
+
+        Raises:
+            AdbError: If the server does not know the device.
+        """
+        return self._query(f"host:disconnect:{address}")
+
+    def kill_server(self):
+        """Stops the ADB server. Does nothing if it is not running."""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except ConnectionRefusedError:
+            return
+        with sock:
+            self._send_request(sock, "host:kill")
+
+    def start_server(self):
+        """Starts the ADB server. Only the adb binary can launch the server daemon.
+
+        Raises:
+            command_runner.CommandError: If adb is missing, fails or takes longer than the timeout.
+        """
+        command_runner.run([self.adb_path, "start-server"], timeout=self.timeout)
+
+    def open_service(self, serial: str, service: str) -> socket.socket:
+        """Opens a stream to a service on the device, e.g. 'shell:' or 'exec:screencap'.
+
+        The returned socket carries the raw service stream; the caller must close it.
+        """
+        sock = self._connect()
+        try:
+            self._send_request(sock, f"host:transport:{serial}")
+            self._send_request(sock, service)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, serial: str, command: str) -> str:
+        """Runs a shell command on the device and returns its output."""
+        with self.open_service(serial, f"shell:{command}") as sock:
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks).decode(errors="replace")
+
+
+class AsyncAdbClient:
+    """The asyncio counterpart of AdbClient, for callers that overlap requests or must bound them.
+
+    Every request is limited by a real timeout, and cancelling the task that awaits it closes
+    its connection to the ADB server straight away.
+
+    Args:
+        host: The address of the ADB server.
+        port: The port of the ADB server.
+        timeout: The maximum time in seconds for every request, including starting the server.
+        adb_path: The adb binary, only used to start the ADB server if it is not running.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 10,
+                 adb_path: str = ADB_PATH):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.adb_path = adb_path
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await asyncio.open_connection(self.host, self.port)
+        except ConnectionRefusedError:
+            # The adb binary starts the server on demand, so do the same
+            await self.start_server()
+            return await asyncio.open_connection(self.host, self.port)
+
+    @staticmethod
+    async def _read_string(reader: asyncio.StreamReader) -> str:
+        length = int(await reader.readexactly(4), 16)
+        return (await reader.readexactly(length)).decode(errors="replace")
+
+    @classmethod
+    async def _send_request(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: str):
+        payload = request.encode()
+        writer.write(b"%04x" % len(payload) + payload)
+        await writer.drain()
+
+        status = await reader.readexactly(4)
+        if status == b"FAIL":
+            raise AdbError(await cls._read_string(reader))
+        if status != b"OKAY":
+            raise AdbError(f"Unexpected reply from ADB server: {status!r}")
+
+    async def _exchange(self, request: str) -> str:
+        reader, writer = await self._connect()
+        try:
+            await self._send_request(reader, writer, request)
+            return await self._read_string(reader)
+        except asyncio.IncompleteReadError:
+            raise AdbError("ADB server closed the connection unexpectedly") from None
+        finally:
+            writer.close()
+
+    async def _query(self, request: str, timeout: Optional[float] = None) -> str:
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(self._exchange(request), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"ADB server did not answer '{request}' within {timeout} s") from None
+
+    async def version(self) -> int:
+        """Fetches the protocol version of the ADB server."""
+        return int(await self._query("host:version"), 16)
+
+    async def devices(self) -> List[Tuple[str, str]]:
+        """Fetches every device known to the ADB server, as (serial, state) tuples."""
+        return AdbClient._parse_devices(await self._query("host:devices"))
+
+    async def get_state(self, serial: str) -> str:
+        """Fetches the state of a single device (e.g. 'device', 'unauthorized', 'offline')."""
+        return await self._query(f"host-serial:{serial}:get-state")
+
+    async def connect(self, address: str, timeout: Optional[float] = None) -> str:
+        """Asks the ADB server to connect to a device over TCP/IP.
+
+        Args:
+            address: The address of the device, e.g. '192.168.1.80:5555'.
+            timeout: The maximum time in seconds to wait for the outcome. Defaults to the
+                     client timeout.
+
+        Returns:
+            The outcome reported by the server, worded exactly as `adb connect` prints it.
+
+        Raises:
+            TimeoutError: If the server did not report an outcome in time, e.g. because the
+                          address does not answer.
+        """
+        return await self._query(f"host:connect:{address}", timeout)
+
+    async def disconnect(self, address: str) -> str:
+        """Asks the ADB server to disconnect from a device.
+
+        Raises:
+            AdbError: If the server does not know the device.
+        """
+        return await self._query(f"host:disconnect:{address}")
+
+    async def kill_server(self):
+        """Stops the ADB server. Does nothing if it is not running."""
+        async def kill():
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except ConnectionRefusedError:
+                return
+            try:
+                await self._send_request(reader, writer, "host:kill")
+            finally:
+                writer.close()
+
+        await asyncio.wait_for(kill(), self.timeout)
+
+    async def start_server(self):
+        """Starts the ADB server with the adb binary, killing the binary if it takes too long.
+
+        Raises:
+            command_runner.CommandError: If adb is missing, fails or takes longer than the timeout.
+        """
+        await command_runner.run_async([self.adb_path, "start-server"], timeout=self.timeout)
+
+
+_default_client: Optional[AdbClient] = None
+_default_client_lock = threading.Lock()
+
+
+def default_client() -> AdbClient:
+    """Returns the AdbClient shared by the whole process."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = AdbClient()
+        return _default_client
+
+
+_default_async_client: Optional[AsyncAdbClient] = None
+
+
+def default_async_client() -> AsyncAdbClient:
+    """Returns the AsyncAdbClient shared by the whole process.
+
+    It keeps no connections open, so it can be used from any event loop.
+    """
+    global _default_async_client
+    with _default_client_lock:
+        if _default_async_client is None:
+            _default_async_client = AsyncAdbClient()
+        return _default_async_client
@@ -0,0 +1,197 @@
+import itertools
+import subprocess
+import threading
+import weakref
+from typing import Dict, Iterable, List, Optional
+
+import command_runner
+import metrics
+
+ADB_PATH = "adb"
+_MARKER = "@@cast-remote-done "
+
+
+class _Confirmation:
+    def __init__(self, process: subprocess.Popen):
+        self.process = process
+        self.confirmed = False
+        self.done = threading.Event()
+
+
+class AdbShellSession:
+    """A long-lived `adb shell` used as a keypress channel to a Google Cast-enabled device.
+
+    Running `adb shell input keyevent ...` for every button press forks a new adb client,
+    which has to reach the ADB server and open a fresh shell on the device each time. This
+    class keeps a single `adb shell` process open and writes commands into its stdin instead.
+    If the shell dies (e.g. the device went offline), it is restarted on the next command.
+
+    Args:
+        serial: The serial of the target device (e.g. '192.168.1.80:5555'). If None, adb
+                picks the only connected device.
+        adb_path: The path to the adb binary.
+    """
+
+    def __init__(self, serial: Optional[str] = None, adb_path: str = ADB_PATH):
+        self.serial = serial
+        self.adb_path = adb_path
+        self.restarts = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._markers = itertools.count(1)
+        self._pending: Dict[bytes, _Confirmation] = {}
+        self._exited: "weakref.WeakSet[subprocess.Popen]" = weakref.WeakSet()
+        self._pending_lock = threading.Lock()
+
+    def __enter__(self) -> "AdbShellSession":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _argv(self) -> List[str]:
+        argv = [self.adb_path]
+        if self.serial:
+            argv += ["-s", self.serial]
+        argv.append("shell")
+        return argv
+
+    def _start(self):
+        self._process = command_runner.popen(self._argv(), stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        # Drained even when nothing waits for a confirmation, so the shell never blocks on a full pipe
+        threading.Thread(target=self._read_output, args=(self._process,), name=f"adb-shell-{self.serial}",
+                         daemon=True).start()
+
+    def _read_output(self, process: subprocess.Popen):
+        try:
+            for line in process.stdout:
+                with self._pending_lock:
+                    confirmation = self._pending.pop(line.strip(), None)
+                if confirmation is not None:
+                    confirmation.confirmed = True
+                    confirmation.done.set()
+        except (OSError, ValueError):
+            pass
+        # The shell exited, so nothing it was sent will be confirmed any more
+        with self._pending_lock:
+            self._exited.add(process)
+            for marker, confirmation in list(self._pending.items()):
+                if confirmation.process is process:
+                    del self._pending[marker]
+                    confirmation.done.set()
+
+    def _ensure_started(self):
+        if self._process is None:
+            self._start()
+        elif self._process.poll() is not None:
+            self.restarts += 1
+            self._start()
+
+    def open(self):
+        """Starts the shell now rather than on the first command, so that command is not delayed."""
+        with self._lock:
+            self._ensure_started()
+
+    def is_alive(self) -> bool:
+        """Checks whether the underlying `adb shell` process is still running."""
+        return self._process is not None and self._process.poll() is None
+
+    def send(self, command: str, confirm_timeout: Optional[float] = None):
+        """Runs a shell command on the device, by default without waiting for it to complete.
+
+        The command is retried once on a fresh shell if the current one has died.
+
+        Args:
+            command: A single line of shell to run on the device.
+            confirm_timeout: If given, waits up to this many seconds for the device to confirm
+                that it ran the command, by echoing a marker after it.
+
+        Raises:
+            RuntimeError: If the command cannot be written to a freshly started shell, or the
+                device did not confirm it in time.
+        """
+        line = (command.rstrip("\n") + "\n").encode()
+        marker = None
+        if confirm_timeout is not None:
+            marker = f"{_MARKER}{next(self._markers)}".encode()
+            line += b"echo " + marker + b"\n"
+
+        with self._lock, metrics.timed("cast_remote_keypress_send_seconds"):
+            for attempt in range(2):
+                self._ensure_started()
+                confirmation = self._expect(marker)
+                try:
+                    self._process.stdin.write(line)
+                    self._process.stdin.flush()
+                    break
+                except (BrokenPipeError, OSError):
+                    self._forget(marker)
+                    self._kill()
+                    if attempt == 0:
+                        self.restarts += 1
+            else:
+                metrics.inc("cast_remote_keypress_failures_total")
+                raise RuntimeError(f"Unable to send command to device through adb shell: {command}")
+
+        if confirmation is None:
+            return
+        if not confirmation.done.wait(confirm_timeout):
+            self._forget(marker)
+            metrics.inc("cast_remote_keypress_failures_total")
+            raise RuntimeError(f"Device {self.serial} did not confirm the command within {confirm_timeout} s")
+        if not confirmation.confirmed:
+            metrics.inc("cast_remote_keypress_failures_total")
+            raise RuntimeError(f"adb shell to device {self.serial} exited before running the command")
+
+    def _expect(self, marker: Optional[bytes]) -> Optional[_Confirmation]:
+        if marker is None:
+            return None
+        confirmation = _Confirmation(self._process)
+        with self._pending_lock:
+            if self._process in self._exited:
+                confirmation.done.set()
+            else:
+                self._pending[marker] = confirmation
+        return confirmation
+
+    def _forget(self, marker: Optional[bytes]):
+        if marker is not None:
+            with self._pending_lock:
+                self._pending.pop(marker, None)
+
+    def send_keyevent(self, keycode: str):
+        """Sends a single keyevent (e.g. 'KEYCODE_HOME') to the device."""
+        self.send(f"input keyevent {keycode}")
+
+    def send_keyevents(self, keycodes: Iterable[str]):
+        """Sends several keyevents to the device in a single `input` invocation."""
+        keycodes = list(keycodes)
+        if keycodes:
+            self.send("input keyevent " + " ".join(keycodes))
+
+    def _kill(self):
+        if self._process is None:
+            return
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        self._process = None
+
+    def close(self, timeout: float = 5):
+        """Closes the shell, letting it finish any commands that were already sent.
+
+        Args:
+            timeout: Seconds to wait for the shell to exit before killing it.
+        """
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=timeout)
+            except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+                self._kill()
+            self._process = None
@@ -0,0 +1,289 @@
+"""A per-device index of installed apps, so an app can be launched by name with one `am start`.
+
+Finding the activity that launches an app means running `cmd package resolve-activity` on
+the device, which takes a good fraction of a second per package. The index remembers the
+launcher activity of every package in a JSON file next to the device registry (APPS_PATH),
+so launching a known app is a single `am start -n`. Devices are keyed by their UUID in the
+registry, so the index follows a device to a new IP address, and a device that takes over an
+address does not inherit the apps of the one that had it.
+
+A refresh lists the packages with one `pm list packages -f --show-versioncode`. The APK path
+and the version code of a package both change whenever it is installed or updated, so
+together they stamp each entry. Only the packages whose stamp changed are resolved again,
+all in one shell command. The first refresh lists every launcher activity at once with
+`cmd package query-activities`.
+
+An app is found by its label, or by its package name or part of it. Labels default to the
+package name without its vendor prefix and can be changed with the label command.
+
+Usage:
+    python3 app_index.py IP_ADDRESS list
+    python3 app_index.py IP_ADDRESS refresh
+    python3 app_index.py IP_ADDRESS launch APP
+    python3 app_index.py IP_ADDRESS label PACKAGE LABEL
+"""
+import json
+import os
+import re
+import shlex
+import sys
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+APPS_PATH = os.environ.get("CAST_REMOTE_APPS", os.path.expanduser("~/.config/adb-cast-remote/apps.json"))
+
+# TV apps declare LEANBACK_LAUNCHER; phone apps sideloaded onto the TV only LAUNCHER
+LAUNCHER_CATEGORIES = ("android.intent.category.LEANBACK_LAUNCHER", "android.intent.category.LAUNCHER")
+_PACKAGE_LINE = re.compile(r"^package:(?P<path>.+)=(?P<package>[\w.]+)(?: versionCode:(?P<version>\d+))?$")
+_COMPONENT = re.compile(r"^\s*(?P<package>[\w.]+)/(?P<activity>[\w.$]+)\s*$")
+_VENDOR_PREFIXES = ("com", "org", "net", "tv", "google", "android", "amazon")
+_MARKER = "@@package "
+
+Shell = Callable[[str], str]
+
+
+@dataclass
+class AppEntry:
+    """An installed package of a device.
+
+    Attributes:
+        package: The package name, e.g. 'com.netflix.ninja'.
+        stamp: The APK path and version code, which change whenever the package is updated.
+        activity: The component that launches the app, e.g. 'com.netflix.ninja/.MainActivity',
+            or None if it has no launcher activity.
+        label: The name the app is found by.
+    """
+    package: str
+    stamp: str
+    activity: Optional[str] = None
+    label: str = ""
+
+
+def default_label(package: str) -> str:
+    """Names an app after its package, e.g. 'netflix ninja' for 'com.netflix.ninja'."""
+    parts = package.split(".")
+    while len(parts) > 1 and parts[0] in _VENDOR_PREFIXES:
+        parts = parts[1:]
+    return " ".join(parts)
+
+
+def parse_package_list(output: str) -> Dict[str, str]:
+    """Parses `pm list packages -f --show-versioncode`.
+
+    Returns:
+        The stamp of each package.
+    """
+    stamps = {}
+    for line in output.splitlines():
+        match = _PACKAGE_LINE.match(line.strip())
+        if match:
+            stamps[match["package"]] = f"{match['path']}:{match['version'] or ''}"
+    return stamps
+
+
+def parse_components(output: str) -> Dict[str, str]:
+    """Finds the package/activity components in the output of resolve-activity or query-activities.
+
+    Returns:
+        The first component listed for each package.
+    """
+    components = {}
+    for line in output.splitlines():
+        match = _COMPONENT.match(line)
+        if match:
+            components.setdefault(match["package"], line.strip())
+    return components
+
+
+def resolve_activities(shell: Shell, packages: List[str]) -> Dict[str, str]:
+    """Resolves the launcher activity of several packages with one shell command.
+
+    Returns:
+        The launcher activity of each package that has one.
+    """
+    commands = []
+    for package in packages:
+        commands.append(f"echo {shlex.quote(_MARKER + package)}")
+        commands.extend(f"cmd package resolve-activity --brief -c {category} {shlex.quote(package)}"
+                        for category in LAUNCHER_CATEGORIES)
+
+    activities = {}
+    package = None
+    for line in shell("; ".join(commands)).splitlines():
+        if line.startswith(_MARKER):
+            package = line[len(_MARKER):].strip()
+            continue
+        match = _COMPONENT.match(line)
+        # resolve-activity falls back to the package's other activities only if asked to
+        if package and match and match["package"] == package:
+            activities.setdefault(package, line.strip())
+    return activities
+
+
+def list_launcher_activities(shell: Shell) -> Dict[str, str]:
+    """Lists the launcher activity of every package with one shell command."""
+    output = shell("; ".join(f"cmd package query-activities --brief -a android.intent.action.MAIN -c {category}"
+                             for category in LAUNCHER_CATEGORIES))
+    return parse_components(output)
+
+
+class AppIndex:
+    """Reads and writes the app index file, keyed by UUID. Every write replaces the file atomically.
+
+    Args:
+        path: The path of the index file.
+    """
+
+    def __init__(self, path: str = APPS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, AppEntry]]:
+        try:
+            with open(self.path) as index_file:
+                devices = json.load(index_file)
+            return {uuid: {package: AppEntry(package=package, **entry) for package, entry in apps.items()}
+                    for uuid, apps in devices.items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError, AttributeError):
+            # The index is only a cache; a refresh rebuilds it
+            return {}
+
+    def _save(self, devices: Dict[str, Dict[str, AppEntry]]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        serialized = {uuid: {package: {key: value for key, value in asdict(entry).items() if key != "package"}
+                             for package, entry in apps.items()}
+                      for uuid, apps in devices.items()}
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".apps-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(serialized, temp_file, indent=1)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def apps(self, uuid: str) -> List[AppEntry]:
+        """Returns the launchable apps of a device, by label."""
+        with self._lock:
+            apps = self._load().get(uuid, {})
+        return sorted((entry for entry in apps.values() if entry.activity), key=lambda entry: entry.label)
+
+    def refresh(self, uuid: str, shell: Shell) -> List[str]:
+        """Brings the index of a device up to date, resolving only new and updated packages.
+
+        Args:
+            uuid: The UUID of the device in the device registry.
+            shell: Runs a shell command on the device and returns its output.
+
+        Returns:
+            The packages that were added, updated or removed.
+        """
+        stamps = parse_package_list(shell("pm list packages -f --show-versioncode"))
+        if not stamps:
+            raise RuntimeError(f"Unable to list the packages of device {uuid}")
+
+        with self._lock:
+            devices = self._load()
+        known = devices.get(uuid, {})
+        changed = [package for package, stamp in stamps.items()
+                   if package not in known or known[package].stamp != stamp]
+        removed = [package for package in known if package not in stamps]
+
+        activities: Dict[str, str] = {}
+        if changed:
+            if known:
+                activities = resolve_activities(shell, changed)
+            else:
+                activities = list_launcher_activities(shell)
+
+        # Read again so that a label set while the device was being queried is not lost
+        with self._lock:
+            devices = self._load()
+            apps = devices.setdefault(uuid, {})
+            for package in removed:
+                apps.pop(package, None)
+            for package in changed:
+                previous = apps.get(package)
+                apps[package] = AppEntry(package, stamps[package], activities.get(package),
+                                         previous.label if previous else default_label(package))
+            if changed or removed:
+                self._save(devices)
+        return changed + removed
+
+    def find(self, uuid: str, app: str) -> Optional[AppEntry]:
+        """Finds a launchable app by label, package name or part of either, ignoring case.
+
+        An exact label or package name wins. Otherwise, among the apps whose package name
+        has the query as one of its parts, or else contains it anywhere, the one with the
+        shortest package name wins, e.g. 'youtube' finds com.google.android.youtube.tv rather
+        than com.google.android.youtube.tvmusic.
+        """
+        query = app.strip().lower()
+        apps = self.apps(uuid)
+        for entry in apps:
+            if query in (entry.label.lower(), entry.package.lower()):
+                return entry
+        for matches in ([entry for entry in apps if query in entry.package.lower().split(".")],
+                        [entry for entry in apps if query in entry.label.lower() or query in entry.package.lower()]):
+            if matches:
+                return min(matches, key=lambda entry: (len(entry.package), entry.package))
+        return None
+
+    def set_label(self, uuid: str, package: str, label: str):
+        """Changes the name an app is found by. The label survives refreshes.
+
+        Raises:
+            RuntimeError: If the package is not in the index of the device.
+        """
+        with self._lock:
+            devices = self._load()
+            entry = devices.get(uuid, {}).get(package)
+            if entry is None:
+                raise RuntimeError(f"Package {package} is not installed on device {uuid}")
+            entry.label = label
+            self._save(devices)
+
+    def forget(self, uuid: str):
+        """Removes the index of a device. Does nothing if it has none."""
+        with self._lock:
+            devices = self._load()
+            if devices.pop(uuid, None) is not None:
+                self._save(devices)
+
+
+def main(argv: List[str]):
+    if len(argv) < 2 or argv[1] not in ("list", "refresh", "launch", "label") or (
+            argv[1] == "launch" and len(argv) != 3) or (argv[1] == "label" and len(argv) != 4):
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+    import device_utils as utils
+
+    ip_address, command = argv[0], argv[1]
+    index = AppIndex()
+    try:
+        if command == "list":
+            for entry in index.apps(utils.device_uuid(ip_address)):
+                print(f"{entry.label}\t{entry.activity}")
+        elif command == "refresh":
+            changed = utils.refresh_app_index(ip_address, index)
+            print(f"{len(changed)} packages changed")
+        elif command == "launch":
+            print(f"Started {utils.launch_app(ip_address, argv[2], index)}")
+        else:
+            index.set_label(utils.device_uuid(ip_address), argv[2], argv[3])
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,20 @@
 #!/usr/bin/python3
 
-import subprocess
+from typing import List, Optional
+
+import connection_state
 import device_utils as utils
+import fleet
+from device_registry import DeviceRegistry
+
+# The ADB device status each settled connection state corresponds to
+CONNECTION_STATUSES = {
+    connection_state.AUTHORIZED: "device",
+    connection_state.UNAUTHORIZED: "unauthorized",
+    connection_state.OFFLINE: "offline",
+}
 
-def auto_pair_to_device(address: str):
+def auto_pair_to_device(address: str) -> str:
     """Attempts to silently connect to a Cast-enabled device at the given IP address.
 
     The connection should succeed only if the Cast-enabled device has previously
@@ -12,20 +23,78 @@ def auto_pair_to_device(address: str):
 
     Args:
         address: The IPv4 address of the Google Cast-enabled device.
+
+    Returns:
+        The connection status of the device after the attempt: 'device', 'unauthorized' or 'offline'.
+
+    Raises:
+        RuntimeError: If the device could not be reached at all.
     """
-    utils.connect_to_cast_device(address, quiet_connect=True)
-    connection_status = utils.get_device_status(address)
-
-    if connection_status == "device":
-        print(f"Connected to Google Cast-enabled device at {address}!")
-    elif connection_status == "unauthorized":
-        print(f"Connection to Google Cast-enabled device at {address} is unauthorized. Forgetting device...")
-        subprocess.run(f"adb disconnect {address}", shell=True)
-    elif connection_status == "offline":
-        print("Unable to connect to Google Cast-enabled device.")
-    else:
-        raise NotImplementedError(f"Handling of unknown connection status: {connection_status} not yet implemented.")
+    connection = utils.establish_connection(address)
+
+    if connection.state == connection_state.UNAUTHORIZED:
+        # The device does not remember the host; forget it too rather than leave a pending prompt
+        utils.disconnect_from_device(address)
+    elif connection.state not in CONNECTION_STATUSES:
+        raise RuntimeError(f"Unable to connect to Google Cast-enabled device at {address}: "
+                           f"{connection.outcome.output if connection.outcome else connection.status}")
+
+    return CONNECTION_STATUSES[connection.state]
+
+
+def is_paired(result: fleet.DeviceResult) -> bool:
+    """Checks whether auto-pairing left the device connected and authorized."""
+    return result.ok and result.value == "device"
+
+
+def auto_pair_to_all_devices(registry: Optional[DeviceRegistry] = None) -> List[fleet.DeviceResult]:
+    """Auto-pairs to every known and discovered Cast-enabled device at once.
+
+    Devices in the registry are tried at their last known IP address first. The local network
+    is only searched if no device is known yet or a known device could not be reached there,
+    in which case the registry is refreshed with the addresses found.
+
+    Args:
+        registry: The registry of known devices. Defaults to the registry at REGISTRY_PATH.
+
+    Returns:
+        The outcome of auto-pairing to each device.
+    """
+    registry = registry or DeviceRegistry()
+
+    known_devices = registry.devices()
+    known_results = fleet.run_on_devices(auto_pair_to_device, [device.ip_address for device in known_devices])
+    for device, result in zip(known_devices, known_results):
+        if is_paired(result):
+            registry.remember(device.uuid, device.ip_address)
+
+    if known_devices and all(is_paired(result) for result in known_results):
+        return known_results
+
+    paired_addresses = {result.ip_address for result in known_results if is_paired(result)}
+    discovered_devices = [device for device in utils.find_cast_devices()
+                          if device.ip_address not in paired_addresses]
+    discovered_results = fleet.run_on_devices(auto_pair_to_device,
+                                              [device.ip_address for device in discovered_devices])
+    for device, result in zip(discovered_devices, discovered_results):
+        if is_paired(result):
+            registry.remember(device.uuid, device.ip_address, device.friendly_name)
+
+    discovered_uuids = {device.uuid for device in discovered_devices}
+    results = [result for result in known_results if is_paired(result)] + discovered_results + [
+        result for device, result in zip(known_devices, known_results)
+        if not is_paired(result) and device.uuid not in discovered_uuids]
+
+    return results
+
+
+def main():
+    results = auto_pair_to_all_devices()
+    if not results:
+        print("No Google Cast-enabled devices found on the local network.")
+        return
+    fleet.print_report(results)
+
 
 if __name__ == "__main__":
-    ip_address = utils.find_device_ip_address()
-    auto_pair_to_device(ip_address)
\ No newline at end of file
+    main()
@@ -0,0 +1,70 @@
+"""Compares the persistent adb shell keypress channel against one adb process per press.
+
+Runs against the fake adb binary in benchmarks/fake_toolchain, so no device is needed:
+
+    python3 benchmarks/bench_keypress.py --presses 200
+
+Latency is the time a single press blocks the caller (i.e. the GPIO callback thread).
+Throughput is measured until the fake device has run every keyevent.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from adb_shell_session import AdbShellSession  # noqa: E402
+
+FAKE_ADB = os.path.join(BENCHMARKS_DIR, "fake_toolchain", "adb")
+KEYCODE = "KEYCODE_DPAD_DOWN"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def bench_process_per_press(presses: int):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(presses):
+        t0 = time.perf_counter()
+        subprocess.run([FAKE_ADB, "shell", "input", "keyevent", KEYCODE])
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def bench_persistent_session(presses: int):
+    latencies = []
+    start = time.perf_counter()
+    session = AdbShellSession(adb_path=FAKE_ADB)
+    for _ in range(presses):
+        t0 = time.perf_counter()
+        session.send_keyevent(KEYCODE)
+        latencies.append(time.perf_counter() - t0)
+    session.close(timeout=60)
+    return latencies, time.perf_counter() - start
+
+
+def report(name, presses, latencies, elapsed):
+    print(f"{name:<24} {presses / elapsed:>10.1f} presses/s   "
+          f"p50 {statistics.median(latencies) * 1000:>8.3f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:>8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--presses", type=int, default=100)
+    args = parser.parse_args()
+
+    report("process per press", args.presses, *bench_process_per_press(args.presses))
+    report("persistent adb shell", args.presses, *bench_persistent_session(args.presses))
+
+
+if __name__ == "__main__":
+    main()
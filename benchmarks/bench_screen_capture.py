@@ -0,0 +1,91 @@
+"""Measures the throughput of the screen capture pipeline against canned framebuffers.
+
+A fake ADB server serves 1080p frames of a launcher with a focus highlight that moves
+every frame, so only a few tiles change between frames, like navigating a menu:
+
+    python3 benchmarks/bench_screen_capture.py --frames 50 --scale 4
+
+Reports frames per second with no frame rate cap, the bytes read from the device and sent
+on as tiles per frame, and the CPU time of the capturing thread per frame. With --full, the
+whole downscaled frame is sent every time, for comparison.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from adb_client import AdbClient  # noqa: E402
+from fake_adb_server import FakeAdbServer  # noqa: E402
+from screen_capture import ScreenCapture  # noqa: E402
+
+SERIAL = "192.168.1.80:5555"
+WIDTH, HEIGHT = 1920, 1080
+CARD_WIDTH, CARD_HEIGHT = 320, 180
+
+
+def canned_frames(count: int):
+    """Builds screencap's raw RGBA output for frames with the highlight on each card in turn."""
+    header = struct.pack("<4I", WIDTH, HEIGHT, 1, 1)
+    background = bytes([16, 16, 24, 255]) * WIDTH
+    card = bytes([200, 200, 200, 255]) * CARD_WIDTH
+    frames = []
+    for index in range(count):
+        highlighted = index % (WIDTH // CARD_WIDTH)
+        rows = []
+        for y in range(HEIGHT):
+            if 400 <= y < 400 + CARD_HEIGHT:
+                row = bytearray(background)
+                start = highlighted * CARD_WIDTH * 4
+                row[start:start + len(card)] = card
+                rows.append(bytes(row))
+            else:
+                rows.append(background)
+        frames.append(header + b"".join(rows))
+    return frames
+
+
+def bench(frames: int, scale: int, tile_size: int, full: bool):
+    canned = canned_frames(6)
+    served = iter(range(frames + 1))
+
+    with FakeAdbServer() as server:
+        server.set_device_state(SERIAL, "device")
+        server.exec_handler = lambda serial, command: canned[next(served) % len(canned)]
+        capture = ScreenCapture(SERIAL, AdbClient(port=server.port), scale=scale, max_fps=1000,
+                                tile_size=tile_size)
+        capture.capture()  # The first frame is a keyframe either way
+
+        raw_bytes = tile_bytes = 0
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        for _ in range(frames):
+            if full:
+                capture.differ.reset()
+            update = capture.capture()
+            raw_bytes += update.raw_bytes
+            tile_bytes += update.tile_bytes
+        elapsed = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+
+    print(f"{'full frames' if full else 'changed tiles':<14} {frames / elapsed:>7.1f} fps   "
+          f"read {raw_bytes / frames / 1e6:>6.2f} MB/frame   sent {tile_bytes / frames / 1e3:>8.1f} kB/frame   "
+          f"cpu {cpu / frames * 1000:>6.2f} ms/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--scale", type=int, default=4)
+    parser.add_argument("--tile-size", type=int, default=16)
+    args = parser.parse_args()
+
+    bench(args.frames, args.scale, args.tile_size, full=True)
+    bench(args.frames, args.scale, args.tile_size, full=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""A stand-in for the Chromecasts on the network, used by the benchmarks.
+
+Answers every mDNS query sent to it with a response recorded from a Chromecast, after
+--latency seconds. Point mdns_browser at it with CAST_REMOTE_MDNS_ADDRESS=127.0.0.1:PORT.
+The port it listens on is printed on the first line of stdout.
+
+Usage:
+    python3 mdns_responder.py [--port PORT] [--latency SECONDS]
+"""
+import argparse
+import socket
+import sys
+import time
+
+# Recorded from a Chromecast named 'Living Room TV' at 192.168.1.80
+RESPONSE = bytes.fromhex(
+    "0000840000010001000000030b5f676f6f676c6563617374045f746370056c6f63616c00000c0001c00c000c00010000"
+    "0078002e2b4368726f6d65636173742d3461356236633764386539663061316232633364346535663630373138323933"
+    "c00cc034001080010000119400932369643d346135623663376438653966306131623263336434653566363037313832"
+    "39330963643d41424344454603726d3d0576653d30350d6d643d4368726f6d65636173741269633d2f73657475702f69"
+    "636f6e2e706e6711666e3d4c6976696e6720526f6f6d2054560963613d3436353431330473743d300f62733d46413846"
+    "4341303030303030046e663d310372733dc0340021800100000078002d000000001f492434613562366337642d386539"
+    "662d306131622d326333642d346535663630373138323933c01dc11300018001000000780004c0a80150"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer mDNS queries like a Chromecast would.")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", args.port))
+    print(sock.getsockname()[1], flush=True)
+
+    while True:
+        _, sender = sock.recvfrom(9000)
+        if args.latency:
+            time.sleep(args.latency)
+        sock.sendto(RESPONSE, sender)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,280 @@
+"""Times the real discovery, connection, status, authorization and keypress code paths.
+
+Everything runs against the fake toolchain in benchmarks/fake_toolchain, so no device is
+needed: a fake `adb` and a fake `avahi-browse` are put first on PATH, a fake ADB server
+answers on a spare port and a fake Chromecast answers mDNS queries on loopback. Their
+latency and failure rate can be set from the command line.
+
+    python3 benchmarks/run_benchmarks.py --iterations 20 --output results.json
+    python3 benchmarks/run_benchmarks.py --baseline results.json --tolerance 0.25
+
+For each operation, reports the wall time, the number of processes spawned and the CPU time
+(this process and the processes it waited for) per call. With --baseline, exits with status
+1 if an operation got slower than the tolerance allows or spawns more processes than before.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+TOOLCHAIN_DIR = os.path.join(BENCHMARKS_DIR, "fake_toolchain")
+FAKE_ADB = os.path.join(TOOLCHAIN_DIR, "adb")
+MDNS_RESPONDER = os.path.join(TOOLCHAIN_DIR, "mdns_responder.py")
+DEVICE_IP = "192.168.1.80"  # The address in the mDNS response the fake Chromecast replays
+SPAWN_EVENTS = {"subprocess.Popen", "os.system", "os.posix_spawn", "os.fork"}
+
+sys.path.insert(0, REPO_DIR)
+
+_counting_spawns = False
+_spawns = 0
+
+
+def _count_spawns(event: str, args):
+    global _spawns
+    if _counting_spawns and event in SPAWN_EVENTS:
+        _spawns += 1
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(operation: Callable[[], object], iterations: int,
+            setup: Optional[Callable[[], object]] = None) -> Dict[str, float]:
+    """Runs an operation several times and summarizes its cost per call.
+
+    Args:
+        operation: The code path to time.
+        iterations: How many times to run it.
+        setup: Runs before every call, outside the measurement (e.g. to disconnect first).
+
+    Returns:
+        Wall time (p50, p99, mean), spawned processes and CPU time per call, and the number
+        of calls that raised.
+    """
+    global _counting_spawns, _spawns
+    wall_times: List[float] = []
+    spawns = 0
+    cpu = 0.0
+    errors = 0
+
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _spawns = 0
+            _counting_spawns = True
+            cpu_start = _cpu_seconds()
+            start = time.perf_counter()
+            try:
+                operation()
+            except (Exception, SystemExit):
+                errors += 1
+            wall_times.append(time.perf_counter() - start)
+            cpu += _cpu_seconds() - cpu_start
+            _counting_spawns = False
+            spawns += _spawns
+
+    wall_times.sort()
+    return {
+        "iterations": iterations,
+        "wall_p50": statistics.median(wall_times),
+        "wall_p99": wall_times[int(0.99 * (len(wall_times) - 1))],
+        "wall_mean": statistics.mean(wall_times),
+        "spawns_per_op": spawns / iterations,
+        "cpu_per_op": cpu / iterations,
+        "errors": errors,
+    }
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    adb_port = _free_port()
+    auth_port = _free_port()
+    os.environ["PATH"] = TOOLCHAIN_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(adb_port)
+    os.environ["FAKE_ADB_SPAWN_DELAY"] = str(args.spawn_delay)
+    os.environ["FAKE_ADB_LATENCY"] = str(args.adb_latency)
+    os.environ["FAKE_ADB_FAILURE_RATE"] = str(args.failure_rate)
+
+    responder = subprocess.Popen([sys.executable, MDNS_RESPONDER, "--latency", str(args.mdns_latency)],
+                                 stdout=subprocess.PIPE, text=True)
+    os.environ["CAST_REMOTE_MDNS_ADDRESS"] = f"127.0.0.1:{responder.stdout.readline().strip()}"
+    subprocess.run([FAKE_ADB, "start-server"], check=True, capture_output=True)
+    subprocess.run([FAKE_ADB, "start-server"], check=True, capture_output=True,
+                   env=dict(os.environ, ANDROID_ADB_SERVER_PORT=str(auth_port), FAKE_ADB_FAILURE_RATE="0",
+                            FAKE_ADB_AUTH_DELAY=str(args.auth_delay)))
+
+    # The environment above has to be in place before these are imported
+    import adb_client
+    import device_utils as utils
+    import discovery
+    import find_cast_device
+    from adb_shell_session import AdbShellSession
+
+    sys.addaudithook(_count_spawns)
+    adb = adb_client.default_client()
+    serial = f"{DEVICE_IP}:5555"
+
+    def disconnect():
+        with contextlib.suppress(adb_client.AdbError):
+            adb.disconnect(serial)
+        utils.invalidate_device_statuses()
+
+    def connect_unauthorized():
+        disconnect()
+        adb.connect(serial)
+
+    results = {}
+    try:
+        iterations = args.iterations
+        results["find_device_ip_address"] = measure(utils.find_device_ip_address, iterations)
+        results["discover_avahi"] = measure(
+            lambda: asyncio.run(discovery.AvahiBackend().discover(discovery.DISCOVERY_TIMEOUT)), iterations)
+        results["connect_to_cast_device"] = measure(lambda: utils.connect_to_cast_device(DEVICE_IP),
+                                                    iterations, setup=disconnect)
+        adb.connect(serial)
+        results["get_device_status"] = measure(lambda: utils.get_device_status(DEVICE_IP), iterations,
+                                               setup=utils.invalidate_device_statuses)
+        results["restart_adb_server"] = measure(utils.restart_adb_server, max(1, iterations // 4))
+
+        adb.port = auth_port
+        try:
+            results["wait_for_user_authentication"] = measure(
+                lambda: find_cast_device.wait_for_user_authentication_on_device(DEVICE_IP), iterations,
+                setup=connect_unauthorized)
+        finally:
+            adb.port = adb_port
+
+        with AdbShellSession(serial=serial) as session:
+            session.send_keyevent("KEYCODE_WAKEUP")
+            results["keypress_shell_session"] = measure(lambda: session.send_keyevent("KEYCODE_DPAD_DOWN"),
+                                                        iterations * 5)
+        results["keypress_process_per_press"] = measure(
+            lambda: subprocess.run(["adb", "-s", serial, "shell", "input", "keyevent", "KEYCODE_DPAD_DOWN"]),
+            iterations)
+
+        import gpio_input
+        gpio = gpio_input.SimulatedGpio()
+        buttons = gpio_input.ButtonInput(gpio, gpio_input.Keymap(), lambda pin: None, no_repeat=[22])
+        buttons.start()
+        clock = itertools.count()
+
+        def bouncing_press():
+            # A press and a release of the D-pad, both with contact bounce
+            timestamp = next(clock) * 0.2
+            gpio.press(22, timestamp=timestamp, bounces=3)
+            gpio.press(22, timestamp=timestamp + 0.1, bounces=2)
+            gpio.release(22, timestamp=timestamp + 0.1 + 0.005)
+
+        results["gpio_bouncing_press"] = measure(bouncing_press, iterations * 5)
+        buttons.close()
+    finally:
+        for port in (adb_port, auth_port):
+            subprocess.run([FAKE_ADB, "kill-server"], capture_output=True,
+                           env=dict(os.environ, ANDROID_ADB_SERVER_PORT=str(port), FAKE_ADB_SPAWN_DELAY="0"))
+        responder.terminate()
+        responder.wait()
+
+    return results
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                     tolerance: float) -> List[str]:
+    """Lists the operations that got slower than the tolerance allows or spawn more processes.
+
+    Args:
+        results: The results of this run, by operation.
+        baseline: The results of an earlier run, by operation.
+        tolerance: The allowed slowdown as a fraction of the baseline, e.g. 0.25 for 25%.
+
+    Returns:
+        A description of each regression found.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["wall_p50"] > before["wall_p50"] * (1 + tolerance):
+            regressions.append(f"{name}: wall_p50 {before['wall_p50'] * 1000:.1f} ms -> "
+                               f"{result['wall_p50'] * 1000:.1f} ms")
+        if result["spawns_per_op"] > before["spawns_per_op"]:
+            regressions.append(f"{name}: spawns_per_op {before['spawns_per_op']:g} -> "
+                               f"{result['spawns_per_op']:g}")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]]):
+    print(f"{'operation':<30} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'spawns':>7} {'cpu ms':>8} {'errors':>7}")
+    for name, result in results.items():
+        print(f"{name:<30} {result['wall_p50'] * 1000:>9.2f} {result['wall_p99'] * 1000:>9.2f} "
+              f"{result['wall_mean'] * 1000:>9.2f} {result['spawns_per_op']:>7.2f} "
+              f"{result['cpu_per_op'] * 1000:>8.2f} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths against a fake adb and Chromecast.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--spawn-delay", type=float, default=0.05,
+                        help="Seconds each fake adb or avahi-browse process takes to start")
+    parser.add_argument("--adb-latency", type=float, default=0.001,
+                        help="Seconds the fake ADB server or avahi-daemon takes to answer each request")
+    parser.add_argument("--mdns-latency", type=float, default=0.01,
+                        help="Seconds the fake Chromecast takes to answer an mDNS query")
+    parser.add_argument("--auth-delay", type=float, default=0.1,
+                        help="Seconds the fake user takes to allow a new connection")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Fraction of connection attempts the fake device refuses, and of avahi-browse "
+                             "runs that cannot reach avahi-daemon")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_table(results)
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "baseline", "tolerance")},
+            "results": results,
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Turns raw button presses and releases into gestures: press, long press, double and triple press.
+
+A button without long or multi-press bindings reports "press" the moment it is pressed, so
+plain buttons keep their latency. Only buttons bound to a gesture wait to tell them apart.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+LONG_PRESS_SECONDS = 0.8
+MULTI_PRESS_WINDOW = 0.35
+_PRESS_COUNTS = {1: "press", 2: "double", 3: "triple"}
+
+
+class _ButtonState:
+    def __init__(self):
+        self.pressed_at: Optional[float] = None
+        self.presses = 0
+        self.long_fired = False
+        self.timer: Optional[threading.Timer] = None
+
+
+class GestureDetector:
+    """Recognizes gestures from press and release events, e.g. from GPIO edge callbacks.
+
+    Args:
+        on_gesture: Called with (button, gesture), where gesture is 'press', 'long', 'double'
+            or 'triple'. Called from the thread that reported the event or from a timer thread.
+        bindings: For each button, the gestures other than 'press' it is bound to.
+        long_press: Seconds a button has to be held for a long press.
+        multi_press_window: The longest gap in seconds between presses of a double or triple press.
+    """
+
+    def __init__(self, on_gesture: Callable[[int, str], None], bindings: Dict[int, Iterable[str]],
+                 long_press: float = LONG_PRESS_SECONDS, multi_press_window: float = MULTI_PRESS_WINDOW):
+        self.on_gesture = on_gesture
+        self.bindings = {button: set(gestures) for button, gestures in bindings.items()}
+        self.long_press = long_press
+        self.multi_press_window = multi_press_window
+        self._states: Dict[int, _ButtonState] = {}
+        self._lock = threading.Lock()
+
+    def _max_presses(self, button: int) -> int:
+        gestures = self.bindings.get(button, set())
+        return 3 if "triple" in gestures else 2 if "double" in gestures else 1
+
+    def pressed(self, button: int):
+        """Reports that a button went down."""
+        gestures = self.bindings.get(button)
+        if not gestures:
+            self.on_gesture(button, "press")
+            return
+
+        with self._lock:
+            state = self._states.setdefault(button, _ButtonState())
+            state.pressed_at = time.monotonic()
+            state.long_fired = False
+            self._cancel_timer(state)
+            if "long" in gestures:
+                state.timer = threading.Timer(self.long_press, self._long_press_elapsed, (button, state.pressed_at))
+                state.timer.daemon = True
+                state.timer.start()
+
+    def released(self, button: int):
+        """Reports that a button went up."""
+        if not self.bindings.get(button):
+            return
+
+        with self._lock:
+            state = self._states.get(button)
+            if state is None or state.pressed_at is None:
+                return
+            state.pressed_at = None
+            self._cancel_timer(state)
+            if state.long_fired:
+                state.long_fired = False
+                return
+
+            state.presses += 1
+            if state.presses >= self._max_presses(button):
+                gesture = self._take_presses(state)
+            else:
+                state.timer = threading.Timer(self.multi_press_window, self._window_elapsed, (button, state))
+                state.timer.daemon = True
+                state.timer.start()
+                return
+
+        self.on_gesture(button, gesture)
+
+    def _long_press_elapsed(self, button: int, pressed_at: float):
+        with self._lock:
+            state = self._states.get(button)
+            if state is None or state.pressed_at != pressed_at:
+                return
+            state.long_fired = True
+            state.presses = 0
+            state.timer = None
+        self.on_gesture(button, "long")
+
+    def _window_elapsed(self, button: int, state: _ButtonState):
+        with self._lock:
+            if state.pressed_at is not None or not state.presses:
+                return
+            state.timer = None
+            gesture = self._take_presses(state)
+        self.on_gesture(button, gesture)
+
+    @staticmethod
+    def _take_presses(state: _ButtonState) -> str:
+        gesture = _PRESS_COUNTS[state.presses]
+        state.presses = 0
+        return gesture
+
+    @staticmethod
+    def _cancel_timer(state: _ButtonState):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+
+    def close(self):
+        """Cancels any gesture still being timed."""
+        with self._lock:
+            for state in self._states.values():
+                self._cancel_timer(state)
@@ -0,0 +1,466 @@
+"""Volume, mute and playback control over the Cast v2 protocol, without going through ADB.
+
+`adb shell input keyevent KEYCODE_VOLUME_UP` starts Android's `input` tool on the device
+for every press. A Cast sender instead keeps one TLS connection to the device's Cast port
+(8009) and sends it small JSON requests, so a volume change costs one round trip, and
+several volume steps become a single request to set the level.
+
+Cast v2 messages are CastMessage protobufs, each preceded by its length as a 4-byte
+big-endian integer. Only the handful of fields this module needs are encoded, by hand, so
+no protobuf library (or pychromecast) is required.
+
+Usage:
+    python3 cast_control.py HOST status
+    python3 cast_control.py HOST volume LEVEL
+    python3 cast_control.py HOST mute|unmute|play-pause
+"""
+import itertools
+import json
+import socket
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import metrics
+
+CAST_PORT = 8009
+REQUEST_TIMEOUT = 5.0
+HEARTBEAT_INTERVAL = 5.0
+VOLUME_STEP = 0.05
+
+SENDER_ID = "sender-0"
+RECEIVER_ID = "receiver-0"
+NS_CONNECTION = "urn:x-cast:com.google.cast.tp.connection"
+NS_HEARTBEAT = "urn:x-cast:com.google.cast.tp.heartbeat"
+NS_RECEIVER = "urn:x-cast:com.google.cast.receiver"
+NS_MEDIA = "urn:x-cast:com.google.cast.media"
+
+# The keys that can be sent over Cast instead of ADB
+VOLUME_STEPS = {"KEYCODE_VOLUME_UP": 1, "KEYCODE_VOLUME_DOWN": -1}
+CAST_KEYCODES = {"KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN", "KEYCODE_VOLUME_MUTE", "KEYCODE_MUTE",
+                 "KEYCODE_MEDIA_PLAY_PAUSE", "KEYCODE_MEDIA_PLAY", "KEYCODE_MEDIA_PAUSE"}
+
+
+class CastError(RuntimeError):
+    """Raised when the device cannot be reached over Cast or refuses a request."""
+
+
+class NoMediaSessionError(CastError):
+    """Raised for a playback key when nothing is playing over Cast, e.g. in a native app."""
+
+
+@dataclass
+class CastMessage:
+    """The fields of a CastMessage protobuf used by this module."""
+    source_id: str
+    destination_id: str
+    namespace: str
+    payload_utf8: str
+
+
+def _encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _decode_varint(data: bytes, offset: int):
+    value = 0
+    for shift in itertools.count(0, 7):
+        if offset >= len(data):
+            raise CastError("Truncated Cast message")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+
+
+def encode_message(message: CastMessage) -> bytes:
+    """Serializes a CastMessage with a string payload (without the length prefix)."""
+    def string_field(number: int, value: str) -> bytes:
+        encoded = value.encode()
+        return _encode_varint(number << 3 | 2) + _encode_varint(len(encoded)) + encoded
+
+    return (_encode_varint(1 << 3) + _encode_varint(0)  # protocol_version = CASTV2_1_0
+            + string_field(2, message.source_id)
+            + string_field(3, message.destination_id)
+            + string_field(4, message.namespace)
+            + _encode_varint(5 << 3) + _encode_varint(0)  # payload_type = STRING
+            + string_field(6, message.payload_utf8))
+
+
+def decode_message(data: bytes) -> CastMessage:
+    """Parses a serialized CastMessage, skipping the fields this module does not use.
+
+    Raises:
+        CastError: If the message is malformed.
+    """
+    fields: Dict[int, str] = {}
+    offset = 0
+    while offset < len(data):
+        key, offset = _decode_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            _, offset = _decode_varint(data, offset)
+        elif wire_type == 2:
+            length, offset = _decode_varint(data, offset)
+            if offset + length > len(data):
+                raise CastError("Truncated Cast message")
+            if number in (2, 3, 4, 6):
+                fields[number] = data[offset:offset + length].decode(errors="replace")
+            offset += length
+        else:
+            raise CastError(f"Unsupported wire type {wire_type} in Cast message")
+    return CastMessage(fields.get(2, ""), fields.get(3, ""), fields.get(4, ""), fields.get(6, ""))
+
+
+def read_frame(sock: socket.socket) -> bytes:
+    """Reads one length-prefixed message from a Cast connection.
+
+    Raises:
+        socket.timeout: If no message started arriving within the socket's timeout.
+        ConnectionError: If the connection was closed.
+    """
+    received = 0
+
+    def read_exactly(size: int) -> bytes:
+        nonlocal received
+        data = b""
+        while len(data) < size:
+            try:
+                chunk = sock.recv(size - len(data))
+            except socket.timeout:
+                # Only give up between messages, never halfway through one
+                if received:
+                    continue
+                raise
+            if not chunk:
+                raise ConnectionResetError("Cast connection closed")
+            data += chunk
+            received += len(chunk)
+        return data
+
+    length, = struct.unpack(">I", read_exactly(4))
+    return read_exactly(length)
+
+
+def frame(message: CastMessage) -> bytes:
+    """Serializes a CastMessage with its length prefix, ready to be sent."""
+    encoded = encode_message(message)
+    return struct.pack(">I", len(encoded)) + encoded
+
+
+class CastConnection:
+    """A persistent Cast v2 connection to one device, reopened automatically when it drops.
+
+    A background thread reads replies and answers the device's heartbeats.
+
+    Args:
+        host: The IP address of the device.
+        port: The Cast port of the device.
+        timeout: The maximum time in seconds to connect or to wait for a reply.
+    """
+
+    def __init__(self, host: str, port: int = CAST_PORT, timeout: float = REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.receiver_status: dict = {}
+        self._sock = None
+        self._reader: Optional[threading.Thread] = None
+        self._send_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._pending: Dict[int, list] = {}
+        self._pending_lock = threading.Lock()
+        self._virtual_connections = set()
+
+    def __enter__(self) -> "CastConnection":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        import ssl
+
+        # Cast devices present certificates signed by Google's device CA, not a public one
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        try:
+            raw = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            try:
+                sock = context.wrap_socket(raw)
+            except OSError:
+                raw.close()
+                raise
+        except OSError as exc:
+            raise CastError(f"Unable to connect to Cast device at {self.host}: {exc}") from exc
+        sock.settimeout(HEARTBEAT_INTERVAL)
+
+        self._sock = sock
+        self._virtual_connections = set()
+        self._reader = threading.Thread(target=self._read_loop, args=(sock,), name=f"cast-{self.host}",
+                                        daemon=True)
+        self._reader.start()
+        try:
+            self._open_virtual_connection(RECEIVER_ID)
+        except OSError as exc:
+            self._drop(sock)
+            raise CastError(f"Unable to connect to Cast device at {self.host}: {exc}") from exc
+        metrics.inc("cast_remote_cast_connects_total")
+
+    def _ensure_connected(self):
+        with self._connect_lock:
+            if self._sock is None:
+                self._connect()
+
+    def _open_virtual_connection(self, destination: str):
+        if destination not in self._virtual_connections:
+            self._send(NS_CONNECTION, destination, {"type": "CONNECT"})
+            self._virtual_connections.add(destination)
+
+    def _send(self, namespace: str, destination: str, payload: dict):
+        data = frame(CastMessage(SENDER_ID, destination, namespace, json.dumps(payload)))
+        with self._send_lock:
+            sock = self._sock
+            if sock is None:
+                raise ConnectionResetError("Cast connection closed")
+            sock.sendall(data)
+
+    def _read_loop(self, sock):
+        while True:
+            try:
+                message = decode_message(read_frame(sock))
+            except socket.timeout:
+                try:
+                    self._send(NS_HEARTBEAT, RECEIVER_ID, {"type": "PING"})
+                except OSError:
+                    break
+                continue
+            except (OSError, CastError):
+                break
+            self._dispatch(message)
+        self._drop(sock)
+
+    def _dispatch(self, message: CastMessage):
+        try:
+            payload = json.loads(message.payload_utf8)
+        except ValueError:
+            return
+
+        if message.namespace == NS_HEARTBEAT and payload.get("type") == "PING":
+            try:
+                self._send(NS_HEARTBEAT, message.source_id, {"type": "PONG"})
+            except OSError:
+                pass
+            return
+        if message.namespace == NS_CONNECTION and payload.get("type") == "CLOSE":
+            self._virtual_connections.discard(message.source_id)
+            return
+        if payload.get("type") == "RECEIVER_STATUS":
+            self.receiver_status = payload.get("status", {})
+
+        with self._pending_lock:
+            waiter = self._pending.pop(payload.get("requestId"), None)
+        if waiter is not None:
+            waiter.append(payload)
+            waiter[0].set()
+
+    def _drop(self, sock):
+        with self._send_lock:
+            if self._sock is sock:
+                self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        # Wake every request still waiting on this connection
+        with self._pending_lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for waiter in pending:
+            waiter[0].set()
+
+    def request(self, namespace: str, destination: str, payload: dict) -> dict:
+        """Sends a request and waits for the reply with the same request ID.
+
+        The request is sent again once on a fresh connection if the connection had dropped.
+
+        Raises:
+            CastError: If the device cannot be reached, does not answer in time, or reports an error.
+        """
+        for _ in range(2):
+            self._ensure_connected()
+            sock = self._sock
+            request_id = next(self._request_ids)
+            waiter = [threading.Event()]
+            with self._pending_lock:
+                self._pending[request_id] = waiter
+            try:
+                with metrics.timed("cast_remote_cast_request_seconds"):
+                    if destination != RECEIVER_ID:
+                        self._open_virtual_connection(destination)
+                    self._send(namespace, destination, dict(payload, requestId=request_id))
+                    answered = waiter[0].wait(self.timeout)
+            except OSError:
+                if sock is not None:
+                    self._drop(sock)
+                continue
+            finally:
+                with self._pending_lock:
+                    self._pending.pop(request_id, None)
+
+            if len(waiter) > 1:
+                reply = waiter[1]
+                if reply.get("type") in ("INVALID_REQUEST", "LOAD_FAILED", "LAUNCH_ERROR"):
+                    raise CastError(f"Cast device at {self.host} rejected {payload.get('type')}: "
+                                    f"{reply.get('reason', reply.get('type'))}")
+                return reply
+            if not answered:
+                raise CastError(f"Cast device at {self.host} did not answer {payload.get('type')} in time")
+            # Woken without a reply: the connection dropped, so try again on a new one
+        raise CastError(f"Lost the Cast connection to {self.host}")
+
+    def status(self) -> dict:
+        """Returns the receiver's status: volume and running applications."""
+        return self.request(NS_RECEIVER, RECEIVER_ID, {"type": "GET_STATUS"}).get("status", {})
+
+    def _volume(self) -> dict:
+        if not self.receiver_status.get("volume"):
+            self.status()
+        return self.receiver_status.get("volume", {})
+
+    def set_volume(self, level: float):
+        """Sets the volume to a level between 0 and 1."""
+        level = min(1.0, max(0.0, level))
+        self.request(NS_RECEIVER, RECEIVER_ID, {"type": "SET_VOLUME", "volume": {"level": level}})
+
+    def step_volume(self, steps: int):
+        """Moves the volume up (positive) or down (negative) by a number of steps, in one request."""
+        volume = self._volume()
+        step = volume.get("stepInterval") or VOLUME_STEP
+        self.set_volume(volume.get("level", 0.0) + steps * step)
+
+    def set_muted(self, muted: bool):
+        self.request(NS_RECEIVER, RECEIVER_ID, {"type": "SET_VOLUME", "volume": {"muted": muted}})
+
+    def toggle_muted(self):
+        self.set_muted(not self._volume().get("muted", False))
+
+    def _media_session(self):
+        applications = self.status().get("applications") or []
+        for application in applications:
+            if any(namespace.get("name") == NS_MEDIA for namespace in application.get("namespaces", [])):
+                transport = application["transportId"]
+                statuses = self.request(NS_MEDIA, transport, {"type": "GET_STATUS"}).get("status") or []
+                if statuses:
+                    return transport, statuses[0]
+        raise NoMediaSessionError(f"Nothing is playing on the Cast device at {self.host}")
+
+    def play_pause(self, play: Optional[bool] = None):
+        """Pauses or resumes what is playing. With play=None, toggles between the two.
+
+        Raises:
+            NoMediaSessionError: If nothing is playing over Cast.
+            CastError: If the device cannot be reached or refuses the request.
+        """
+        transport, session = self._media_session()
+        if play is None:
+            play = session.get("playerState") != "PLAYING"
+        self.request(NS_MEDIA, transport, {"type": "PLAY" if play else "PAUSE",
+                                           "mediaSessionId": session["mediaSessionId"]})
+
+    def send_keys(self, keycodes: Sequence[str]):
+        """Carries out keys from CAST_KEYCODES. Consecutive volume steps become one request.
+
+        Raises:
+            ValueError: If a key cannot be sent over Cast.
+            NoMediaSessionError: If a playback key was sent while nothing is playing over Cast.
+            CastError: If the device cannot be reached or refuses a request.
+        """
+        steps = 0
+        for keycode in list(keycodes) + [None]:
+            if keycode in VOLUME_STEPS:
+                steps += VOLUME_STEPS[keycode]
+                continue
+            if steps:
+                self.step_volume(steps)
+                steps = 0
+            if keycode is None:
+                break
+            if keycode in ("KEYCODE_VOLUME_MUTE", "KEYCODE_MUTE"):
+                self.toggle_muted()
+            elif keycode == "KEYCODE_MEDIA_PLAY_PAUSE":
+                self.play_pause()
+            elif keycode in ("KEYCODE_MEDIA_PLAY", "KEYCODE_MEDIA_PAUSE"):
+                self.play_pause(play=keycode == "KEYCODE_MEDIA_PLAY")
+            else:
+                raise ValueError(f"{keycode} cannot be sent over Cast")
+
+    def close(self):
+        """Closes the connection."""
+        with self._send_lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.sendall(frame(CastMessage(SENDER_ID, RECEIVER_ID, NS_CONNECTION, json.dumps({"type": "CLOSE"}))))
+            except OSError:
+                pass
+            sock.close()
+
+
+def split_cast_keys(keycodes: Sequence[str], cast_keycodes: Iterable[str]) -> List[Tuple[bool, List[str]]]:
+    """Splits keys into runs to send over Cast or over ADB, keeping their order.
+
+    Each run over Cast is one request to the device, so that if it fails only that run needs
+    to be sent over ADB instead: consecutive volume steps share a run, any other key over Cast
+    has a run of its own.
+
+    Returns:
+        A list of (over_cast, keycodes) pairs.
+    """
+    cast_keycodes = set(cast_keycodes)
+    runs: List[Tuple[bool, List[str]]] = []
+    for keycode in keycodes:
+        over_cast = keycode in cast_keycodes
+        if runs and runs[-1][0] == over_cast and (
+                not over_cast or (keycode in VOLUME_STEPS and runs[-1][1][-1] in VOLUME_STEPS)):
+            runs[-1][1].append(keycode)
+        else:
+            runs.append((over_cast, [keycode]))
+    return runs
+
+
+def main(argv: List[str]):
+    if len(argv) < 2 or argv[1] not in ("status", "volume", "mute", "unmute", "play-pause") or (
+            argv[1] == "volume" and len(argv) != 3):
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+    with CastConnection(argv[0]) as connection:
+        try:
+            if argv[1] == "status":
+                print(json.dumps(connection.status(), indent=2))
+            elif argv[1] == "volume":
+                connection.set_volume(float(argv[2]))
+            elif argv[1] in ("mute", "unmute"):
+                connection.set_muted(argv[1] == "mute")
+            else:
+                connection.play_pause()
+        except CastError as exc:
+            print(exc, file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
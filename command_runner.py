@@ -0,0 +1,145 @@
+"""The one place this project runs other programs.
+
+Commands are argv lists run directly, never through /bin/sh, and every call has a timeout.
+Output is returned to be parsed in Python, and a non-zero exit code raises CommandError
+unless the caller asks to check it itself.
+
+Every process started here is counted (see spawn_count()), so tests and benchmarks can
+assert how many processes an operation costs.
+"""
+import asyncio
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import metrics
+
+DEFAULT_TIMEOUT = 30.0
+
+_spawns = 0
+_spawns_lock = threading.Lock()
+
+
+class CommandError(RuntimeError):
+    """Raised when a command cannot be started, exits with a non-zero code or times out.
+
+    Attributes:
+        argv: The command that failed.
+        returncode: Its exit code, or None if it could not be started or timed out.
+        stderr: What it printed to standard error, if anything.
+    """
+
+    def __init__(self, message: str, argv: List[str], returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(message)
+        self.argv = argv
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+@dataclass
+class CommandResult:
+    """The outcome of a command that ran to completion."""
+    argv: List[str]
+    returncode: int
+    stdout: str
+    stderr: str
+    elapsed: float
+
+
+def spawn_count() -> int:
+    """Returns how many processes have been started through this module so far."""
+    return _spawns
+
+
+def _count_spawn(argv: List[str]):
+    global _spawns
+    with _spawns_lock:
+        _spawns += 1
+    metrics.inc("cast_remote_processes_spawned_total", command=os.path.basename(argv[0]))
+
+
+def _check(result: CommandResult) -> CommandResult:
+    if result.returncode != 0:
+        detail = result.stderr.strip() or result.stdout.strip()
+        raise CommandError(f"{' '.join(result.argv)} exited with code {result.returncode}"
+                           + (f": {detail}" if detail else ""), result.argv, result.returncode, result.stderr)
+    return result
+
+
+def run(argv: List[str], timeout: float = DEFAULT_TIMEOUT, check: bool = True,
+        input: Optional[str] = None) -> CommandResult:
+    """Runs a command to completion and captures its output.
+
+    Args:
+        argv: The program and its arguments, e.g. ['adb', 'start-server'].
+        timeout: The maximum time in seconds to let the command run. It is killed after that.
+        check: Whether to raise CommandError if the command exits with a non-zero code.
+        input: Text to write to the command's standard input.
+
+    Returns:
+        The exit code and output of the command.
+
+    Raises:
+        CommandError: If the command cannot be started, times out, or fails while check is set.
+    """
+    argv = list(argv)
+    _count_spawn(argv)
+    start = time.monotonic()
+    try:
+        completed = subprocess.run(argv, capture_output=True, text=True, timeout=timeout, input=input,
+                                   stdin=None if input is not None else subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        raise CommandError(f"{' '.join(argv)} timed out after {timeout} s", argv) from None
+    except OSError as exc:
+        raise CommandError(f"Unable to run {argv[0]}: {exc}", argv) from exc
+
+    result = CommandResult(argv, completed.returncode, completed.stdout, completed.stderr,
+                           time.monotonic() - start)
+    return _check(result) if check else result
+
+
+async def run_async(argv: List[str], timeout: float = DEFAULT_TIMEOUT, check: bool = True) -> CommandResult:
+    """The asyncio flavour of run(). Cancelling the caller kills the command."""
+    argv = list(argv)
+    _count_spawn(argv)
+    start = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+    except OSError as exc:
+        raise CommandError(f"Unable to run {argv[0]}: {exc}", argv) from exc
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise CommandError(f"{' '.join(argv)} timed out after {timeout} s", argv) from None
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    result = CommandResult(argv, process.returncode, stdout.decode(errors="replace"),
+                           stderr.decode(errors="replace"), time.monotonic() - start)
+    return _check(result) if check else result
+
+
+def popen(argv: List[str], **kwargs) -> subprocess.Popen:
+    """Starts a long-lived command, e.g. an interactive `adb shell`, without a shell in between.
+
+    Args:
+        argv: The program and its arguments.
+        **kwargs: Passed on to subprocess.Popen (e.g. stdin=subprocess.PIPE).
+
+    Raises:
+        CommandError: If the command cannot be started.
+    """
+    argv = list(argv)
+    _count_spawn(argv)
+    try:
+        return subprocess.Popen(argv, **kwargs)
+    except OSError as exc:
+        raise CommandError(f"Unable to run {argv[0]}: {exc}", argv) from exc
@@ -0,0 +1,200 @@
+"""Keeps the ADB connection to known Google Cast-enabled devices alive in the background.
+
+Each monitor sends a cheap keepalive over the device's existing ADB transport every few
+seconds. When the device stops answering (Wi-Fi dropped, TV went to sleep, ...), it
+reconnects with jittered exponential backoff. If the device cannot be reached at its last
+known address, the network is searched for its UUID in case its IP address changed.
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import adb_client
+import connection_state
+import device_utils as utils
+import event_log
+import metrics
+from device_registry import DeviceRegistry, KnownDevice
+
+KEEPALIVE_INTERVAL = 5.0
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float:
+    """Returns how long to wait before the given reconnection attempt (counting from 0).
+
+    The delay doubles with every attempt up to maximum, and is randomized between half and
+    all of that so that several monitors do not retry in lockstep.
+    """
+    ceiling = min(maximum, base * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class ConnectionMonitor:
+    """Watches the connection to one device from a background thread and restores it when lost.
+
+    Args:
+        device: The device to watch.
+        registry: Updated when the device is found at a new IP address.
+        interval: Seconds between keepalives while the device is connected.
+        backoff_base: Seconds to wait after the first failed reconnection attempt.
+        backoff_max: The longest wait between reconnection attempts.
+        on_change: Called with the monitor whenever the connection is lost or restored.
+    """
+
+    def __init__(self, device: KnownDevice, registry: Optional[DeviceRegistry] = None,
+                 interval: float = KEEPALIVE_INTERVAL, backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX, on_change: Optional[Callable[["ConnectionMonitor"], None]] = None):
+        self.device = device
+        self.registry = registry
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_change = on_change or (lambda monitor: None)
+
+        self.connected: Optional[bool] = None
+        self.down_since: Optional[float] = None
+        self.outages = 0
+        self.reconnect_attempts = 0
+        self.total_downtime = 0.0
+        self.last_downtime = 0.0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def serial(self) -> str:
+        return f"{self.device.ip_address}:5555"
+
+    def start(self):
+        """Starts watching the device."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"monitor-{self.device.ip_address}",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Stops watching the device."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_alive(self) -> bool:
+        """Sends a keepalive to the device over its ADB transport.
+
+        Returns:
+            True if the device answered.
+        """
+        try:
+            with metrics.timed("cast_remote_keepalive_seconds"):
+                adb_client.default_client().shell(self.serial, "echo")
+            return True
+        except (adb_client.AdbError, OSError):
+            return False
+
+    def _run(self):
+        attempt = 0
+        while True:
+            if self.is_alive():
+                if self.connected is not True:
+                    self._restored()
+                attempt = 0
+                delay = self.interval
+            else:
+                if self.connected is not False:
+                    self._lost()
+                if self._reconnect():
+                    self._restored()
+                    attempt = 0
+                    delay = self.interval
+                else:
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                    attempt += 1
+
+            if self._stop.wait(delay):
+                return
+
+    def _connect(self) -> str:
+        adb = adb_client.default_client()
+        try:
+            # An offline transport has to be dropped first, or connecting only reports it as already connected
+            if adb.get_state(self.serial) == "offline":
+                adb.disconnect(self.serial)
+        except (adb_client.AdbError, OSError):
+            pass
+        try:
+            outcome = adb.connect(self.serial)
+        except (adb_client.AdbError, OSError) as exc:
+            outcome = str(exc)
+        utils.invalidate_device_statuses()
+        return outcome
+
+    def _reconnect(self) -> bool:
+        self.reconnect_attempts += 1
+        metrics.inc("cast_remote_reconnect_attempts_total")
+        outcome = self._connect()
+        if self.is_alive():
+            return True
+
+        unreachable = connection_state.parse_connect_output(outcome).kind in connection_state.UNREACHABLE_OUTCOMES
+        if unreachable and self._rediscover():
+            self._connect()
+            return self.is_alive()
+        return False
+
+    def _rediscover(self) -> bool:
+        """Searches the network for the device's UUID and follows it if its IP address changed.
+
+        Returns:
+            True if the device was found at a new IP address.
+        """
+        # Devices found by the subnet sweep have no UUID to follow, so only mDNS is worth asking
+        for service in utils.find_cast_devices(sweep=False):
+            if service.uuid == self.device.uuid and service.ip_address != self.device.ip_address:
+                event_log.record(event_log.STATUS_CHANGE, ip_address=service.ip_address, uuid=self.device.uuid,
+                                 previous_ip_address=self.device.ip_address, state="moved")
+                self.device = KnownDevice(self.device.uuid, service.ip_address,
+                                          self.device.friendly_name, self.device.last_success)
+                if self.registry is not None:
+                    self.device = self.registry.remember(self.device.uuid, self.device.ip_address)
+                metrics.inc("cast_remote_ip_changes_total")
+                return True
+        return False
+
+    def _lost(self):
+        self.connected = False
+        self.down_since = time.monotonic()
+        metrics.inc("cast_remote_connection_lost_total")
+        event_log.record(event_log.STATUS_CHANGE, ip_address=self.device.ip_address, uuid=self.device.uuid,
+                         state="lost")
+        self.on_change(self)
+
+    def _restored(self):
+        if self.down_since is not None:
+            self.last_downtime = time.monotonic() - self.down_since
+            self.total_downtime += self.last_downtime
+            self.outages += 1
+            self.down_since = None
+            metrics.observe("cast_remote_downtime_seconds", self.last_downtime)
+            event_log.record(event_log.STATUS_CHANGE, ip_address=self.device.ip_address, uuid=self.device.uuid,
+                             state="restored", downtime=self.last_downtime)
+        self.connected = True
+        self.on_change(self)
+
+    def report(self) -> Dict[str, object]:
+        """Returns the connection health of the device, with downtimes in seconds."""
+        down_for = time.monotonic() - self.down_since if self.down_since is not None else 0.0
+        return {
+            "uuid": self.device.uuid,
+            "ip_address": self.device.ip_address,
+            "connected": bool(self.connected),
+            "down_for": down_for,
+            "outages": self.outages,
+            "last_downtime": self.last_downtime,
+            "total_downtime": self.total_downtime + down_for,
+            "reconnect_attempts": self.reconnect_attempts,
+        }
@@ -0,0 +1,181 @@
+"""The state of the ADB connection to a Google Cast-enabled device, as an explicit state machine.
+
+A connection goes through these states:
+
+    discovered --connect--> connecting --+--> authorized     (the device accepts ADB commands)
+                                         +--> unauthorized   (waiting for the user to allow it)
+                                         +--> offline        (the transport is there but dead)
+                                         +--> failed         (the device could not be reached)
+
+`adb connect` reports how the attempt went in free text, which varies between adb versions.
+parse_connect_output() turns it into one of a few outcomes. Only an 'already connected'
+outcome says nothing about authorization, so it is the only one that needs the device's
+status from the ADB server before the state is known.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import event_log
+
+# Connection states
+DISCOVERED = "discovered"
+CONNECTING = "connecting"
+UNAUTHORIZED = "unauthorized"
+AUTHORIZED = "authorized"
+OFFLINE = "offline"
+FAILED = "failed"
+SETTLED_STATES = {AUTHORIZED, UNAUTHORIZED, OFFLINE, FAILED}
+
+# Outcomes of `adb connect`
+CONNECTED = "connected"
+ALREADY_CONNECTED = "already_connected"
+AUTH_FAILED = "auth_failed"
+REFUSED = "refused"
+NO_ROUTE = "no_route"
+TIMED_OUT = "timed_out"
+INVALID_ADDRESS = "invalid_address"
+UNEXPECTED = "unexpected"
+UNREACHABLE_OUTCOMES = {REFUSED, NO_ROUTE, TIMED_OUT}
+
+# Checked in order, case-insensitively; the first pattern found in the output wins
+_OUTCOME_PATTERNS = [
+    (re.compile(r"already connected", re.IGNORECASE), ALREADY_CONNECTED),
+    (re.compile(r"failed to authenticate", re.IGNORECASE), AUTH_FAILED),
+    (re.compile(r"connection refused", re.IGNORECASE), REFUSED),
+    (re.compile(r"no route to host|network is unreachable|host is down", re.IGNORECASE), NO_ROUTE),
+    (re.compile(r"timed out|timeout", re.IGNORECASE), TIMED_OUT),
+    (re.compile(r"failed to resolve|cannot resolve|name or service not known|bad address|invalid",
+                re.IGNORECASE), INVALID_ADDRESS),
+    (re.compile(r"^\s*connected to ", re.IGNORECASE), CONNECTED),
+]
+
+# The device statuses reported by the ADB server, as events of the state machine
+DEVICE = "device"
+MISSING = "missing"
+UNEXPECTED_STATUS = "unexpected_status"
+_STATUS_EVENTS = {
+    "device": DEVICE,
+    "unauthorized": UNAUTHORIZED,
+    "authorizing": UNAUTHORIZED,
+    "offline": OFFLINE,
+    # The transport is still doing its handshake; its status is known once it finishes
+    "connecting": CONNECTING,
+    "missing": MISSING,
+}
+
+CONNECT = "connect"
+
+TRANSITIONS: Dict[Tuple[str, str], str] = {
+    (CONNECTING, CONNECTED): AUTHORIZED,
+    (CONNECTING, ALREADY_CONNECTED): CONNECTING,
+    (CONNECTING, AUTH_FAILED): UNAUTHORIZED,
+    (CONNECTING, REFUSED): FAILED,
+    (CONNECTING, NO_ROUTE): FAILED,
+    (CONNECTING, TIMED_OUT): FAILED,
+    (CONNECTING, INVALID_ADDRESS): FAILED,
+    (CONNECTING, UNEXPECTED): FAILED,
+}
+for _state in (DISCOVERED, CONNECTING, UNAUTHORIZED, AUTHORIZED, OFFLINE, FAILED):
+    TRANSITIONS[(_state, CONNECT)] = CONNECTING
+for _state in (CONNECTING, UNAUTHORIZED, AUTHORIZED, OFFLINE):
+    TRANSITIONS.update({
+        (_state, DEVICE): AUTHORIZED,
+        (_state, CONNECTING): CONNECTING,
+        (_state, UNAUTHORIZED): UNAUTHORIZED,
+        (_state, OFFLINE): OFFLINE,
+        # The transport went away, e.g. the device dropped off the network
+        (_state, MISSING): OFFLINE,
+        (_state, UNEXPECTED_STATUS): FAILED,
+    })
+
+
+@dataclass
+class ConnectOutcome:
+    """What `adb connect` reported.
+
+    Attributes:
+        kind: One of CONNECTED, ALREADY_CONNECTED, AUTH_FAILED, REFUSED, NO_ROUTE, TIMED_OUT,
+            INVALID_ADDRESS or UNEXPECTED.
+        output: The text adb printed, stripped.
+    """
+    kind: str
+    output: str
+
+
+def parse_connect_output(output: str) -> ConnectOutcome:
+    """Classifies the output of `adb connect`, whatever the adb version and the address in it."""
+    output = output.strip()
+    for pattern, kind in _OUTCOME_PATTERNS:
+        if pattern.search(output):
+            return ConnectOutcome(kind, output)
+    return ConnectOutcome(UNEXPECTED, output)
+
+
+def status_event(status: str) -> str:
+    """Returns the event for a device status reported by the ADB server (e.g. 'device')."""
+    return _STATUS_EVENTS.get(status, UNEXPECTED_STATUS)
+
+
+@dataclass
+class ConnectionStateMachine:
+    """Follows the connection to one device from the outcomes and statuses reported by adb.
+
+    Attributes:
+        ip_address: The IP address of the device.
+        state: The current state, e.g. AUTHORIZED.
+        outcome: The outcome of the last connection attempt, if any.
+        status: The last device status reported by the ADB server, if any.
+        history: Every transition so far, as (state, event, new state).
+    """
+    ip_address: str
+    state: str = DISCOVERED
+    outcome: Optional[ConnectOutcome] = None
+    status: Optional[str] = None
+    history: List[Tuple[str, str, str]] = field(default_factory=list)
+
+    def fire(self, event: str) -> str:
+        """Moves to the state the event leads to.
+
+        Returns:
+            The new state.
+
+        Raises:
+            ValueError: If the event cannot happen in the current state.
+        """
+        try:
+            new_state = TRANSITIONS[(self.state, event)]
+        except KeyError:
+            raise ValueError(f"Unexpected {event} while {self.state}") from None
+        self.history.append((self.state, event, new_state))
+        event_log.record(event_log.STATUS_CHANGE, ip_address=self.ip_address, previous=self.state, event=event,
+                         state=new_state)
+        self.state = new_state
+        return new_state
+
+    def connecting(self) -> str:
+        """Records that a connection attempt started."""
+        self.outcome = None
+        return self.fire(CONNECT)
+
+    def connect_output(self, output: str) -> str:
+        """Records the output of `adb connect`."""
+        self.outcome = parse_connect_output(output)
+        event_log.record(event_log.CONNECT_OUTCOME, ip_address=self.ip_address, outcome=self.outcome.kind,
+                         output=self.outcome.output)
+        return self.fire(self.outcome.kind)
+
+    def device_status(self, status: str) -> str:
+        """Records the status of the device reported by the ADB server."""
+        self.status = status
+        return self.fire(status_event(status))
+
+    @property
+    def needs_status(self) -> bool:
+        """Whether the outcome of the connection attempt does not tell the state by itself."""
+        return self.state == CONNECTING and self.outcome is not None
+
+    @property
+    def settled(self) -> bool:
+        """Whether the state is known: authorized, unauthorized, offline or failed."""
+        return self.state in SETTLED_STATES
@@ -0,0 +1,196 @@
+"""A thin client for the controller daemon (see controller_daemon.py).
+
+Usage:
+    python3 controller_client.py key KEYCODE [DEVICE_IP]
+    python3 controller_client.py macro NAME [DEVICE_IP]
+    python3 controller_client.py launch APP [DEVICE_IP]
+    python3 controller_client.py broadcast GROUP KEYCODE [KEYCODE ...]
+    python3 controller_client.py broadcast GROUP --macro NAME
+    python3 controller_client.py status [DEVICE_IP]
+    python3 controller_client.py pair
+    python3 controller_client.py devices
+    python3 controller_client.py health
+    python3 controller_client.py events [COUNT] [KIND]
+"""
+import json
+import os
+import socket
+import sys
+import threading
+from typing import List, Optional, Sequence
+
+SOCKET_PATH = os.environ.get("CAST_REMOTE_SOCKET", "/tmp/adb-cast-remote.sock")
+
+
+class ControllerClient:
+    """Sends requests to the controller daemon over one persistent Unix socket connection.
+
+    The connection is reopened automatically if the daemon was restarted.
+
+    Args:
+        socket_path: Where the daemon listens.
+        timeout: The maximum time in seconds to wait for a reply.
+    """
+
+    def __init__(self, socket_path: str = SOCKET_PATH, timeout: Optional[float] = 120):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+            self._reader = None
+
+    def request(self, command: str, **fields) -> dict:
+        """Sends a request to the daemon and returns its reply.
+
+        Raises:
+            ConnectionError: If the daemon is not running or closed the connection.
+            TimeoutError: If the daemon did not reply in time. The request may still be carried out.
+            RuntimeError: If the daemon could not carry out the request.
+        """
+        line = json.dumps(dict(fields, command=command)).encode() + b"\n"
+
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(line)
+                    reply = self._reader.readline()
+                    if not reply:
+                        raise ConnectionResetError("Controller daemon closed the connection")
+                    break
+                except OSError as exc:
+                    # After a timeout the reader cannot be used again, and a late reply would be
+                    # taken for the answer to the next request, so start over on a new connection
+                    self._close()
+                    if not isinstance(exc, (ConnectionError, FileNotFoundError)):
+                        raise
+                    if attempt == 1 or isinstance(exc, FileNotFoundError):
+                        raise ConnectionError(f"Controller daemon is not running at {self.socket_path}") from exc
+
+        reply = json.loads(reply)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "Unknown error"))
+        return reply
+
+    def send_key(self, keycode: str, device: Optional[str] = None):
+        """Sends a keyevent (e.g. 'KEYCODE_HOME') through the daemon."""
+        self.send_keys([keycode], device)
+
+    def send_keys(self, keycodes: List[str], device: Optional[str] = None):
+        """Sends several keyevents through the daemon, run on the device as a single command."""
+        fields = {"keycodes": list(keycodes)}
+        if device:
+            fields["device"] = device
+        self.request("key", **fields)
+
+    def run_macro(self, name: str, device: Optional[str] = None):
+        """Runs a macro (see macros.py) through the daemon."""
+        fields = {"name": name}
+        if device:
+            fields["device"] = device
+        self.request("macro", **fields)
+
+    def launch_app(self, app: str, device: Optional[str] = None) -> str:
+        """Starts an app by name (e.g. 'netflix') through the daemon.
+
+        Returns:
+            The activity that was started.
+        """
+        fields = {"app": app}
+        if device:
+            fields["device"] = device
+        return self.request("launch", **fields)["activity"]
+
+    def broadcast(self, group: str, keycodes: Sequence[str] = (), macro: Optional[str] = None) -> dict:
+        """Sends keyevents or a macro to every device of a group (see device_groups.py) at once.
+
+        Returns:
+            The daemon's reply, with the outcome on each device ("results") and the time in
+            seconds between sending to the first and the last device ("skew").
+        """
+        fields = {"group": group}
+        if macro:
+            fields["macro"] = macro
+        else:
+            fields["keycodes"] = list(keycodes)
+        return self.request("broadcast", **fields)
+
+    def events(self, count: Optional[int] = None, kind: Optional[str] = None) -> List[dict]:
+        """Returns the last events in the daemon's event log (see event_log.py), oldest first."""
+        fields = {}
+        if count:
+            fields["count"] = count
+        if kind:
+            fields["kind"] = kind
+        return self.request("events", **fields)["events"]
+
+
+def main(argv: List[str]):
+    if not argv or argv[0] not in ("key", "macro", "launch", "status", "pair", "devices", "health",
+                                   "broadcast", "events") or (
+            argv[0] == "events" and (len(argv) > 3 or len(argv) > 1 and not argv[1].isdigit())) or (
+            argv[0] in ("key", "macro", "launch") and len(argv) < 2) or (
+            argv[0] == "broadcast" and (len(argv) < 3 or argv[2] == "--macro" and len(argv) != 4)):
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+    client = ControllerClient()
+    command = argv[0]
+    fields = {}
+    if command == "broadcast":
+        fields["group"] = argv[1]
+        if argv[2] == "--macro":
+            fields["macro"] = argv[3]
+        else:
+            fields["keycodes"] = argv[2:]
+        argv = []
+    if command == "events":
+        if len(argv) > 1:
+            fields["count"] = int(argv[1])
+        if len(argv) > 2:
+            fields["kind"] = argv[2]
+        argv = []
+    if command in ("key", "macro", "launch"):
+        fields[{"key": "keycode", "macro": "name", "launch": "app"}[command]] = argv[1]
+        argv = argv[1:]
+    if len(argv) > 1:
+        fields["device"] = argv[1]
+
+    try:
+        reply = client.request(command, **fields)
+    except (ConnectionError, RuntimeError) as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        client.close()
+
+    reply.pop("ok")
+    if reply:
+        print(json.dumps(reply, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
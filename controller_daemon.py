@@ -0,0 +1,296 @@
+"""A long-running controller that owns discovery, the ADB connection and the keypress channel.
+
+GPIO buttons, command line tools and the boot-time service talk to it over a Unix domain
+socket instead of each starting Python, discovering devices and connecting from scratch.
+
+Requests and replies are single lines of JSON:
+    {"command": "key", "keycode": "KEYCODE_HOME"}      -> {"ok": true}
+    {"command": "key", "keycodes": ["KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_DOWN"]} -> {"ok": true}
+    {"command": "status"}                               -> {"ok": true, "statuses": {...}}
+    {"command": "pair"}                                 -> {"ok": true, "results": [...]}
+    {"command": "devices"}                              -> {"ok": true, "devices": [...]}
+    {"command": "health"}                               -> {"ok": true, "health": [...]}
+    {"command": "macro", "name": "netflix_second_row"}  -> {"ok": true}
+    {"command": "launch", "app": "netflix"}             -> {"ok": true, "activity": "com.netflix.ninja/..."}
+    {"command": "broadcast", "group": "bar", "keycodes": ["KEYCODE_SLEEP"]}
+                                                        -> {"ok": true, "results": [...], "skew": 0.002}
+    {"command": "events", "count": 20, "kind": "key_sent"} -> {"ok": true, "events": [...]}
+
+"key", "macro", "launch" and "status" accept an optional "device" (IP address) to target a
+single device. "launch" starts an app by name through the app index (see app_index).
+"broadcast" sends "keycodes" or the macro "macro" to every device of a group (see device_groups)
+at the same moment, and reports the outcome on each device and the skew between them.
+"health" reports, for each known device, whether it is connected and how long it was unavailable.
+"events" returns the last "count" events still in the daemon's event log, optionally only those
+of one "kind" (see event_log).
+
+Usage:
+    python3 controller_daemon.py [--socket PATH] [--metrics-port PORT]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+import auto_pair_to_cast_device
+import device_groups
+import device_utils as utils
+import event_log
+import metrics
+from adb_shell_session import AdbShellSession
+from connection_monitor import ConnectionMonitor
+from controller_client import SOCKET_PATH
+from device_registry import DeviceRegistry
+from macros import MacroConfig, load_config
+
+
+class AdbBackend:
+    """Carries out daemon commands on real devices through device_utils and adb shell sessions.
+
+    Args:
+        registry: The registry of known devices.
+        macros: The macros the "macro" command can run. Defaults to the macros in MACROS_PATH.
+        groups: The device groups the "broadcast" command can target. Defaults to the groups in
+            GROUPS_PATH.
+    """
+
+    def __init__(self, registry: Optional[DeviceRegistry] = None, macros: Optional[MacroConfig] = None,
+                 groups: Optional[Dict[str, List[str]]] = None):
+        self.registry = registry or DeviceRegistry()
+        self.macros = macros if macros is not None else load_config()
+        self.groups = groups if groups is not None else device_groups.load_groups()
+        # One persistent adb shell per device, shared by single-device commands and broadcasts
+        self.broadcaster = device_groups.Broadcaster()
+        self._monitors: Dict[str, ConnectionMonitor] = {}
+        self._monitors_lock = threading.Lock()
+
+    def start_monitors(self):
+        """Starts keeping every known device connected that is not watched yet."""
+        with self._monitors_lock:
+            for device in self.registry.devices():
+                if device.uuid not in self._monitors:
+                    monitor = self._monitors[device.uuid] = ConnectionMonitor(device, self.registry)
+                    monitor.start()
+
+    def health(self) -> List[dict]:
+        """Returns the connection health of every watched device."""
+        with self._monitors_lock:
+            return [monitor.report() for monitor in self._monitors.values()]
+
+    def list_devices(self) -> List[dict]:
+        """Returns every known device with its connection status."""
+        devices = self.registry.devices()
+        statuses = utils.get_device_statuses([device.ip_address for device in devices])
+        return [dict(asdict(device), status=statuses[device.ip_address]) for device in devices]
+
+    def status(self, ip_address: Optional[str] = None) -> Dict[str, str]:
+        """Returns the connection status of one device, or of every known device."""
+        ip_addresses = [ip_address] if ip_address else [device.ip_address for device in self.registry.devices()]
+        return utils.get_device_statuses(ip_addresses)
+
+    def pair(self) -> List[dict]:
+        """Auto-pairs to every known and discovered device."""
+        results = auto_pair_to_cast_device.auto_pair_to_all_devices(self.registry)
+        self.start_monitors()
+        return [asdict(result) for result in results]
+
+    def _default_device(self) -> str:
+        devices = self.registry.devices()
+        statuses = utils.get_device_statuses([device.ip_address for device in devices])
+        for device in devices:
+            if statuses[device.ip_address] == "device":
+                return device.ip_address
+        raise RuntimeError("No connected Google Cast-enabled device")
+
+    def _session(self, ip_address: Optional[str]) -> AdbShellSession:
+        return self.broadcaster.session(ip_address or self._default_device())
+
+    def send_keys(self, keycodes: List[str], ip_address: Optional[str] = None):
+        """Sends keyevents in a single command over a persistent adb shell to the device."""
+        self._session(ip_address).send_keyevents(keycodes)
+
+    def run_macro(self, name: str, ip_address: Optional[str] = None):
+        """Runs every step of a macro on the device as a single shell command."""
+        self._session(ip_address).send(self.macros.script(name))
+
+    def launch_app(self, app: str, ip_address: Optional[str] = None) -> str:
+        """Starts an app by name through the app index (see app_index).
+
+        Returns:
+            The activity that was started.
+        """
+        return utils.launch_app(ip_address or self._default_device(), app, registry=self.registry)
+
+    def broadcast(self, group: str, keycodes: Optional[List[str]] = None, macro: Optional[str] = None) -> dict:
+        """Sends keyevents or a macro to every device of a group at the same moment.
+
+        Returns:
+            The outcome on each device, the skew between the first and last device and the
+            time the broadcast took, both in seconds.
+        """
+        if bool(keycodes) == bool(macro):
+            raise RuntimeError("A broadcast needs either keycodes or a macro")
+        ip_addresses = device_groups.resolve_group(group, self.groups, self.registry)
+        if not ip_addresses:
+            raise RuntimeError(f"Device group {group} is empty")
+
+        command = self.macros.script(macro) if macro else "input keyevent " + " ".join(keycodes)
+        report = self.broadcaster.send(command, ip_addresses)
+        metrics.observe("cast_remote_broadcast_skew_seconds", report.skew)
+        return {"results": [asdict(result) for result in report.results], "skew": report.skew,
+                "elapsed": report.elapsed}
+
+    def close(self):
+        with self._monitors_lock:
+            for monitor in self._monitors.values():
+                monitor.stop()
+            self._monitors.clear()
+        self.broadcaster.close()
+
+
+class ControllerDaemon:
+    """Serves controller requests on a Unix domain socket.
+
+    Args:
+        backend: Carries out the commands, e.g. AdbBackend.
+        socket_path: Where to listen.
+    """
+
+    def __init__(self, backend, socket_path: str = SOCKET_PATH):
+        self.backend = backend
+        self.socket_path = socket_path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """Starts listening on socket_path.
+
+        Raises:
+            RuntimeError: If another daemon is already listening there.
+        """
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)  # Left behind by a daemon that did not stop cleanly
+            else:
+                raise RuntimeError(f"Another controller daemon is already listening on {self.socket_path}")
+            finally:
+                probe.close()
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is None:
+            return  # Never started, so the socket may belong to another daemon
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.handle_request(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, line: bytes) -> dict:
+        """Carries out a single JSON request and returns the reply."""
+        try:
+            request = json.loads(line)
+            command = request["command"]
+        except (ValueError, KeyError, TypeError):
+            return {"ok": False, "error": "Malformed request"}
+
+        try:
+            if command == "key":
+                keycodes = request["keycodes"] if "keycodes" in request else [request["keycode"]]
+                await asyncio.to_thread(self.backend.send_keys, keycodes, request.get("device"))
+                return {"ok": True}
+            if command == "status":
+                statuses = await asyncio.to_thread(self.backend.status, request.get("device"))
+                return {"ok": True, "statuses": statuses}
+            if command == "pair":
+                return {"ok": True, "results": await asyncio.to_thread(self.backend.pair)}
+            if command == "devices":
+                return {"ok": True, "devices": await asyncio.to_thread(self.backend.list_devices)}
+            if command == "macro":
+                await asyncio.to_thread(self.backend.run_macro, request["name"], request.get("device"))
+                return {"ok": True}
+            if command == "launch":
+                activity = await asyncio.to_thread(self.backend.launch_app, request["app"], request.get("device"))
+                return {"ok": True, "activity": activity}
+            if command == "broadcast":
+                reply = await asyncio.to_thread(self.backend.broadcast, request["group"],
+                                                request.get("keycodes"), request.get("macro"))
+                return dict(reply, ok=True)
+            if command == "health":
+                return {"ok": True, "health": self.backend.health()}
+            if command == "events":
+                events = event_log.recent(request.get("count"), request.get("kind"))
+                return {"ok": True, "events": [asdict(event) for event in events]}
+        except KeyError as exc:
+            return {"ok": False, "error": f"Missing field {exc}"}
+        except Exception as exc:
+            return {"ok": False, "error": str(exc)}
+
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+
+async def run(socket_path: str):
+    event_log.start()
+    backend = AdbBackend()
+    daemon = ControllerDaemon(backend, socket_path)
+
+    try:
+        await daemon.start()
+        backend.start_monitors()
+        print(f"Listening on {socket_path}")
+        await daemon.serve_forever()
+    finally:
+        await daemon.stop()
+        backend.close()
+        event_log.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Google Cast remote controller daemon.")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    try:
+        asyncio.run(run(args.socket))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
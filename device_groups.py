@@ -0,0 +1,170 @@
+"""Named groups of Google Cast-enabled devices, and sending one command to a whole group at once.
+
+Groups are defined in a JSON file (GROUPS_PATH). A member is an IP address, or the UUID or
+friendly name of a device in the registry:
+
+    {
+      "bar": ["192.168.1.80", "192.168.1.81"],
+      "lobby": ["Lobby Left", "Lobby Right", "4a5b6c7d8e9f0a1b2c3d4e5f60718293"]
+    }
+
+The group "all" is every device in the registry, unless the file defines it.
+
+Usage:
+    python3 device_groups.py list
+    python3 device_groups.py show GROUP
+"""
+import ipaddress
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Sequence
+
+import fleet
+from adb_shell_session import AdbShellSession
+from device_registry import DeviceRegistry
+
+GROUPS_PATH = os.environ.get("CAST_REMOTE_GROUPS", os.path.expanduser("~/.config/adb-cast-remote/groups.json"))
+ALL_DEVICES = "all"
+# How long a broadcast waits for the slowest shell to open, then for each device to confirm
+SYNC_TIMEOUT = 5.0
+CONFIRM_TIMEOUT = 5.0
+
+
+def load_groups(path: str = GROUPS_PATH) -> Dict[str, List[str]]:
+    """Reads the groups file. A missing file means no groups other than "all".
+
+    Raises:
+        ValueError: If the file is not valid JSON or a group is not a list of members.
+    """
+    try:
+        with open(path) as groups_file:
+            groups = json.load(groups_file)
+    except FileNotFoundError:
+        return {}
+
+    if not isinstance(groups, dict):
+        raise ValueError(f"{path} must map each group name to a list of devices")
+    for name, members in groups.items():
+        if not isinstance(members, list) or not all(isinstance(member, str) for member in members):
+            raise ValueError(f"Group {name!r} must be a list of IP addresses, UUIDs or device names")
+    return groups
+
+
+def _is_ip_address(member: str) -> bool:
+    try:
+        ipaddress.IPv4Address(member)
+    except ValueError:
+        return False
+    return True
+
+
+def resolve_group(name: str, groups: Dict[str, List[str]], registry: DeviceRegistry) -> List[str]:
+    """Returns the IP addresses of the members of a group, each once, in the order they are listed.
+
+    Raises:
+        RuntimeError: If there is no such group, or a member is not a known device.
+    """
+    devices = registry.devices()
+    if name not in groups:
+        if name == ALL_DEVICES:
+            return [device.ip_address for device in devices]
+        raise RuntimeError(f"Unknown device group: {name}")
+
+    by_name = {device.friendly_name: device.ip_address for device in devices if device.friendly_name}
+    by_uuid = {device.uuid: device.ip_address for device in devices}
+    ip_addresses = []
+    for member in groups[name]:
+        if _is_ip_address(member):
+            ip_address = member
+        elif member in by_uuid or member in by_name:
+            ip_address = by_uuid.get(member) or by_name[member]
+        else:
+            raise RuntimeError(f"Member {member!r} of group {name} is not a known device")
+        if ip_address not in ip_addresses:
+            ip_addresses.append(ip_address)
+    return ip_addresses
+
+
+class Broadcaster:
+    """Sends shell commands to several devices at once, over one persistent adb shell per device.
+
+    Args:
+        sync_timeout: The longest time in seconds to wait for the slowest device's shell to open
+            before sending to the others.
+        confirm_timeout: The longest time in seconds to wait for each device to confirm that it
+            ran the command. A device that does not is reported as failed.
+    """
+
+    def __init__(self, sync_timeout: float = SYNC_TIMEOUT, confirm_timeout: float = CONFIRM_TIMEOUT):
+        self.sync_timeout = sync_timeout
+        self.confirm_timeout = confirm_timeout
+        self._sessions: Dict[str, AdbShellSession] = {}
+        self._lock = threading.Lock()
+
+    def session(self, ip_address: str) -> AdbShellSession:
+        """Returns the shell of a device, creating it on first use."""
+        with self._lock:
+            session = self._sessions.get(ip_address)
+            if session is None:
+                session = self._sessions[ip_address] = AdbShellSession(serial=f"{ip_address}:5555")
+        return session
+
+    def send(self, command: str, ip_addresses: Sequence[str]) -> fleet.BroadcastReport:
+        """Runs a shell command on every device at the same moment.
+
+        The shells are opened first, so the command goes out to every device together instead
+        of waiting for each shell in turn. A device only counts as successful once it confirmed
+        that it ran the command.
+
+        Returns:
+            The outcome on each device and the skew between the first and last device.
+        """
+        return fleet.broadcast(lambda ip_address: self.session(ip_address).send(command, self.confirm_timeout),
+                               ip_addresses,
+                               prepare=lambda ip_address: self.session(ip_address).open(),
+                               sync_timeout=self.sync_timeout)
+
+    def send_keys(self, keycodes: List[str], ip_addresses: Sequence[str]) -> fleet.BroadcastReport:
+        """Sends keyevents to every device at the same moment, as one command per device."""
+        return self.send("input keyevent " + " ".join(keycodes), ip_addresses)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+def print_broadcast_report(report: fleet.BroadcastReport):
+    """Prints the outcome on each device and the skew between them."""
+    for result in report.results:
+        outcome = f"sent +{result.value * 1000:.1f} ms" if result.ok else f"FAILED: {result.error}"
+        print(f"{result.ip_address:<16} {outcome}")
+    failed = sum(not result.ok for result in report.results)
+    print(f"{len(report.results) - failed}/{len(report.results)} devices, skew {report.skew * 1000:.1f} ms, "
+          f"took {report.elapsed:.2f}s")
+
+
+def main(argv: List[str]):
+    groups = load_groups()
+    registry = DeviceRegistry()
+
+    if argv[:1] == ["list"]:
+        for name in sorted(set(groups) | {ALL_DEVICES}):
+            print(name)
+    elif argv[:1] == ["show"] and len(argv) == 2:
+        try:
+            for ip_address in resolve_group(argv[1], groups, registry):
+                print(ip_address)
+        except RuntimeError as exc:
+            print(exc, file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
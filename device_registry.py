@@ -0,0 +1,144 @@
+"""An on-disk registry of the Google Cast-enabled devices this host has connected to.
+
+Lets auto-pairing try the last known IP address of each device straight away at boot,
+and only fall back to discovering devices on the network when that fails.
+
+Usage:
+    python3 device_registry.py list
+    python3 device_registry.py remember UUID IP_ADDRESS [FRIENDLY_NAME]
+    python3 device_registry.py forget UUID
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+REGISTRY_PATH = os.environ.get("CAST_REMOTE_REGISTRY",
+                               os.path.expanduser("~/.config/adb-cast-remote/devices.json"))
+
+
+@dataclass
+class KnownDevice:
+    """A Google Cast-enabled device the host has connected to before.
+
+    Attributes:
+        uuid: The UUID the device advertises over mDNS.
+        ip_address: The IP address the device had the last time it was seen.
+        friendly_name: The name of the device, e.g. 'Living Room TV'.
+        last_success: When the host last connected to the device, in seconds since the epoch.
+    """
+    uuid: str
+    ip_address: str
+    friendly_name: str = ""
+    last_success: float = 0.0
+
+
+class DeviceRegistry:
+    """Reads and writes the registry file. Every write replaces the file atomically.
+
+    Args:
+        path: The path of the registry file.
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, KnownDevice]:
+        try:
+            with open(self.path) as registry_file:
+                entries = json.load(registry_file)
+            return {entry["uuid"]: KnownDevice(**entry) for entry in entries}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError, KeyError):
+            # A registry we cannot read is only a cache; start over rather than fail to pair
+            return {}
+
+    def _save(self, devices: Dict[str, KnownDevice]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".devices-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump([asdict(device) for device in devices.values()], temp_file, indent=2)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def devices(self) -> List[KnownDevice]:
+        """Returns every known device, most recently connected first."""
+        with self._lock:
+            devices = list(self._load().values())
+        return sorted(devices, key=lambda device: device.last_success, reverse=True)
+
+    def get(self, uuid: str) -> Optional[KnownDevice]:
+        """Returns the known device with the given UUID, if any."""
+        with self._lock:
+            return self._load().get(uuid)
+
+    def find_by_ip(self, ip_address: str) -> Optional[KnownDevice]:
+        """Returns the device most recently connected at the given IP address, if any.
+
+        After a DHCP lease change two entries can share an address. The one connected last is
+        the device there now.
+        """
+        devices = [device for device in self.devices() if device.ip_address == ip_address]
+        return devices[0] if devices else None
+
+    def remember(self, uuid: str, ip_address: str, friendly_name: str = "",
+                 last_success: Optional[float] = None) -> KnownDevice:
+        """Adds or refreshes a device after a successful connection.
+
+        Args:
+            uuid: The UUID of the device.
+            ip_address: The IP address the device was reached at.
+            friendly_name: The name of the device. Keeps the stored name if empty.
+            last_success: When the connection succeeded. Defaults to now.
+
+        Returns:
+            The stored entry.
+        """
+        with self._lock:
+            devices = self._load()
+            previous = devices.get(uuid)
+            device = KnownDevice(uuid=uuid, ip_address=ip_address,
+                                 friendly_name=friendly_name or (previous.friendly_name if previous else ""),
+                                 last_success=time.time() if last_success is None else last_success)
+            devices[uuid] = device
+            self._save(devices)
+        return device
+
+    def forget(self, uuid: str):
+        """Removes a device from the registry. Does nothing if it is not known."""
+        with self._lock:
+            devices = self._load()
+            if devices.pop(uuid, None) is not None:
+                self._save(devices)
+
+
+def main(argv: List[str]):
+    registry = DeviceRegistry()
+
+    if argv[:1] == ["list"]:
+        for device in registry.devices():
+            print(f"{device.uuid}\t{device.ip_address}\t{device.friendly_name}")
+    elif argv[:1] == ["remember"] and len(argv) in (3, 4):
+        registry.remember(*argv[1:])
+    elif argv[:1] == ["forget"] and len(argv) == 2:
+        registry.forget(argv[1])
+    else:
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
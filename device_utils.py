@@ -1,11 +1,89 @@
+"""Discovery, connection and status helpers for Google Cast-enabled devices.
+
+Each helper has an asyncio flavour (e.g. connect_to_cast_device_async) that bounds every
+request to the ADB server with a timeout and can be cancelled. The blocking functions run
+the asyncio flavour to completion, so they must not be called from a running event loop;
+await the asyncio flavour there instead.
+"""
+import asyncio
+import concurrent.futures
+import shlex
 import sys
-import subprocess
-from typing import Optional
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import adb_client
+import app_index
+import connection_state
+import event_log
+import mdns_browser
+import metrics
+import subnet_sweep
+from device_registry import DeviceRegistry
+
+# Status queries made within this many seconds of each other share one device table
+STATUS_CACHE_TTL = 0.5
+DEVICE_MISSING = "missing"
+DISCOVERY_TIMEOUT = 3.0
+CONNECT_TIMEOUT = 10.0
+# Devices found by the subnet sweep do not tell their Cast UUID; they are known by address instead
+SWEEP_UUID_PREFIX = "adb-"
+HANDSHAKE_POLL_INTERVAL = 0.2
+
+_status_cache_lock = threading.Lock()
+_status_cache_time = 0.0
+_status_cache: Optional[Dict[str, str]] = None
+# The device table query in flight, shared by every thread and event loop asking meanwhile
+_status_query: Optional[concurrent.futures.Future] = None
+_status_generation = 0
+
+
+async def find_cast_devices_async(timeout: float = DISCOVERY_TIMEOUT,
+                                  sweep: bool = True) -> List[mdns_browser.CastService]:
+    """The asyncio flavour of find_cast_devices()."""
+    with metrics.timed("cast_remote_discovery_seconds"):
+        devices = await mdns_browser.browse(timeout=timeout)
+    metrics.inc("cast_remote_discovery_outcomes_total", outcome="found" if devices else "none")
+    source = "mdns"
+
+    if not devices and sweep:
+        ip_addresses = await subnet_sweep.sweep()
+        metrics.inc("cast_remote_discovery_outcomes_total", outcome="sweep_found" if ip_addresses else "sweep_none")
+        devices = [mdns_browser.CastService(ip_address=ip_address, port=subnet_sweep.ADB_PORT,
+                                            uuid=SWEEP_UUID_PREFIX + ip_address, friendly_name="", instance_name="")
+                   for ip_address in ip_addresses]
+        source = "sweep"
+
+    for device in devices:
+        event_log.record(event_log.DISCOVERED, ip_address=device.ip_address, uuid=device.uuid,
+                         friendly_name=device.friendly_name, source=source)
+    return devices
+
+
+def find_cast_devices(sweep: bool = True) -> List[mdns_browser.CastService]:
+    """Fetches every Google Cast-enabled device connected to the local network.
+
+    If no device answers mDNS (e.g. the network filters multicast), the local subnet is swept
+    for devices with ADB over TCP instead. Those devices have no name, and their UUID is the
+    IP address prefixed with SWEEP_UUID_PREFIX.
+
+    Args:
+        sweep: Whether to sweep the subnet when no device answers mDNS.
+
+    Returns:
+        A list of the devices found, each with its IP address, UUID and friendly name.
+        The list is empty if no device was found.
+    """
+    return asyncio.run(find_cast_devices_async(sweep=sweep))
 
 
 def find_device_ip_address() -> str:
     """Fetches the IP address of a Google Cast-enabled device connected to the local network.
 
+    If no device answers mDNS (e.g. the network filters multicast), the local subnet is swept
+    for devices with ADB over TCP instead.
+
     Assumptions:
         Only one Google Cast-enabled device can be connected to the local network.
 
@@ -15,13 +93,7 @@ def find_device_ip_address() -> str:
     Raises:
         NotImplementedError: If multiple Google Cast-enabled devices are found (not yet supported).
     """
-    cmd = (
-        r"avahi-browse -rt _googlecast._tcp | "
-	    r"grep -E 'IPv4|address' | awk '{print $3}' | grep '\.' | "
-	    r"tr -d '[]'"
-    )
-    output = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    list_ip_addresses = output.stdout.splitlines()
+    list_ip_addresses = [service.ip_address for service in find_cast_devices()]
 
     if len(list_ip_addresses) == 0:
         print("No Google Cast-enabled devices found on the local network.")
@@ -36,20 +108,25 @@ def find_device_ip_address() -> str:
     return ip_address
 
 
+async def restart_adb_server_async():
+    """The asyncio flavour of restart_adb_server()."""
+    adb = adb_client.default_async_client()
+    await adb.kill_server()
+    await adb.start_server()
+    invalidate_device_statuses()
+
+
 def restart_adb_server():
     """Restarts the Android Debug Bridge (ADB) daemon.
 
     This is useful for refreshing the ADB connection, especially when
     devices are not detected, or ADB is behaving unexpectedly.
     """
-    cmd_kill_server = "adb kill-server"
-    cmd_start_server = "adb start-server"
+    asyncio.run(restart_adb_server_async())
 
-    subprocess.run(cmd_kill_server, shell=True)
-    subprocess.run(cmd_start_server, shell=True)
 
-
-def connect_to_cast_device(ip_address: str, quiet_connect: bool = False) -> Optional[bool]:
+def connect_to_cast_device(ip_address: str, quiet_connect: bool = False,
+                           timeout: float = CONNECT_TIMEOUT) -> Optional[bool]:
     """Connects to a Google Cast-enabled device on the local network.
 
     Sends the Android Debug Bridge (ADB) connection command to the Cast-enabled device.
@@ -61,6 +138,7 @@ def connect_to_cast_device(ip_address: str, quiet_connect: bool = False) -> Opti
         ip_address: The IP address of the Google Cast-enabled device.
         quiet_connect: A boolean indicating whether to suppress the authorization popup
                        on the device.
+        timeout: The maximum time in seconds to wait for the device to answer.
 
     Returns:
         A boolean indicating if the host has successfully connected to the device and the
@@ -68,45 +146,131 @@ def connect_to_cast_device(ip_address: str, quiet_connect: bool = False) -> Opti
         return None.
 
     Raises:
-        RuntimeError: If unable to connect to Cast-enabled device.
+        RuntimeError: If unable to connect to Cast-enabled device, it did not answer in time, or its
+                      connection stayed offline after reconnecting.
     """
-    if quiet_connect:
-        cmd = f"abd -a connect {ip_address}:5555"
-        subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return None
-    else:
-        cmd = f"adb connect {ip_address}:5555"
-        connection_outcome = subprocess.run(cmd, shell=True, capture_output=True, text=True).stdout.strip()
-        device_status = get_device_status(ip_address)
+    return asyncio.run(connect_to_cast_device_async(ip_address, quiet_connect, timeout))
 
-    if connection_outcome == f"connected to {ip_address}:5555":
-        print(f"Connected to device {ip_address}")
-        return True
 
-    if "already connected" in connection_outcome and device_status == "device":
-        print(f"Already connected to {ip_address}:5555")
-        return True
+async def establish_connection_async(ip_address: str,
+                                     timeout: float = CONNECT_TIMEOUT) -> connection_state.ConnectionStateMachine:
+    """Connects to a Google Cast-enabled device and works out the state of the connection.
 
-    if "already connected" in connection_outcome and device_status != "device":
-        print(f"Connection to device {ip_address} is unauthorized")
-        return False
+    The ADB server is only asked for the device's status when `adb connect` does not tell
+    whether the device authorized the host (i.e. it was already connected). A transport
+    still doing its handshake is followed until it finishes, and one that turns out to be
+    offline is dropped and connected again once.
 
-    if "failed to authenticate" in connection_outcome:
-        print(f"Failed to authenticate connection to device {ip_address}")
-        return False
+    Args:
+        ip_address: The IP address of the Google Cast-enabled device.
+        timeout: The maximum time in seconds to wait for each connection attempt.
+
+    Returns:
+        The state machine of the connection, settled in one of its final states unless the
+        handshake had not finished within the timeout.
+    """
+    adb = adb_client.default_async_client()
+    serial = f"{ip_address}:5555"
+    machine = connection_state.ConnectionStateMachine(ip_address)
+
+    for attempt in range(2):
+        machine.connecting()
+        try:
+            with metrics.timed("cast_remote_connect_seconds"):
+                machine.connect_output(await adb.connect(serial, timeout=timeout))
+        except TimeoutError:
+            machine.connect_output(f"timed out after {timeout} s")
+        finally:
+            invalidate_device_statuses()
+
+        if machine.needs_status:
+            await _follow_handshake(machine, timeout)
+        if machine.state != connection_state.OFFLINE or attempt:
+            break
+
+        # An offline transport has to be dropped first, or connecting only reports it as already connected
+        try:
+            await adb.disconnect(serial)
+        except adb_client.AdbError:
+            pass
+
+    return machine
+
+
+async def _follow_handshake(machine: connection_state.ConnectionStateMachine, timeout: float):
+    # A transport that is already connected may still be doing its handshake ('connecting')
+    deadline = time.monotonic() + timeout
+    while True:
+        machine.device_status(await get_device_status_async(machine.ip_address, missing_ok=True))
+        if machine.settled or time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(HANDSHAKE_POLL_INTERVAL)
+        invalidate_device_statuses()
+
+
+def establish_connection(ip_address: str, timeout: float = CONNECT_TIMEOUT) -> connection_state.ConnectionStateMachine:
+    """Blocking wrapper around establish_connection_async()."""
+    return asyncio.run(establish_connection_async(ip_address, timeout))
+
+
+def _connection_error(machine: connection_state.ConnectionStateMachine, timeout: float) -> RuntimeError:
+    ip_address = machine.ip_address
+    kind = machine.outcome.kind
+    if machine.state == connection_state.CONNECTING:
+        return RuntimeError(f"Device at {ip_address} was still connecting after {timeout} s")
+    if machine.state == connection_state.OFFLINE:
+        return RuntimeError(f"Device at {ip_address} is offline. Check if it is awake and connected to the "
+                            f"local network")
+    if machine.state != connection_state.FAILED or kind == connection_state.UNEXPECTED:
+        return RuntimeError(f"Unexpected connection outcome: {machine.outcome.output}")
+    if kind == connection_state.REFUSED:
+        return RuntimeError(f"Unable to connect to device at {ip_address}. Check if Developer Options and USB "
+                            f"Debugging is enabled on device.")
+    if kind == connection_state.NO_ROUTE:
+        return RuntimeError(f"Unable to connect to device at {ip_address}. Check if device is connected to the "
+                            f"local network")
+    if kind == connection_state.TIMED_OUT:
+        return RuntimeError(f"Timed out connecting to device at {ip_address} after {timeout} s")
+    if kind == connection_state.INVALID_ADDRESS:
+        return RuntimeError(f"{ip_address} is an invalid IP address")
+    return RuntimeError(f"Unexpected device status {machine.status} for device at {ip_address}")
+
+
+async def connect_to_cast_device_async(ip_address: str, quiet_connect: bool = False,
+                                       timeout: float = CONNECT_TIMEOUT) -> Optional[bool]:
+    """The asyncio flavour of connect_to_cast_device()."""
+    if quiet_connect:
+        adb = adb_client.default_async_client()
+        try:
+            with metrics.timed("cast_remote_connect_seconds"):
+                await adb.connect(f"{ip_address}:5555", timeout=timeout)
+        except TimeoutError:
+            raise RuntimeError(f"Timed out connecting to device at {ip_address} after {timeout} s") from None
+        finally:
+            invalidate_device_statuses()
+        return None
 
-    if connection_outcome == f"failed to connect to '{ip_address}:5555': Connection refused":
-        raise RuntimeError(f"Unable to connect to device at {ip_address}. Check if Developer Options and USB Debugging"
-                           f"is enabled on device.")
+    machine = await establish_connection_async(ip_address, timeout)
+    outcome = machine.outcome.kind
 
-    if connection_outcome == f"failed to connect to '{ip_address}:5555': No route to host":
-        raise RuntimeError(f"Unable to connect to device at {ip_address}. Check if device is connected to the local "
-                           f"network")
+    if machine.state == connection_state.AUTHORIZED:
+        if outcome == connection_state.ALREADY_CONNECTED:
+            metrics.inc("cast_remote_connect_outcomes_total", outcome="already_connected")
+        else:
+            metrics.inc("cast_remote_connect_outcomes_total", outcome="connected")
+        return True
 
-    if connection_outcome == f"failed to resolve host '{ip_address}': Name or service not known":
-        raise RuntimeError(f"{ip_address} is an invalid IP address")
+    if machine.state == connection_state.UNAUTHORIZED:
+        if outcome == connection_state.AUTH_FAILED:
+            metrics.inc("cast_remote_connect_outcomes_total", outcome="auth_failed")
+        else:
+            metrics.inc("cast_remote_connect_outcomes_total", outcome="unauthorized")
+        return False
 
-    raise RuntimeError(f"Unexpected connection outcome: {connection_outcome}")
+    metrics.inc("cast_remote_connect_outcomes_total",
+                outcome="offline" if machine.state == connection_state.OFFLINE else
+                "timeout" if outcome == connection_state.TIMED_OUT else outcome)
+    raise _connection_error(machine, timeout)
 
 
 def disconnect_from_device(ip_address: str):
@@ -115,13 +279,132 @@ def disconnect_from_device(ip_address: str):
     Args:
         ip_address: The IP address of the Google Cast-enabled device.
     """
-    output = subprocess.run(f'adb disconnect {ip_address}', shell=True,
-                            capture_output=True, text=True)
-    print(repr(output.stdout))
-    if "disconnect" in output.stdout:
-        print(f"Disconnected from device {ip_address}")
-    else:
+    asyncio.run(disconnect_from_device_async(ip_address))
+
+
+async def disconnect_from_device_async(ip_address: str):
+    """The asyncio flavour of disconnect_from_device()."""
+    try:
+        outcome = await adb_client.default_async_client().disconnect(ip_address)
+    except adb_client.AdbError:
+        outcome = ""
+    invalidate_device_statuses()
+
+    if "disconnect" not in outcome:
         raise RuntimeError(f"No such device {ip_address}")
+    event_log.record(event_log.STATUS_CHANGE, ip_address=ip_address, state="disconnected")
+
+
+def invalidate_device_statuses():
+    """Forgets the cached device table, e.g. after connecting to or disconnecting from a device."""
+    global _status_cache, _status_query, _status_generation
+    with _status_cache_lock:
+        _status_cache = None
+        # A query already in flight may predate the change, so later callers must not wait for it
+        _status_query = None
+        _status_generation += 1
+
+
+async def get_device_table_async(max_age: float = STATUS_CACHE_TTL) -> Dict[str, str]:
+    """The asyncio flavour of get_device_table()."""
+    global _status_cache, _status_cache_time, _status_query
+    with _status_cache_lock:
+        if _status_cache is not None and time.monotonic() - _status_cache_time <= max_age:
+            return dict(_status_cache)
+        query = _status_query
+        if query is None:
+            query = _status_query = concurrent.futures.Future()
+            generation = _status_generation
+        else:
+            generation = None
+
+    if generation is None:
+        # Shielded so that a cancelled caller does not cancel the query for everyone else
+        return dict(await asyncio.shield(asyncio.wrap_future(query)))
+
+    try:
+        with metrics.timed("cast_remote_status_query_seconds"):
+            table = dict(await adb_client.default_async_client().devices())
+    except BaseException as exc:
+        with _status_cache_lock:
+            if _status_query is query:
+                _status_query = None
+        query.set_exception(exc)
+        raise
+
+    with _status_cache_lock:
+        if _status_generation == generation:
+            _status_cache = table
+            _status_cache_time = time.monotonic()
+        if _status_query is query:
+            _status_query = None
+    query.set_result(table)
+    return dict(table)
+
+
+def get_device_table(max_age: float = STATUS_CACHE_TTL) -> Dict[str, str]:
+    """Fetches the connection status of every device known to the ADB server in a single query.
+
+    The result is cached for max_age seconds, so callers polling within the same tick (e.g. one
+    thread per device) share one query. Concurrent callers wait for the query in flight rather
+    than sending their own.
+
+    Args:
+        max_age: The oldest cached table, in seconds, that is still acceptable.
+
+    Returns:
+        A dictionary mapping each device serial (e.g. '192.168.1.80:5555') to its status.
+    """
+    return asyncio.run(get_device_table_async(max_age))
+
+
+async def get_device_statuses_async(ip_addresses: Iterable[str],
+                                    max_age: float = STATUS_CACHE_TTL) -> Dict[str, str]:
+    """The asyncio flavour of get_device_statuses()."""
+    statuses_by_ip = {}
+    for serial, state in (await get_device_table_async(max_age)).items():
+        statuses_by_ip.setdefault(serial.split(":")[0], state)
+
+    return {ip_address: statuses_by_ip.get(ip_address, DEVICE_MISSING) for ip_address in ip_addresses}
+
+
+def get_device_statuses(ip_addresses: Iterable[str], max_age: float = STATUS_CACHE_TTL) -> Dict[str, str]:
+    """Fetches the connection status of several Google Cast-enabled devices in a single query.
+
+    Args:
+        ip_addresses: The IPv4 addresses of the Google Cast-enabled devices.
+        max_age: The oldest cached device table, in seconds, that is still acceptable.
+
+    Returns:
+        A dictionary mapping each IP address to 'device', 'unauthorized', 'offline', or
+        'missing' if the ADB server does not know the device.
+    """
+    return asyncio.run(get_device_statuses_async(ip_addresses, max_age))
+
+
+def wait_for_device_state(ip_address: str, state: str = "device", timeout: float = 60) -> bool:
+    """Waits until a Google Cast-enabled device reaches the given connection status.
+
+    Follows the ADB server's stream of device changes, so it returns the moment the status
+    changes (e.g. the user allowed the connection) instead of on the next poll.
+
+    Args:
+        ip_address: The IPv4 address of the Google Cast-enabled device.
+        state: The status to wait for, e.g. 'device' once the device authorized the host.
+        timeout: The maximum time to wait, in seconds.
+
+    Returns:
+        True if the device reached the status, False if the timeout was reached first.
+    """
+    try:
+        for table in adb_client.default_client().track_devices(timeout=timeout):
+            if any(serial.split(":")[0] == ip_address and device_state == state
+                   for serial, device_state in table.items()):
+                invalidate_device_statuses()
+                return True
+    except TimeoutError:
+        return False
+    return False
 
 
 def get_device_status(ip_address: str) -> str:
@@ -136,19 +419,88 @@ def get_device_status(ip_address: str) -> str:
         ip_address: The IPv4 address of the Google Cast-enabled device.
 
     Returns:
-        The connection status of the device as a string, if found. Returns empty string if
-        the device was not found.
+        The connection status of the device as a string, if found.
 
     Raises:
         RuntimeError: If no device with the corresponding IP address was found.
     """
-    cmd = f"adb devices | grep {ip_address} | awk '{{print $2}}'"
-    output = subprocess.run(cmd, shell=True, capture_output=True,
-                            text=True)
+    return asyncio.run(get_device_status_async(ip_address))
+
 
-    device_status = output.stdout.strip()
+async def get_device_status_async(ip_address: str, missing_ok: bool = False) -> str:
+    """The asyncio flavour of get_device_status(). With missing_ok, returns 'missing' instead of raising."""
+    device_status = (await get_device_statuses_async([ip_address]))[ip_address]
 
-    if device_status == "":
+    if device_status == DEVICE_MISSING and not missing_ok:
         raise RuntimeError(f"No device with IP address {ip_address} found.")
 
-    return device_status
\ No newline at end of file
+    return device_status
+
+
+def _device_shell(ip_address: str):
+    serial = f"{ip_address}:5555"
+    return lambda command: adb_client.default_client().shell(serial, command)
+
+
+def device_uuid(ip_address: str, registry: Optional[DeviceRegistry] = None) -> str:
+    """Returns the UUID the device registry knows the device at an IP address by.
+
+    Raises:
+        RuntimeError: If no device in the registry has that IP address.
+    """
+    device = (registry or DeviceRegistry()).find_by_ip(ip_address)
+    if device is None:
+        raise RuntimeError(f"Device {ip_address} is not in the device registry; pair with it first")
+    return device.uuid
+
+
+def refresh_app_index(ip_address: str, index: Optional[app_index.AppIndex] = None,
+                      registry: Optional[DeviceRegistry] = None) -> List[str]:
+    """Brings the index of the apps installed on a device up to date (see app_index).
+
+    Only the packages installed or updated since the last refresh are queried.
+
+    Returns:
+        The packages that were added, updated or removed.
+
+    Raises:
+        RuntimeError: If the device is not in the registry or its packages cannot be listed.
+    """
+    index = index or app_index.AppIndex()
+    uuid = device_uuid(ip_address, registry)
+    with metrics.timed("cast_remote_app_index_refresh_seconds"):
+        return index.refresh(uuid, _device_shell(ip_address))
+
+
+def launch_app(ip_address: str, app: str, index: Optional[app_index.AppIndex] = None,
+               registry: Optional[DeviceRegistry] = None) -> str:
+    """Starts an app on a device by name, e.g. 'netflix', with a single `am start`.
+
+    The launcher activity comes from the app index, so a known app costs one command on the
+    device. The index is refreshed first if the app is not in it, and again if the activity
+    it remembers no longer exists.
+
+    Returns:
+        The activity that was started.
+
+    Raises:
+        RuntimeError: If the device is not in the registry, no installed app matches the name
+            or the app could not be started.
+    """
+    index = index or app_index.AppIndex()
+    uuid = device_uuid(ip_address, registry)
+    shell = _device_shell(ip_address)
+    entry = index.find(uuid, app)
+    for _ in range(2):
+        if entry is None:
+            index.refresh(uuid, shell)
+            entry = index.find(uuid, app)
+            if entry is None:
+                raise RuntimeError(f"No app matching {app!r} on device {ip_address}")
+        output = shell(f"am start -n {shlex.quote(entry.activity)}")
+        if "Error" not in output:
+            metrics.inc("cast_remote_app_launches_total")
+            return entry.activity
+        # The app was updated or removed since the index last saw it
+        entry = None
+    raise RuntimeError(f"Unable to start {app} on device {ip_address}: {output.strip()}")
@@ -1,27 +1,36 @@
-import pychromecast
-import asyncio
-from bleak import BleakScanner
+import sys
+
+
+# bleak is a heavy optional backend; it is only imported when the Bluetooth scan runs
+# (pychromecast is loaded lazily by discovery.PyChromecastBackend)
 
 async def find_chromecast_bluetooth():
+    from bleak import BleakScanner
+
     devices = await BleakScanner.discover(timeout=20)
     for d in devices:
         print(d)
 
 def find_chromecast():
-    chromecasts, browser = pychromecast.get_chromecasts()
-    browser.stop_discovery()
+    import discovery
 
-    for cast in chromecasts:
-        print("Friendly name:", cast.cast_info.friendly_name)
-        print("IP address: ", cast.cast_info.host)  # This will be used to connect to the Chromecast
-        print("UUID: ", cast.cast_info.uuid)  # This will be cached
+    casts = discovery.discover([discovery.PyChromecastBackend()])
+    for cast in casts:
+        print("Friendly name:", cast.friendly_name)
+        print("IP address: ", cast.ip_address)  # This will be used to connect to the Chromecast
+        print("UUID: ", cast.uuid)  # This will be cached
+    if not casts:
+        discovery.print_failures()
 
     return
 
 
 if __name__ == "__main__":
-    find_chromecast()
-    #asyncio.run(find_chromecast_bluetooth())
+    if "--bluetooth" in sys.argv[1:]:
+        import asyncio
+        asyncio.run(find_chromecast_bluetooth())
+    else:
+        find_chromecast()
 
 # Connecting for the first time:
 # - Press a button to connect for first time
@@ -0,0 +1,243 @@
+"""Finds Google Cast-enabled devices by racing several discovery backends against each other.
+
+Each backend finds devices its own way: the registry of known devices, this project's mDNS
+browser, avahi-browse, or pychromecast. They all run at once, and the first one to come back
+with a verified answer wins; the others are cancelled. Whichever backend is fastest on a
+given network therefore wins without any configuration.
+
+Usage:
+    python3 discovery.py [--timeout SECONDS] [--backend NAME ...]
+"""
+import asyncio
+import importlib.util
+import re
+import shutil
+import sys
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import command_runner
+import event_log
+import mdns_browser
+import metrics
+from device_registry import DeviceRegistry
+from mdns_browser import CastService
+
+DISCOVERY_TIMEOUT = 3.0
+CAST_PORT = 8009
+VERIFY_TIMEOUT = 0.5
+
+
+class DiscoveryBackend:
+    """A way of finding Google Cast-enabled devices.
+
+    Attributes:
+        name: A short name for reports and metrics, e.g. 'mdns'.
+        verified: Whether a device found by this backend is known to be on the network right
+            now. Answers from unverified backends (e.g. a cache) are checked before they win.
+    """
+    name = "backend"
+    verified = True
+
+    def is_available(self) -> bool:
+        """Checks whether the backend can run here, e.g. that its optional dependency is installed."""
+        return True
+
+    async def discover(self, timeout: float) -> List[CastService]:
+        """Finds devices, taking no longer than timeout seconds.
+
+        Returns:
+            The devices found. An empty list means none were found.
+        """
+        raise NotImplementedError
+
+
+class MdnsBackend(DiscoveryBackend):
+    """Queries the network with mdns_browser, returning as soon as a device answers."""
+    name = "mdns"
+
+    async def discover(self, timeout: float) -> List[CastService]:
+        return await mdns_browser.browse(timeout=timeout, first_only=True)
+
+
+class AvahiBackend(DiscoveryBackend):
+    """Asks avahi-daemon, which may already have the devices in its cache."""
+    name = "avahi"
+
+    def __init__(self, avahi_browse_path: str = "avahi-browse"):
+        self.avahi_browse_path = avahi_browse_path
+
+    def is_available(self) -> bool:
+        return shutil.which(self.avahi_browse_path) is not None
+
+    async def discover(self, timeout: float) -> List[CastService]:
+        result = await command_runner.run_async(
+            [self.avahi_browse_path, "--resolve", "--parsable", "--terminate", "_googlecast._tcp"], timeout=timeout)
+        return parse_avahi_browse(result.stdout)
+
+
+class PyChromecastBackend(DiscoveryBackend):
+    """Discovers devices with pychromecast, if it is installed."""
+    name = "pychromecast"
+
+    def is_available(self) -> bool:
+        return importlib.util.find_spec("pychromecast") is not None
+
+    async def discover(self, timeout: float) -> List[CastService]:
+        return await asyncio.to_thread(self._discover, timeout)
+
+    @staticmethod
+    def _discover(timeout: float) -> List[CastService]:
+        import pychromecast
+
+        cast_infos, browser = pychromecast.discovery.discover_chromecasts(timeout=timeout)
+        pychromecast.discovery.stop_discovery(browser)
+        return [cast_info_service(info) for info in cast_infos]
+
+
+def cast_info_service(info) -> CastService:
+    """Converts a pychromecast CastInfo, taking the instance name from its mDNS service if it has one."""
+    instance_names = sorted(service.name for service in info.services if hasattr(service, "name"))
+    return CastService(ip_address=info.host, port=info.port, uuid=str(info.uuid).replace("-", ""),
+                       friendly_name=info.friendly_name or "",
+                       instance_name=instance_names[0] if instance_names else "")
+
+
+class CacheBackend(DiscoveryBackend):
+    """Returns the devices in the registry, at the IP address each one last had."""
+    name = "cache"
+    verified = False
+
+    def __init__(self, registry: Optional[DeviceRegistry] = None):
+        self.registry = registry or DeviceRegistry()
+
+    async def discover(self, timeout: float) -> List[CastService]:
+        return [CastService(ip_address=device.ip_address, port=CAST_PORT, uuid=device.uuid,
+                            friendly_name=device.friendly_name, instance_name="")
+                for device in self.registry.devices()]
+
+
+def _unescape_avahi(value: str) -> str:
+    # avahi-browse --parsable escapes special characters in names as \DDD (decimal)
+    return re.sub(r"\\(\d{3})", lambda match: chr(int(match.group(1))), value)
+
+
+def parse_avahi_browse(output: str) -> List[CastService]:
+    """Parses the output of `avahi-browse --resolve --parsable --terminate _googlecast._tcp`.
+
+    Returns:
+        Each resolved IPv4 device once, in the order avahi listed them.
+    """
+    services = {}
+    for line in output.splitlines():
+        fields = line.split(";", 9)
+        if len(fields) < 10 or fields[0] != "=" or fields[2] != "IPv4":
+            continue
+        txt = dict(entry.split("=", 1) for entry in re.findall(r'"([^"]*)"', fields[9]) if "=" in entry)
+        uuid = txt.get("id", "")
+        if not uuid or uuid in services:
+            continue
+        services[uuid] = CastService(ip_address=fields[7], port=int(fields[8]), uuid=uuid,
+                                     friendly_name=txt.get("fn", ""),
+                                     instance_name=f"{_unescape_avahi(fields[3])}.{fields[4]}.{fields[5]}")
+    return list(services.values())
+
+
+async def is_reachable(service: CastService, timeout: float = VERIFY_TIMEOUT) -> bool:
+    """Checks that the device accepts connections on its Cast port."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(service.ip_address, service.port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def _run_backend(backend: DiscoveryBackend, timeout: float) -> Tuple[DiscoveryBackend, List[CastService]]:
+    try:
+        services = await backend.discover(timeout)
+        if not backend.verified and services:
+            reachable = await asyncio.gather(*(is_reachable(service) for service in services))
+            services = [service for service, ok in zip(services, reachable) if ok]
+    except Exception as exc:
+        # One broken backend (e.g. avahi-daemon not running) must not end the race for the others
+        metrics.inc("cast_remote_discovery_backend_failures_total", backend=backend.name)
+        event_log.record(event_log.DISCOVERY_FAILED, backend=backend.name, error=f"{type(exc).__name__}: {exc}")
+        services = []
+    return backend, services
+
+
+def default_backends(registry: Optional[DeviceRegistry] = None) -> List[DiscoveryBackend]:
+    """Returns every backend that can run here, cheapest first."""
+    backends = [CacheBackend(registry), MdnsBackend(), AvahiBackend(), PyChromecastBackend()]
+    return [backend for backend in backends if backend.is_available()]
+
+
+async def race(backends: Optional[Sequence[DiscoveryBackend]] = None,
+               timeout: float = DISCOVERY_TIMEOUT) -> List[CastService]:
+    """Runs the backends concurrently and returns the first verified answer.
+
+    A backend that fails or finds nothing does not end the race; the others keep going until
+    one finds a device or the timeout is reached.
+
+    Args:
+        backends: The backends to race. Defaults to default_backends().
+        timeout: The maximum time in seconds to wait for any backend.
+
+    Returns:
+        The devices found by the winning backend, or an empty list if none found any.
+    """
+    backends = list(default_backends() if backends is None else backends)
+    start = time.monotonic()
+    tasks = [asyncio.ensure_future(_run_backend(backend, timeout)) for backend in backends]
+    try:
+        for finished in asyncio.as_completed(tasks, timeout=timeout):
+            try:
+                backend, services = await finished
+            except asyncio.TimeoutError:
+                break
+            if services:
+                metrics.inc("cast_remote_discovery_wins_total", backend=backend.name)
+                metrics.observe("cast_remote_discovery_race_seconds", time.monotonic() - start, backend=backend.name)
+                return services
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return []
+
+
+def discover(backends: Optional[Sequence[DiscoveryBackend]] = None,
+             timeout: float = DISCOVERY_TIMEOUT) -> List[CastService]:
+    """Blocking wrapper around race() for callers without an event loop."""
+    return asyncio.run(race(backends, timeout))
+
+
+def print_failures():
+    """Prints why backends failed during the last races, for command line tools that found nothing."""
+    for event in event_log.recent(kind=event_log.DISCOVERY_FAILED):
+        print(f"Discovery backend {event.fields['backend']} failed: {event.fields['error']}", file=sys.stderr)
+
+
+def main():
+    import argparse
+
+    backends = {backend.name: backend for backend in default_backends()}
+    parser = argparse.ArgumentParser(description="Find Google Cast-enabled devices with the fastest backend.")
+    parser.add_argument("--timeout", type=float, default=DISCOVERY_TIMEOUT)
+    parser.add_argument("--backend", action="append", choices=sorted(backends),
+                        help="Only race these backends (may be repeated)")
+    args = parser.parse_args()
+
+    selected = [backends[name] for name in args.backend] if args.backend else list(backends.values())
+    services = discover(selected, timeout=args.timeout)
+    for service in services:
+        print(f"{service.ip_address}\t{service.uuid}\t{service.friendly_name}")
+    if not services:
+        print_failures()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""A structured event log that never makes the caller wait.
+
+Events (a device discovered, the outcome of a connection attempt, a change of connection
+state, a key sent and how long after the press) are appended to an in-memory ring buffer.
+Appending to a bounded deque is atomic, so record() takes no lock and does no I/O; the GPIO
+callback and key queue threads pay about a microsecond per event. A background thread
+started with start() writes the events out in batches, as JSON lines to EVENT_LOG_PATH or to
+the systemd journal. When the buffer fills faster than it is flushed, the oldest events are
+overwritten and the flusher reports how many it missed.
+
+    event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_HOME"], latency=0.012)
+    event_log.start()                # flushes every FLUSH_INTERVAL seconds until stop()
+    event_log.recent(20)             # the last 20 events still in memory
+
+The command line prints the last events written to EVENT_LOG_PATH, optionally only those of
+one kind. The controller daemon's "events" command returns the ones still in its memory.
+
+Usage:
+    python3 event_log.py [COUNT] [KIND]
+"""
+import itertools
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+EVENT_LOG_PATH = os.environ.get("CAST_REMOTE_EVENT_LOG",
+                                os.path.expanduser("~/.config/adb-cast-remote/events.jsonl"))
+SINK_ENV = "CAST_REMOTE_EVENT_SINK"
+JOURNAL_SOCKET = "/run/systemd/journal/socket"
+RING_SIZE = 4096
+FLUSH_INTERVAL = 1.0
+MAX_FILE_BYTES = 1024 * 1024
+
+# Event kinds
+DISCOVERED = "discovered"            # ip_address, uuid, friendly_name, source ('mdns' or 'sweep')
+CONNECT_OUTCOME = "connect_outcome"  # ip_address, outcome, output
+STATUS_CHANGE = "status_change"      # ip_address, previous, event, state; or uuid, state ('lost', 'restored', 'moved')
+KEY_SENT = "key_sent"                # keycodes, presses, latency (seconds from the first press)
+KEY_FAILED = "key_failed"            # keycodes, error
+KEY_DROPPED = "key_dropped"          # keycodes, count, reason ('queue_full' or 'stale')
+MACRO = "macro"                      # name, error if it failed
+TRANSPORT_FALLBACK = "transport_fallback"  # keycodes, transport, error
+SEND_FAILED = "send_failed"          # ip_address, error
+DISCOVERY_FAILED = "discovery_failed"  # backend, error (see discovery)
+EVENTS_MISSED = "events_missed"      # count, written by the flusher when the buffer overflowed
+
+_sequence = itertools.count(1)
+_events: "deque[tuple]" = deque(maxlen=RING_SIZE)
+_cleared = 0  # The sequence number of the last event clear() removed
+_flusher: Optional["_Flusher"] = None
+_flusher_lock = threading.Lock()
+
+
+@dataclass
+class Event:
+    """An entry of the event log.
+
+    Attributes:
+        sequence: Numbers the events of this process in the order they were recorded.
+        time: When the event happened, in seconds since the epoch.
+        kind: One of the event kinds above, e.g. KEY_SENT.
+        fields: What happened, e.g. {"keycodes": ["KEYCODE_HOME"], "latency": 0.012}.
+    """
+    sequence: int
+    time: float
+    kind: str
+    fields: Dict[str, object] = field(default_factory=dict)
+
+    def to_json(self) -> str:
+        return json.dumps(dict(self.fields, time=round(self.time, 6), kind=self.kind), default=str)
+
+
+def record(kind: str, **fields):
+    """Appends an event to the ring buffer. Never blocks and never raises for a full buffer."""
+    # Numbering and appending happen in one C call that runs no Python code, so no other thread
+    # can get in between them and the buffer is always in sequence order, which the flusher
+    # relies on. zip takes the event first, so the counter is not advanced past it.
+    _events.extend(zip(((time.time(), kind, fields),), _sequence))
+
+
+def _snapshot(after: int = 0) -> List[Event]:
+    # Copying a deque is a single C call, so it cannot see an append halfway through
+    return [Event(sequence, *entry) for entry, sequence in list(_events) if sequence > after]
+
+
+def recent(count: Optional[int] = None, kind: Optional[str] = None) -> List[Event]:
+    """Returns the last events still in the ring buffer, oldest first.
+
+    Args:
+        count: The most events to return. All of them if None.
+        kind: Only return events of this kind.
+    """
+    events = [event for event in _snapshot() if kind is None or event.kind == kind]
+    return events[-count:] if count else events
+
+
+def clear():
+    """Empties the ring buffer. The events it held are not reported as missed."""
+    global _cleared
+    if _events:
+        _cleared = _events[-1][1]
+    _events.clear()
+
+
+class JsonLinesSink:
+    """Appends events to a file, one JSON object per line, keeping one rotated file.
+
+    Args:
+        path: The file to append to.
+        max_bytes: Once the file is larger, it is renamed to path + '.1' and a new one started.
+    """
+
+    def __init__(self, path: str = EVENT_LOG_PATH, max_bytes: int = MAX_FILE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def write(self, events: List[Event]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a") as log_file:
+            log_file.write("".join(event.to_json() + "\n" for event in events))
+
+    def close(self):
+        pass
+
+
+class JournaldSink:
+    """Sends events to the systemd journal over its native socket, one entry per event.
+
+    Each field of an event becomes a journal field, e.g. CAST_REMOTE_IP_ADDRESS, so
+    `journalctl CAST_REMOTE_EVENT=key_sent` finds every key sent.
+    """
+
+    def __init__(self, socket_path: str = JOURNAL_SOCKET, identifier: str = "adb-cast-remote"):
+        self.socket_path = socket_path
+        self.identifier = identifier
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    @staticmethod
+    def _field(name: str, value: str) -> bytes:
+        encoded = value.encode()
+        if b"\n" in encoded:
+            return name.encode() + b"\n" + struct.pack("<Q", len(encoded)) + encoded + b"\n"
+        return name.encode() + b"=" + encoded + b"\n"
+
+    def entry(self, event: Event) -> bytes:
+        """Serializes an event in the journal's native protocol."""
+        summary = " ".join(f"{name}={value}" for name, value in event.fields.items())
+        fields = [("MESSAGE", f"{event.kind} {summary}".strip()), ("PRIORITY", "6"),
+                  ("SYSLOG_IDENTIFIER", self.identifier), ("CAST_REMOTE_EVENT", event.kind)]
+        for name, value in event.fields.items():
+            journal_name = "CAST_REMOTE_" + "".join(c if c.isalnum() else "_" for c in name.upper())
+            fields.append((journal_name, value if isinstance(value, str) else json.dumps(value, default=str)))
+        return b"".join(self._field(name, value) for name, value in fields)
+
+    def write(self, events: List[Event]):
+        for event in events:
+            self._sock.sendto(self.entry(event), self.socket_path)
+
+    def close(self):
+        self._sock.close()
+
+
+def default_sink():
+    """Returns the sink named by CAST_REMOTE_EVENT_SINK ('file', 'journald' or 'none').
+
+    Without it, services started by systemd log to the journal and everything else to
+    EVENT_LOG_PATH.
+    """
+    sink = os.environ.get(SINK_ENV) or ("journald" if os.environ.get("JOURNAL_STREAM") else "file")
+    if sink == "none":
+        return None
+    if sink == "journald":
+        return JournaldSink()
+    return JsonLinesSink()
+
+
+class _Flusher:
+    def __init__(self, sink, interval: float):
+        self.sink = sink
+        self.interval = interval
+        self.flushed = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+
+    def flush(self):
+        with self._lock:
+            events = _snapshot(after=self.flushed)
+            if not events:
+                return
+            # Also counts the events overwritten before the first batch, e.g. in a burst at startup
+            written = max(self.flushed, _cleared)
+            missed = events[0].sequence - written - 1
+            if missed > 0:
+                events.insert(0, Event(written + 1, events[0].time, EVENTS_MISSED, {"count": missed}))
+            try:
+                self.sink.write(events)
+            except OSError:
+                # Losing log lines is better than stopping the remote; carry on with the next batch
+                self.failures += 1
+            self.flushed = events[-1].sequence
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def stop(self, timeout: float):
+        self._stop.set()
+        self._thread.join(timeout)
+        self.flush()
+        self.sink.close()
+
+
+def start(sink=None, interval: float = FLUSH_INTERVAL):
+    """Starts writing events out from a background thread, every interval seconds.
+
+    Args:
+        sink: Where to write them, e.g. JsonLinesSink(). Defaults to default_sink().
+        interval: Seconds between batches.
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+        sink = sink or default_sink()
+        if sink is None:
+            return
+        _flusher = _Flusher(sink, interval)
+        # Events recorded before start() are written with the first batch
+        _flusher._thread.start()
+
+
+def flush():
+    """Writes out the events recorded so far, from the calling thread."""
+    with _flusher_lock:
+        if _flusher is not None:
+            _flusher.flush()
+
+
+def stop(timeout: float = 5):
+    """Writes out the remaining events and stops the background thread."""
+    global _flusher
+    with _flusher_lock:
+        flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.stop(timeout)
+
+
+def read_file(path: str = EVENT_LOG_PATH, count: int = 20, kind: Optional[str] = None) -> List[dict]:
+    """Returns the last events written to a JSON-lines log, oldest first."""
+    matching: "deque[dict]" = deque(maxlen=count)
+    paths: Iterable[str] = (path + ".1", path)
+    for log_path in paths:
+        try:
+            with open(log_path) as log_file:
+                for line in log_file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if kind is None or event.get("kind") == kind:
+                        matching.append(event)
+        except FileNotFoundError:
+            continue
+    return list(matching)
+
+
+def main(argv: List[str]):
+    try:
+        count = int(argv[0]) if argv else 20
+    except ValueError:
+        count = 0
+    if count <= 0 or len(argv) > 2:
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+    for event in read_file(count=count, kind=argv[1] if len(argv) > 1 else None):
+        print(json.dumps(event))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
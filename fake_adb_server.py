@@ -0,0 +1,237 @@
+"""A local stand-in for the ADB server, for tests and benchmarks.
+
+Speaks the same TCP protocol as the real server for the requests this project uses, and
+keeps a table of fake devices instead of talking to real ones.
+
+Usage:
+    python3 fake_adb_server.py [--port PORT] [--latency SECONDS] [--failure-rate RATE]
+                               [--auth-delay SECONDS]
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def _encode(message: str) -> bytes:
+    payload = message.encode()
+    return b"%04x" % len(payload) + payload
+
+
+class FakeAdbServer:
+    """A fake ADB server listening on a loopback port.
+
+    Attributes:
+        devices: Maps device serial to its state ('device', 'unauthorized', 'offline').
+        connect_replies: Maps an address to the message 'host:connect' should reply with.
+            Addresses not listed here are connected and reported as authorized devices.
+        shell_handler: Called with (serial, command) for every shell command, returns the
+            output to send back.
+        exec_handler: Called with (serial, command) for every exec: service (e.g. screencap),
+            returns the raw output to stream back.
+        requests: Every request received, in order.
+        latency: Seconds to wait before answering each request.
+        failure_rate: The fraction of 'host:connect' requests refused by the fake device.
+        auth_delay: If set, newly connected devices are 'unauthorized' for this many seconds,
+            as if the user took that long to allow the connection.
+
+    Use set_device_state() rather than changing devices directly for the change to be sent to
+    clients tracking devices.
+    """
+
+    def __init__(self):
+        self.devices: Dict[str, str] = {}
+        self._devices_changed = threading.Condition()
+        self._devices_version = 0
+        self.connect_replies: Dict[str, str] = {}
+        self.shell_handler: Callable[[str, str], bytes] = lambda serial, command: b""
+        self.exec_handler: Callable[[str, str], bytes] = lambda serial, command: b""
+        self.requests: List[str] = []
+        self.latency = 0.0
+        self.failure_rate = 0.0
+        self.auth_delay: Optional[float] = None
+        self.on_kill: Callable[[], None] = lambda: None
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def __enter__(self) -> "FakeAdbServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self, port: int = 0):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._handle(self.rfile, self.wfile)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05},
+                         daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            with self._devices_changed:
+                self._devices_version = -1
+                self._devices_changed.notify_all()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def set_device_state(self, serial: str, state: Optional[str]):
+        """Changes the state of a device, or removes it if state is None."""
+        with self._devices_changed:
+            if state is None:
+                self.devices.pop(serial, None)
+            else:
+                self.devices[serial] = state
+            self._devices_version += 1
+            self._devices_changed.notify_all()
+
+    def _device_table(self) -> str:
+        return "".join(f"{serial}\t{state}\n" for serial, state in self.devices.items())
+
+    def _track_devices(self, wfile):
+        wfile.write(b"OKAY")
+        while True:
+            with self._devices_changed:
+                version = self._devices_version
+                table = self._device_table()
+            try:
+                wfile.write(_encode(table))
+                wfile.flush()
+            except OSError:
+                return
+            with self._devices_changed:
+                self._devices_changed.wait_for(lambda: self._devices_version != version)
+                if self._devices_version == -1:
+                    return
+
+    @staticmethod
+    def _read_request(rfile) -> Optional[str]:
+        header = rfile.read(4)
+        if len(header) < 4:
+            return None
+        return rfile.read(int(header, 16)).decode()
+
+    def _handle(self, rfile, wfile):
+        request = self._read_request(rfile)
+        if request is None:
+            return
+        self.requests.append(request)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if request == "host:version":
+            wfile.write(b"OKAY" + _encode("0029"))
+        elif request == "host:devices":
+            wfile.write(b"OKAY" + _encode(self._device_table()))
+        elif request == "host:track-devices":
+            self._track_devices(wfile)
+        elif request.startswith("host-serial:") and request.endswith(":get-state"):
+            serial = request[len("host-serial:"):-len(":get-state")]
+            if serial in self.devices:
+                wfile.write(b"OKAY" + _encode(self.devices[serial]))
+            else:
+                wfile.write(b"FAIL" + _encode(f"device '{serial}' not found"))
+        elif request.startswith("host:connect:"):
+            wfile.write(b"OKAY" + _encode(self._connect(request[len("host:connect:"):])))
+        elif request.startswith("host:disconnect:"):
+            address = request[len("host:disconnect:"):]
+            serials = [serial for serial in self.devices if serial.split(":")[0] == address.split(":")[0]]
+            if not serials:
+                wfile.write(b"FAIL" + _encode(f"no such device '{address}'"))
+            else:
+                for serial in serials:
+                    self.set_device_state(serial, None)
+                wfile.write(b"OKAY" + _encode(f"disconnected {address}"))
+        elif request == "host:kill":
+            wfile.write(b"OKAY")
+            wfile.flush()
+            threading.Thread(target=self.on_kill).start()
+        elif request.startswith("host:transport:"):
+            self._handle_transport(request[len("host:transport:"):], rfile, wfile)
+        else:
+            wfile.write(b"FAIL" + _encode(f"unknown host service '{request}'"))
+        wfile.flush()
+
+    def _connect(self, address: str) -> str:
+        if address in self.connect_replies:
+            return self.connect_replies[address]
+        if address in self.devices:
+            return f"already connected to {address}"
+        if self.failure_rate and random.random() < self.failure_rate:
+            return f"failed to connect to '{address}': Connection refused"
+        if self.auth_delay is None:
+            self.set_device_state(address, "device")
+            return f"connected to {address}"
+
+        self.set_device_state(address, "unauthorized")
+        threading.Timer(self.auth_delay, self._authorize, (address,)).start()
+        return f"failed to authenticate to {address}"
+
+    def _authorize(self, serial: str):
+        with self._devices_changed:
+            if self.devices.get(serial) != "unauthorized":
+                return
+        self.set_device_state(serial, "device")
+
+    def _handle_transport(self, serial: str, rfile, wfile):
+        if self.devices.get(serial) != "device":
+            wfile.write(b"FAIL" + _encode(f"device '{serial}' not found"))
+            return
+        wfile.write(b"OKAY")
+        wfile.flush()
+
+        service = self._read_request(rfile)
+        if service is None:
+            return
+        self.requests.append(service)
+
+        if service.startswith("shell:") and len(service) > len("shell:"):
+            wfile.write(b"OKAY" + self.shell_handler(serial, service[len("shell:"):]))
+        elif service == "shell:":
+            wfile.write(b"OKAY")
+            wfile.flush()
+            for line in rfile:
+                wfile.write(self.shell_handler(serial, line.decode().rstrip("\n")))
+                wfile.flush()
+        elif service.startswith("exec:"):
+            wfile.write(b"OKAY" + self.exec_handler(serial, service[len("exec:"):]))
+        else:
+            wfile.write(b"FAIL" + _encode(f"unknown service '{service}'"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake ADB server.")
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--auth-delay", type=float)
+    args = parser.parse_args()
+
+    server = FakeAdbServer()
+    server.latency = args.latency
+    server.failure_rate = args.failure_rate
+    server.auth_delay = args.auth_delay
+    server.shell_handler = lambda serial, command: b""
+
+    stopped = threading.Event()
+    server.on_kill = stopped.set
+    server.start(port=args.port)
+    stopped.wait()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import time
 import sys
+from typing import List, Optional
 
 import device_utils as utils
+import fleet
+from device_registry import DeviceRegistry
 
 TIMEOUT_SECONDS = 60
 CHECK_AUTHORIZATION_INTERVAL = 3
@@ -16,7 +19,7 @@ def is_authorized_device(ip_address: str) -> bool:
     Returns:
         A boolean indicating whether the device is authorized or not.
     """
-    device_status = utils.get_device_status(ip_address)
+    device_status = utils.get_device_statuses([ip_address])[ip_address]
     return device_status == "device"
 
 
@@ -40,9 +43,11 @@ def wait_for_user_authentication_on_device(ip_address: str):
     """
     Waits for the user to authenticate the connection on a Google Cast-enabled device.
 
-    This function checks periodically whether the user has authorized the device connection.
-    If the user does not authenticate within the timeout period, the function disconnects
-    from the device and exits the program.
+    This function follows the ADB server's device state changes, so it returns as soon as the
+    user has authorized the device connection. If the ADB server cannot stream state changes,
+    it falls back to checking every CHECK_AUTHORIZATION_INTERVAL seconds. If the user does not
+    authenticate within the timeout period, the function disconnects from the device and exits
+    the program.
 
     Args:
         ip_address: The IP address of the Cast device as a string.
@@ -52,32 +57,49 @@ def wait_for_user_authentication_on_device(ip_address: str):
     """
     print("Please authenticate connection on Cast Device")
 
+    try:
+        authorized_device = utils.wait_for_device_state(ip_address, "device", timeout=TIMEOUT_SECONDS)
+    except utils.adb_client.AdbError:
+        authorized_device = poll_for_user_authentication_on_device(ip_address)
+
+    if not authorized_device:
+        print("Timeout reached. Exiting...")
+        utils.disconnect_from_device(ip_address)
+        sys.exit(0)
+
+
+def poll_for_user_authentication_on_device(ip_address: str) -> bool:
+    """
+    Checks every CHECK_AUTHORIZATION_INTERVAL seconds whether the user has authorized the device.
+
+    Args:
+        ip_address: The IP address of the Cast device as a string.
+
+    Returns:
+        True if the device was authorized before the timeout was reached, False otherwise.
+    """
     start_time = time.time()
-    timeout_reached = is_timeout_reached(start_time)
     authorized_device = is_authorized_device(ip_address)
 
-    while not authorized_device and not timeout_reached:
+    while not authorized_device and not is_timeout_reached(start_time):
         time.sleep(CHECK_AUTHORIZATION_INTERVAL)
         authorized_device = is_authorized_device(ip_address)
-        timeout_reached = is_timeout_reached(start_time)
 
-        if timeout_reached:
-            print("Timeout reached. Exiting...")
-            utils.disconnect_from_device(ip_address)
-            sys.exit(0)
+    return authorized_device
 
 
-def pair_to_device_first_time():
-    """Attempts to discover and connect to a Google Cast-enabled device on the local network.
+def pair_to_device(ip_address: str) -> bool:
+    """Connects to the Google Cast-enabled device at the given IP address.
 
-    This function locates the IP address of a Cast-enabled device a tries to establish a connection.
-    If the device requires user authorization, it waits for the user to authenticate the connection
+    If the device requires user authorization, waits for the user to authenticate the connection
     manually (e.g. by approving the pairing on the device itself).
 
+    Args:
+        ip_address: The IP address of the Cast device as a string.
+
     Returns:
-        None
+        True once the device is connected and authorized.
     """
-    ip_address = utils.find_device_ip_address()
     authorized_connection = utils.connect_to_cast_device(ip_address)
 
     if not authorized_connection:
@@ -86,6 +108,54 @@ def pair_to_device_first_time():
     else:
         print(f"Connected to Cast Device at {ip_address}. No need to authenticate connection.")
 
+    return True
+
+
+def pair_to_device_first_time():
+    """Attempts to discover and connect to a Google Cast-enabled device on the local network.
+
+    This function locates the IP address of a Cast-enabled device a tries to establish a connection.
+    If the device requires user authorization, it waits for the user to authenticate the connection
+    manually (e.g. by approving the pairing on the device itself).
+
+    Returns:
+        None
+    """
+    ip_address = utils.find_device_ip_address()
+    pair_to_device(ip_address)
+
+
+def pair_to_all_devices_first_time(registry: Optional[DeviceRegistry] = None) -> List[fleet.DeviceResult]:
+    """Discovers every Cast-enabled device on the local network and pairs to all of them at once.
+
+    Users can authorize the connection on each device in any order; the whole run takes as long
+    as the slowest device. Devices that were paired are remembered in the device registry.
+
+    Args:
+        registry: The registry of known devices. Defaults to the registry at REGISTRY_PATH.
+
+    Returns:
+        The outcome of pairing to each device.
+    """
+    registry = registry or DeviceRegistry()
+
+    devices = utils.find_cast_devices()
+    if not devices:
+        print("No Google Cast-enabled devices found on the local network.")
+        return []
+
+    for device in devices:
+        print(f"Found {device.friendly_name or 'Cast Device'} ({device.uuid}) at {device.ip_address}")
+
+    results = fleet.run_on_devices(pair_to_device, [device.ip_address for device in devices])
+    for device, result in zip(devices, results):
+        if result.ok:
+            registry.remember(device.uuid, device.ip_address, device.friendly_name)
+
+    fleet.print_report(results)
+    return results
+
 
 if __name__ == '__main__':
-    pair_to_device_first_time()
\ No newline at end of file
+    pairing_results = pair_to_all_devices_first_time()
+    sys.exit(0 if pairing_results and all(result.ok for result in pairing_results) else 1)
@@ -0,0 +1,159 @@
+"""Runs device operations over every Google Cast-enabled device at once.
+
+Each device gets its own worker thread, so an operation over a fleet of devices takes
+about as long as the slowest device rather than the sum of all of them.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import device_utils as utils
+
+MAX_WORKERS = 32
+
+
+@dataclass
+class DeviceResult:
+    """The outcome of an operation on a single device.
+
+    Attributes:
+        ip_address: The IP address of the device.
+        ok: Whether the operation completed without raising.
+        value: What the operation returned, if it completed.
+        error: A description of the failure, if it did not.
+        elapsed: How long the operation took on this device, in seconds.
+    """
+    ip_address: str
+    ok: bool
+    value: Any = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+
+def _run_one(operation: Callable[[str], Any], ip_address: str) -> DeviceResult:
+    start = time.monotonic()
+    try:
+        value = operation(ip_address)
+    except SystemExit as exc:
+        # Single-device code paths exit the program on failure; contain it to this device
+        return DeviceResult(ip_address, ok=False, error=f"exited with code {exc.code}",
+                            elapsed=time.monotonic() - start)
+    except Exception as exc:
+        return DeviceResult(ip_address, ok=False, error=str(exc), elapsed=time.monotonic() - start)
+    return DeviceResult(ip_address, ok=True, value=value, elapsed=time.monotonic() - start)
+
+
+def run_on_devices(operation: Callable[[str], Any], ip_addresses: Sequence[str],
+                   max_workers: int = MAX_WORKERS) -> List[DeviceResult]:
+    """Runs an operation on every device concurrently.
+
+    Args:
+        operation: Called with the IP address of each device.
+        ip_addresses: The IP addresses of the devices.
+        max_workers: The maximum number of devices handled at the same time.
+
+    Returns:
+        One DeviceResult per device, in the same order as ip_addresses.
+    """
+    if not ip_addresses:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ip_addresses))) as executor:
+        futures = [executor.submit(_run_one, operation, ip_address) for ip_address in ip_addresses]
+        return [future.result() for future in futures]
+
+
+@dataclass
+class BroadcastReport:
+    """The outcome of sending one command to a group of devices at once.
+
+    Attributes:
+        results: The outcome on each device. The value of a successful result is when the
+            command was sent to that device, in seconds after the first device.
+        skew: The time in seconds between sending the command to the first and the last device.
+        elapsed: How long the whole broadcast took, in seconds.
+    """
+    results: List[DeviceResult]
+    skew: float
+    elapsed: float
+
+
+def broadcast(operation: Callable[[str], Any], ip_addresses: Sequence[str],
+              prepare: Optional[Callable[[str], Any]] = None, sync_timeout: float = 5.0) -> BroadcastReport:
+    """Runs an operation on every device at the same moment.
+
+    Every device gets its own thread. Each thread first prepares its device (e.g. opens its
+    channel), then all threads wait for each other and run the operation together, so the
+    slowest device to prepare does not stagger the others.
+
+    Args:
+        operation: Called with the IP address of each device, e.g. to send it a command.
+        ip_addresses: The IP addresses of the devices.
+        prepare: Called with the IP address of each device before the operation. A device
+            whose preparation fails is reported as failed and does not hold up the others.
+        sync_timeout: The longest time in seconds to wait for every device to be prepared.
+            The devices that are ready go ahead without the others after that.
+
+    Returns:
+        The outcome on each device, in the same order as ip_addresses, and the skew between them.
+    """
+    if not ip_addresses:
+        return BroadcastReport([], 0.0, 0.0)
+
+    start = time.monotonic()
+    ready = threading.Barrier(len(ip_addresses))
+    sent_at: Dict[str, float] = {}
+
+    def run(ip_address: str):
+        try:
+            if prepare is not None:
+                prepare(ip_address)
+        finally:
+            try:
+                ready.wait(sync_timeout)
+            except threading.BrokenBarrierError:
+                pass
+        sent_at[ip_address] = time.monotonic()
+        operation(ip_address)
+
+    with ThreadPoolExecutor(max_workers=len(ip_addresses)) as executor:
+        futures = [executor.submit(_run_one, run, ip_address) for ip_address in ip_addresses]
+        results = [future.result() for future in futures]
+
+    sent = [sent_at[result.ip_address] for result in results if result.ok]
+    first = min(sent) if sent else start
+    for result in results:
+        if result.ok:
+            result.value = sent_at[result.ip_address] - first
+    return BroadcastReport(results, skew=max(sent) - first if sent else 0.0, elapsed=time.monotonic() - start)
+
+
+def connect_all(ip_addresses: Sequence[str], quiet_connect: bool = False) -> List[DeviceResult]:
+    """Connects to every device concurrently. See device_utils.connect_to_cast_device."""
+    return run_on_devices(lambda ip: utils.connect_to_cast_device(ip, quiet_connect=quiet_connect), ip_addresses)
+
+
+def status_all(ip_addresses: Sequence[str]) -> List[DeviceResult]:
+    """Fetches the connection status of every device with a single device table query."""
+    start = time.monotonic()
+    statuses = utils.get_device_statuses(ip_addresses)
+    elapsed = time.monotonic() - start
+
+    results = []
+    for ip_address in ip_addresses:
+        status = statuses[ip_address]
+        if status == utils.DEVICE_MISSING:
+            results.append(DeviceResult(ip_address, ok=False, error=f"No device with IP address {ip_address} found.",
+                                        elapsed=elapsed))
+        else:
+            results.append(DeviceResult(ip_address, ok=True, value=status, elapsed=elapsed))
+    return results
+
+
+def print_report(results: Sequence[DeviceResult]):
+    """Prints one line per device with the outcome of an operation."""
+    for result in results:
+        outcome = result.value if result.ok else f"FAILED: {result.error}"
+        print(f"{result.ip_address:<16} {outcome} ({result.elapsed:.2f}s)")
@@ -1,57 +1,234 @@
-import RPi.GPIO as GPIO
-import subprocess
+"""Turns the buttons wired to the Raspberry Pi's GPIO pins into a remote for the Google TV.
+
+Which button sends which key is set in the keymap file (see gpio_input), and long, double
+and triple presses can run macros (see macros). If the keymap names a device group, every
+button acts on all the devices of the group at once (see device_groups). Keys the keymap
+lists under "cast" go over a Cast connection instead of ADB (see cast_control).
+
+Usage:
+    python3 googleTVController.py [--simulate]
+
+With --simulate no GPIO pins are read. Instead, each line on standard input presses a
+button: 'PIN' presses and releases it, 'down PIN' and 'up PIN' press or release it.
+"""
 import signal
 import sys
+import time
+from dataclasses import asdict
+from typing import Optional
+
+import cast_control
+import device_groups
+import event_log
+import gpio_input
+import macros
+from adb_shell_session import AdbShellSession
+from button_gestures import GestureDetector
+from controller_client import ControllerClient
+from device_registry import DeviceRegistry
+from key_queue import KeyEventQueue
+
+# After Cast fails, keys go over ADB for this many seconds before Cast is tried again
+CAST_RETRY_DELAY = 30.0
+# Longer than the daemon can take to broadcast, so a slow broadcast is not taken for a failed one
+DAEMON_TIMEOUT = device_groups.SYNC_TIMEOUT + device_groups.CONFIRM_TIMEOUT + 5.0
+
+
+class Remote:
+    """Sends the key or macro of each button to the device.
+
+    Button presses go through the controller daemon when it is running, which keeps the
+    connection warm. Otherwise one adb shell is kept open for all button presses, or one per
+    device of the keymap's group. Keys sent over Cast share one Cast connection, and go over
+    ADB instead while Cast is failing.
+
+    Args:
+        keymap: The keycode of each button.
+        macro_config: The macros bound to long, double and triple presses of buttons.
+        controller: The client of the controller daemon.
+        adb_shell: The shell used when the daemon is not running.
+    """
+
+    def __init__(self, keymap: gpio_input.Keymap, macro_config: macros.MacroConfig,
+                 controller: Optional[ControllerClient] = None, adb_shell: Optional[AdbShellSession] = None):
+        self.keymap = keymap
+        self.macro_config = macro_config
+        self.controller = controller or ControllerClient(timeout=DAEMON_TIMEOUT)
+        self.adb_shell = adb_shell or AdbShellSession()
+        # Presses are queued so the GPIO callback thread never waits on the device
+        self.key_queue = KeyEventQueue(self.send_keycodes)
+        self.gestures = GestureDetector(self.on_gesture, macro_config.buttons)
+        self.broadcaster: Optional[device_groups.Broadcaster] = None
+        self.cast: Optional[cast_control.CastConnection] = None
+        self.cast_retry_at = 0.0
+
+    def broadcast(self, keycodes=(), macro=None):
+        """Sends keyevents or a macro to every device of the keymap's group at once.
+
+        Raises:
+            TimeoutError: If the daemon did not reply in time. It may still have sent the
+                command, so it is not sent again.
+        """
+        try:
+            results = self.controller.broadcast(self.keymap.group, keycodes, macro)["results"]
+        except ConnectionError:
+            if self.broadcaster is None:
+                self.broadcaster = device_groups.Broadcaster()
+            ip_addresses = device_groups.resolve_group(self.keymap.group, device_groups.load_groups(),
+                                                       DeviceRegistry())
+            command = self.macro_config.script(macro) if macro else "input keyevent " + " ".join(keycodes)
+            results = [asdict(result) for result in self.broadcaster.send(command, ip_addresses).results]
+
+        for result in results:
+            if not result["ok"]:
+                event_log.record(event_log.SEND_FAILED, ip_address=result["ip_address"], error=result["error"])
+
+    def cast_connection(self) -> Optional[cast_control.CastConnection]:
+        """Returns the Cast connection to the keymap's cast_device or the most recently connected device."""
+        if self.cast is None:
+            host = self.keymap.cast_device
+            if host is None:
+                devices = DeviceRegistry().devices()
+                if not devices:
+                    return None
+                host = devices[0].ip_address
+            self.cast = cast_control.CastConnection(host)
+        return self.cast
+
+    def send_over_cast(self, keycodes) -> bool:
+        """Sends keys over Cast.
+
+        After Cast fails, it is not tried again for CAST_RETRY_DELAY seconds. A playback key
+        while nothing is playing over Cast is not a failure of Cast.
+
+        Returns:
+            Whether they were sent. If not, they must be sent over ADB.
+        """
+        if time.monotonic() < self.cast_retry_at:
+            return False
+        connection = self.cast_connection()
+        if connection is None:
+            return False
+        try:
+            connection.send_keys(keycodes)
+        except cast_control.NoMediaSessionError as exc:
+            # The usual state while a native app is in front, so Cast keeps working for other keys
+            event_log.record(event_log.TRANSPORT_FALLBACK, keycodes=list(keycodes), transport="adb", error=str(exc))
+            return False
+        except cast_control.CastError as exc:
+            event_log.record(event_log.TRANSPORT_FALLBACK, keycodes=list(keycodes), transport="adb", error=str(exc))
+            self.cast_retry_at = time.monotonic() + CAST_RETRY_DELAY
+            return False
+        return True
+
+    def send_over_adb(self, keycodes):
+        try:
+            self.controller.send_keys(keycodes)
+        except ConnectionError:
+            # Only when the daemon is not running: after a timeout it may still send the keys
+            self.adb_shell.send_keyevents(keycodes)
+
+    def send_keycodes(self, keycodes):
+        if self.keymap.group:
+            self.broadcast(keycodes)
+            return
+        for over_cast, run in cast_control.split_cast_keys(keycodes, self.keymap.cast):
+            if not (over_cast and self.send_over_cast(run)):
+                self.send_over_adb(run)
+
+    def run_macro(self, name):
+        try:
+            if self.keymap.group:
+                self.broadcast(macro=name)
+                return
+            try:
+                self.controller.run_macro(name)
+            except ConnectionError:
+                self.adb_shell.send(self.macro_config.script(name))
+        except (RuntimeError, TimeoutError) as exc:
+            event_log.record(event_log.MACRO, name=name, error=str(exc))
+        else:
+            event_log.record(event_log.MACRO, name=name)
+
+    def on_gesture(self, gpio, gesture):
+        if gesture == "press":
+            self.key_queue.press(self.keymap.buttons[gpio])
+        else:
+            self.run_macro(self.macro_config.buttons[gpio][gesture])
+
+    def pressed(self, gpio):
+        self.gestures.pressed(gpio)
+
+    def released(self, gpio):
+        self.gestures.released(gpio)
 
-gpio_to_keycode = {
-    27: "KEYCODE_DPAD_CENTER",  # Select
-    17: "KEYCODE_DPAD_UP",
-    22: "KEYCODE_DPAD_DOWN",
-    23: "KEYCODE_DPAD_LEFT",
-    24: "KEYCODE_DPAD_RIGHT",
-    25: "KEYCODE_BACK",
-    5: "KEYCODE_HOME",
-    6: "KEYCODE_VOLUME_UP",
-    16: "KEYCODE_VOLUME_DOWN",
-    26: "KEYCODE_POWER",
-}
+    def start(self):
+        self.key_queue.start()
 
+    def close(self):
+        self.gestures.close()
+        self.key_queue.stop()
+        print(f"Key queue: {self.key_queue.stats()}")
+        self.controller.close()
+        self.adb_shell.close()
+        if self.broadcaster is not None:
+            self.broadcaster.close()
+        if self.cast is not None:
+            self.cast.close()
 
-# Function to send ABD command
-def send_adb_command(gpio):
-    keycode = gpio_to_keycode[gpio]
-    print(f"Sending command {keycode}")
-    command = f"adb shell input keyevent {keycode}"
-    subprocess.run(command.split())
 
+def simulate(backend: gpio_input.SimulatedGpio, lines):
+    """Presses buttons on a simulated GPIO backend as described by lines of text."""
+    for line in lines:
+        words = line.split()
+        try:
+            if len(words) == 1:
+                backend.press(int(words[0]))
+                time.sleep(0.05)  # Held for a moment, like a real click
+                backend.release(int(words[0]))
+            elif len(words) == 2 and words[0] in ("down", "up"):
+                (backend.press if words[0] == "down" else backend.release)(int(words[1]))
+            elif words:
+                print(f"Unknown command: {line.strip()}")
+        except ValueError:
+            print(f"Unknown command: {line.strip()}")
 
-def exit_handler():
-    print("\nExiting... Cleaning up GPIO.")
-    GPIO.cleanup()
-    sys.exit(0)  # Is this necessary?
 
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    simulated = "--simulate" in argv
 
-# Set GPIO pins to Broadcast Mode
-GPIO.setmode(GPIO.BCM)
+    keymap = gpio_input.load_keymap()
+    remote = Remote(keymap, macros.load_config())
+    backend = gpio_input.SimulatedGpio() if simulated else gpio_input.default_backend()
+    # Buttons with gestures must not repeat, or holding them would never be a long press
+    buttons = gpio_input.ButtonInput(backend, keymap, remote.pressed, remote.released,
+                                     no_repeat=remote.macro_config.buttons)
 
-# Configure each GPIO pins
-for gpio in gpio_to_keycode:
-    GPIO.setup(gpio, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)  # Pull-down resistor
+    def exit_handler(signum=None, frame=None):
+        sys.exit(0)  # Cleans up in the finally block below
 
-# Detect button press (LOW -> HIGH)
-for gpio in gpio_to_keycode:
-    GPIO.add_event_detect(gpio, GPIO.RISING, callback=send_adb_command,
-                          bouncetime=200)
+    event_log.start()
+    remote.start()
+    buttons.start()
 
-# Catch Ctrl+C (SIGINT) and Stop (SIGTERM)
-signal.signal(signal.SIGINT, exit_handler)
-signal.signal(signal.SIGTERM, exit_handler)  # This doesn't work in Thonny
+    # Catch Ctrl+C (SIGINT) and Stop (SIGTERM)
+    signal.signal(signal.SIGINT, exit_handler)
+    signal.signal(signal.SIGTERM, exit_handler)  # This doesn't work in Thonny
 
-try:
-    print("Waiting for button press...")
-    signal.pause()  # Script idles (and has 0 CPU usage) until button is pressed
+    try:
+        if simulated:
+            print("Reading button presses from standard input...")
+            simulate(backend, sys.stdin)
+        else:
+            print("Waiting for button press...")
+            signal.pause()  # Script idles (and has 0 CPU usage) until button is pressed
+    finally:
+        print("Exiting... Cleaning up GPIO")
+        buttons.close()
+        remote.close()
+        event_log.stop()
 
-finally:
-    print("Exiting... Cleaning up GPIO")
-    GPIO.cleanup()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""Reads the remote's buttons: a configurable keymap, software debounce and hold-to-repeat.
+
+The keymap is read from a JSON file (KEYMAP_PATH). Every setting is optional:
+
+    {
+      "buttons": {"17": "KEYCODE_DPAD_UP", "22": "KEYCODE_DPAD_DOWN", "27": "KEYCODE_DPAD_CENTER"},
+      "repeat": ["KEYCODE_DPAD_UP", "KEYCODE_DPAD_DOWN"],
+      "debounce": 0.02,
+      "repeat_delay": 0.4,
+      "repeat_interval": 0.15,
+      "repeat_min_interval": 0.04,
+      "repeat_acceleration": 0.85,
+      "group": "bar",
+      "cast": ["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN", "KEYCODE_MEDIA_PLAY_PAUSE"],
+      "cast_device": "192.168.1.80"
+    }
+
+Buttons are debounced in software from the timestamp of each edge rather than with
+RPi.GPIO's fixed bouncetime, so a button can be pressed again as soon as it has settled.
+Holding a button whose keycode is in "repeat" presses it again after repeat_delay, then
+every repeat_interval, each repeat coming sooner by repeat_acceleration down to
+repeat_min_interval. All times are in seconds. With "group", every button acts on all the
+devices of that group (see device_groups) instead of a single device. The keycodes in
+"cast" are sent over a Cast connection (see cast_control) instead of ADB, to cast_device or
+else the most recently connected device, and fall back to ADB if Cast fails.
+
+The GPIO pins are reached through a GpioBackend: libgpiod (kernel edge timestamps) or
+RPi.GPIO on a Raspberry Pi, and SimulatedGpio for tests and benchmarks.
+"""
+import importlib.util
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set
+
+import cast_control
+
+KEYMAP_PATH = os.environ.get("CAST_REMOTE_KEYMAP", os.path.expanduser("~/.config/adb-cast-remote/keymap.json"))
+GPIO_CHIP = os.environ.get("CAST_REMOTE_GPIO_CHIP", "/dev/gpiochip0")
+
+DEFAULT_BUTTONS = {
+    27: "KEYCODE_DPAD_CENTER",  # Select
+    17: "KEYCODE_DPAD_UP",
+    22: "KEYCODE_DPAD_DOWN",
+    23: "KEYCODE_DPAD_LEFT",
+    24: "KEYCODE_DPAD_RIGHT",
+    25: "KEYCODE_BACK",
+    5: "KEYCODE_HOME",
+    6: "KEYCODE_VOLUME_UP",
+    16: "KEYCODE_VOLUME_DOWN",
+    26: "KEYCODE_POWER",
+}
+DEFAULT_REPEAT = {"KEYCODE_DPAD_UP", "KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_LEFT", "KEYCODE_DPAD_RIGHT",
+                  "KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN"}
+
+EdgeCallback = Callable[[int, bool, float], None]
+
+
+@dataclass
+class Keymap:
+    """Which keycode each button sends and how buttons are debounced and repeated.
+
+    Attributes:
+        buttons: The keycode of each GPIO pin (BCM numbering).
+        repeat: The keycodes that repeat while their button is held.
+        debounce: Edges within this many seconds of the last accepted edge of a pin are ignored.
+        repeat_delay: Seconds a button is held before it starts repeating.
+        repeat_interval: Seconds between the first repeats.
+        repeat_min_interval: The shortest time between repeats, however long the button is held.
+        repeat_acceleration: What each interval between repeats is multiplied by to get the next.
+        group: The device group the buttons act on, or None for a single device.
+        cast: The keycodes sent over Cast instead of ADB.
+        cast_device: The IP address of the device to send them to, or None for the most
+            recently connected device.
+    """
+    buttons: Dict[int, str] = field(default_factory=lambda: dict(DEFAULT_BUTTONS))
+    repeat: Set[str] = field(default_factory=lambda: set(DEFAULT_REPEAT))
+    debounce: float = 0.02
+    repeat_delay: float = 0.4
+    repeat_interval: float = 0.15
+    repeat_min_interval: float = 0.04
+    repeat_acceleration: float = 0.85
+    group: Optional[str] = None
+    cast: Set[str] = field(default_factory=set)
+    cast_device: Optional[str] = None
+
+    def repeating_pins(self) -> Set[int]:
+        """Returns the pins whose button repeats while held."""
+        return {pin for pin, keycode in self.buttons.items() if keycode in self.repeat}
+
+    def repeat_delays(self) -> Iterator[float]:
+        """Yields the wait before each repeat of a held button, forever."""
+        yield self.repeat_delay
+        interval = self.repeat_interval
+        while True:
+            yield interval
+            interval = max(self.repeat_min_interval, interval * self.repeat_acceleration)
+
+
+def parse_keymap(config: dict) -> Keymap:
+    """Builds a keymap from the contents of a keymap file, using defaults for missing settings.
+
+    Raises:
+        ValueError: If a setting is malformed.
+    """
+    keymap = Keymap()
+    if "buttons" in config:
+        keymap.buttons = {int(pin): str(keycode) for pin, keycode in config["buttons"].items()}
+    if "repeat" in config:
+        keymap.repeat = set(config["repeat"])
+    if config.get("group") is not None:
+        keymap.group = str(config["group"])
+    if "cast" in config:
+        keymap.cast = set(config["cast"])
+        unsupported = keymap.cast - cast_control.CAST_KEYCODES
+        if unsupported:
+            raise ValueError(f"These keys cannot be sent over Cast: {', '.join(sorted(unsupported))}")
+    if config.get("cast_device") is not None:
+        keymap.cast_device = str(config["cast_device"])
+
+    for name in ("debounce", "repeat_delay", "repeat_interval", "repeat_min_interval", "repeat_acceleration"):
+        if name in config:
+            value = config[name]
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"Invalid {name} in keymap: {value!r}")
+            setattr(keymap, name, float(value))
+    if not 0 < keymap.repeat_acceleration <= 1:
+        raise ValueError(f"repeat_acceleration must be in (0, 1], not {keymap.repeat_acceleration}")
+    if keymap.repeat and keymap.repeat_min_interval <= 0:
+        raise ValueError("repeat_min_interval must be positive")
+    return keymap
+
+
+def load_keymap(path: str = KEYMAP_PATH) -> Keymap:
+    """Reads the keymap file. A missing file means the default keymap.
+
+    Raises:
+        ValueError: If the file is not valid JSON or a setting is malformed.
+    """
+    try:
+        with open(path) as keymap_file:
+            return parse_keymap(json.load(keymap_file))
+    except FileNotFoundError:
+        return Keymap()
+
+
+class GpioBackend:
+    """Access to the GPIO pins the buttons are wired to (pulled down, high while pressed)."""
+
+    def start(self, pins: Iterable[int], on_edge: EdgeCallback):
+        """Configures the pins as inputs and starts reporting their edges.
+
+        Args:
+            pins: The pins to watch.
+            on_edge: Called with (pin, level, timestamp) for every edge, where level is True
+                for a rising edge and timestamp is on the time.monotonic() clock.
+        """
+        raise NotImplementedError
+
+    def read(self, pin: int) -> bool:
+        """Returns the current level of a pin."""
+        raise NotImplementedError
+
+    def close(self):
+        """Stops reporting edges and releases the pins."""
+
+
+class GpiodBackend(GpioBackend):
+    """Reads edges with libgpiod (python3-libgpiod 2.x), which timestamps them in the kernel."""
+
+    def __init__(self, chip: str = GPIO_CHIP):
+        self.chip = chip
+        self._request = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec("gpiod") is not None
+
+    def start(self, pins: Iterable[int], on_edge: EdgeCallback):
+        import gpiod
+        from gpiod.line import Bias, Edge
+
+        settings = gpiod.LineSettings(edge_detection=Edge.BOTH, bias=Bias.PULL_DOWN)
+        self._request = gpiod.request_lines(self.chip, consumer="adb-cast-remote",
+                                            config={tuple(pins): settings})
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(on_edge,), name="gpio-edges", daemon=True)
+        self._thread.start()
+
+    def _run(self, on_edge: EdgeCallback):
+        import gpiod
+
+        while not self._stop.is_set():
+            if not self._request.wait_edge_events(0.1):
+                continue
+            for event in self._request.read_edge_events():
+                # Edge timestamps come from CLOCK_MONOTONIC, the clock of time.monotonic()
+                on_edge(event.line_offset, event.event_type == gpiod.EdgeEvent.Type.RISING_EDGE,
+                        event.timestamp_ns / 1e9)
+
+    def read(self, pin: int) -> bool:
+        from gpiod.line import Value
+
+        return self._request.get_value(pin) == Value.ACTIVE
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(1)
+            self._thread = None
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+
+
+class RPiGpioBackend(GpioBackend):
+    """Reads edges with RPi.GPIO, timestamping them when its callback thread reports them."""
+
+    def __init__(self):
+        self._gpio = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec("RPi") is not None
+
+    def start(self, pins: Iterable[int], on_edge: EdgeCallback):
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        for pin in pins:
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)  # Pull-down resistor
+            # No bouncetime: debouncing is done from the edge timestamps instead
+            GPIO.add_event_detect(pin, GPIO.BOTH,
+                                  callback=lambda pin: on_edge(pin, bool(GPIO.input(pin)), time.monotonic()))
+
+    def read(self, pin: int) -> bool:
+        return bool(self._gpio.input(pin))
+
+    def close(self):
+        if self._gpio is not None:
+            self._gpio.cleanup()
+            self._gpio = None
+
+
+class SimulatedGpio(GpioBackend):
+    """GPIO pins driven from code instead of buttons, for tests and benchmarks."""
+
+    def __init__(self):
+        self.levels: Dict[int, bool] = {}
+        self._on_edge: Optional[EdgeCallback] = None
+
+    def start(self, pins: Iterable[int], on_edge: EdgeCallback):
+        self.levels = {pin: False for pin in pins}
+        self._on_edge = on_edge
+
+    def edge(self, pin: int, level: bool, timestamp: Optional[float] = None):
+        """Drives a pin to a level, reporting the edge synchronously."""
+        self.levels[pin] = level
+        if self._on_edge is not None:
+            self._on_edge(pin, level, time.monotonic() if timestamp is None else timestamp)
+
+    def press(self, pin: int, timestamp: Optional[float] = None, bounces: int = 0, bounce_gap: float = 0.001):
+        """Presses a button, with bounces extra pairs of edges as the contacts settle."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        for bounce in range(bounces):
+            self.edge(pin, True, timestamp + 2 * bounce * bounce_gap)
+            self.edge(pin, False, timestamp + (2 * bounce + 1) * bounce_gap)
+        self.edge(pin, True, timestamp + 2 * bounces * bounce_gap)
+
+    def release(self, pin: int, timestamp: Optional[float] = None):
+        """Releases a button."""
+        self.edge(pin, False, timestamp)
+
+    def read(self, pin: int) -> bool:
+        return self.levels.get(pin, False)
+
+    def close(self):
+        self._on_edge = None
+
+
+def default_backend() -> GpioBackend:
+    """Returns the best GPIO backend installed: libgpiod, then RPi.GPIO.
+
+    Raises:
+        RuntimeError: If neither is installed.
+    """
+    for backend in (GpiodBackend, RPiGpioBackend):
+        if backend.is_available():
+            return backend()
+    raise RuntimeError("Neither python3-libgpiod nor RPi.GPIO is installed. Use --simulate to run without a Pi.")
+
+
+class Debouncer:
+    """Filters contact bounce out of the edges of each pin, using the time of each edge.
+
+    An edge is accepted if it changes the pin's level and comes at least debounce seconds
+    after the last accepted edge of that pin. The first edge of a press is reported straight
+    away; only the bounces after it are dropped.
+    """
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.rejected = 0
+        self._last: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def accept(self, pin: int, level: bool, timestamp: float) -> bool:
+        """Returns True if the edge is a real change of the button's state."""
+        with self._lock:
+            last_level, last_timestamp = self._last.get(pin, (False, float("-inf")))
+            if level == last_level or timestamp < last_timestamp + self.debounce:
+                self.rejected += 1
+                return False
+            self._last[pin] = (level, timestamp)
+            return True
+
+    def level(self, pin: int) -> bool:
+        """Returns the level of the last accepted edge of a pin."""
+        with self._lock:
+            return self._last.get(pin, (False, 0.0))[0]
+
+    def settles_at(self, pin: int) -> float:
+        """Returns the time from which the next edge of a pin will be accepted."""
+        with self._lock:
+            return self._last.get(pin, (False, float("-inf")))[1] + self.debounce
+
+
+class ButtonInput:
+    """Reports debounced presses and releases of the buttons in a keymap, repeating held buttons.
+
+    Args:
+        backend: Where the buttons are read from.
+        keymap: The buttons to watch and how to debounce and repeat them.
+        on_press: Called with the pin of a button when it is pressed, and again for each repeat.
+        on_release: Called with the pin of a button when it is released.
+        no_repeat: Pins that must not repeat even if their keycode does, e.g. buttons with gestures.
+    """
+
+    def __init__(self, backend: GpioBackend, keymap: Keymap, on_press: Callable[[int], None],
+                 on_release: Optional[Callable[[int], None]] = None, no_repeat: Iterable[int] = ()):
+        self.backend = backend
+        self.keymap = keymap
+        self.on_press = on_press
+        self.on_release = on_release or (lambda pin: None)
+        self.repeating = keymap.repeating_pins() - set(no_repeat)
+        self.debouncer = Debouncer(keymap.debounce)
+        self.repeats = 0
+        self._held: Dict[int, threading.Event] = {}
+        self._settling: Dict[int, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts watching the buttons."""
+        self.backend.start(sorted(self.keymap.buttons), self._edge)
+
+    def _edge(self, pin: int, level: bool, timestamp: float):
+        if pin not in self.keymap.buttons:
+            return
+        if not self.debouncer.accept(pin, level, timestamp):
+            if level != self.debouncer.level(pin):
+                self._settle_later(pin, self.debouncer.settles_at(pin) - timestamp)
+            return
+
+        if level:
+            self.on_press(pin)
+            if pin in self.repeating:
+                self._start_repeating(pin)
+        else:
+            self._stop_repeating(pin)
+            self.on_release(pin)
+
+    def _settle_later(self, pin: int, delay: float):
+        # A quick tap can be released within the debounce time of its press. The release is
+        # dropped as a bounce, so the pin is read again once it has settled.
+        with self._lock:
+            if pin in self._settling:
+                return
+            timer = threading.Timer(max(0.0, delay), self._settle, (pin,))
+            timer.daemon = True
+            self._settling[pin] = timer
+        timer.start()
+
+    def _settle(self, pin: int):
+        with self._lock:
+            self._settling.pop(pin, None)
+        level = self.backend.read(pin)
+        if level != self.debouncer.level(pin):
+            self._edge(pin, level, max(time.monotonic(), self.debouncer.settles_at(pin)))
+
+    def _start_repeating(self, pin: int):
+        released = threading.Event()
+        with self._lock:
+            previous = self._held.get(pin)
+            if previous is not None:
+                previous.set()
+            self._held[pin] = released
+        threading.Thread(target=self._repeat, args=(pin, released), name=f"repeat-{pin}", daemon=True).start()
+
+    def _stop_repeating(self, pin: int):
+        with self._lock:
+            released = self._held.pop(pin, None)
+        if released is not None:
+            released.set()
+
+    def _repeat(self, pin: int, released: threading.Event):
+        for delay in self.keymap.repeat_delays():
+            if released.wait(delay):
+                return
+            self.repeats += 1
+            self.on_press(pin)
+
+    def close(self):
+        """Stops repeating held buttons and releases the GPIO pins."""
+        with self._lock:
+            held, self._held = list(self._held.values()), {}
+            settling, self._settling = list(self._settling.values()), {}
+        for released in held:
+            released.set()
+        for timer in settling:
+            timer.cancel()
+        self.backend.close()
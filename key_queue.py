@@ -0,0 +1,177 @@
+"""A bounded queue that batches rapid button presses into as few device commands as possible.
+
+The GPIO callback only puts the press on the queue and returns. A worker thread takes every
+press waiting at that moment and sends them as one command, so holding or mashing a button
+does not leave presses queued behind each other, landing on the TV seconds late.
+"""
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import event_log
+import metrics
+
+VOLUME_STEPS = {"KEYCODE_VOLUME_UP": 1, "KEYCODE_VOLUME_DOWN": -1}
+
+
+@dataclass
+class KeyPress:
+    """A button press waiting to be sent."""
+    keycode: str
+    pressed_at: float = field(default_factory=time.monotonic)
+
+
+def collapse_volume_steps(keycodes: List[str]) -> List[str]:
+    """Replaces each run of consecutive volume keys by its net number of steps.
+
+    For example, UP, UP, DOWN becomes a single UP, and UP, DOWN cancels out.
+    """
+    collapsed = []
+    net_steps = 0
+
+    def flush():
+        direction = "KEYCODE_VOLUME_UP" if net_steps > 0 else "KEYCODE_VOLUME_DOWN"
+        collapsed.extend([direction] * abs(net_steps))
+
+    for keycode in keycodes:
+        if keycode in VOLUME_STEPS:
+            net_steps += VOLUME_STEPS[keycode]
+        else:
+            flush()
+            net_steps = 0
+            collapsed.append(keycode)
+    flush()
+
+    return collapsed
+
+
+class KeyEventQueue:
+    """Sends queued key presses in batches from a worker thread.
+
+    Args:
+        send_batch: Sends a list of keycodes to the device in a single command.
+        max_size: The most presses that can wait at once. Presses beyond it are dropped.
+        max_age: Presses older than this many seconds when their turn comes are dropped.
+        max_batch: The most keycodes sent in a single command.
+    """
+
+    def __init__(self, send_batch: Callable[[List[str]], None], max_size: int = 32, max_age: float = 1.0,
+                 max_batch: int = 16):
+        self.send_batch = send_batch
+        self.max_age = max_age
+        self.max_batch = max_batch
+
+        self.sent = 0
+        self.batches = 0
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=1000)
+
+        self._queue: "queue.Queue[Optional[KeyPress]]" = queue.Queue(maxsize=max_size)
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self):
+        """Starts the worker thread."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="key-event-queue", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5):
+        """Sends the presses already queued, then stops the worker thread."""
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+
+    def press(self, keycode: str) -> bool:
+        """Queues a key press without blocking.
+
+        Returns:
+            False if the press was dropped because the queue is full.
+        """
+        try:
+            self._queue.put_nowait(KeyPress(keycode))
+        except queue.Full:
+            self.dropped_full += 1
+            metrics.inc("cast_remote_key_presses_dropped_total", reason="queue_full")
+            event_log.record(event_log.KEY_DROPPED, keycodes=[keycode], count=1, reason="queue_full")
+            return False
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def depth(self) -> int:
+        """The number of presses waiting to be sent."""
+        return self._queue.qsize()
+
+    def _next_batch(self) -> Optional[List[KeyPress]]:
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                press = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if press is None:
+                # Keep the stop marker for the next round
+                self._queue.put(None)
+                break
+            batch.append(press)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            now = time.monotonic()
+            fresh = [press for press in batch if now - press.pressed_at <= self.max_age]
+            self.dropped_stale += len(batch) - len(fresh)
+            if len(fresh) < len(batch):
+                metrics.inc("cast_remote_key_presses_dropped_total", len(batch) - len(fresh), reason="stale")
+                stale = [press.keycode for press in batch if now - press.pressed_at > self.max_age]
+                event_log.record(event_log.KEY_DROPPED, keycodes=stale, count=len(stale), reason="stale")
+
+            keycodes = collapse_volume_steps([press.keycode for press in fresh])
+            try:
+                if keycodes:
+                    self.send_batch(keycodes)
+            except Exception as exc:
+                self.failed += len(fresh)
+                event_log.record(event_log.KEY_FAILED, keycodes=keycodes, error=str(exc))
+                continue
+
+            sent_at = time.monotonic()
+            self.sent += len(fresh)
+            if keycodes:
+                self.batches += 1
+            self.latencies.extend(sent_at - press.pressed_at for press in fresh)
+            for press in fresh:
+                metrics.observe("cast_remote_key_press_to_send_seconds", sent_at - press.pressed_at)
+            if keycodes:
+                event_log.record(event_log.KEY_SENT, keycodes=keycodes, presses=len(fresh),
+                                 latency=sent_at - fresh[0].pressed_at)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns queue depth, drop counts and press-to-send latency (in seconds) so far."""
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "batches": self.batches,
+            "dropped_full": self.dropped_full,
+            "dropped_stale": self.dropped_stale,
+            "failed": self.failed,
+            "latency_p50": statistics.median(latencies) if latencies else 0.0,
+            "latency_p99": latencies[int(0.99 * (len(latencies) - 1))] if latencies else 0.0,
+        }
@@ -0,0 +1,186 @@
+"""Named key sequences ("macros") compiled into a single device-side shell command.
+
+Macros are defined in a JSON file (MACROS_PATH) alongside the buttons that trigger them:
+
+    {
+      "macros": {
+        "netflix_second_row": [
+          {"intent": {"component": "com.netflix.ninja/.MainActivity"}},
+          {"delay": 3},
+          {"key": "KEYCODE_DPAD_DOWN", "repeat": 2},
+          {"key": "KEYCODE_DPAD_CENTER"}
+        ],
+        "search_news": [{"key": "KEYCODE_SEARCH"}, {"delay": 1}, {"text": "news"}]
+      },
+      "buttons": {"27": {"long": "netflix_second_row", "double": "search_news"}}
+    }
+
+A step is one of:
+    {"key": KEYCODE, "repeat": N}    presses a key N times (default 1); only key steps repeat
+    {"text": TEXT}                   types text into the focused field
+    {"intent": {...}}                starts an activity with `am start`; accepts "action",
+                                     "data", "category" and "component"
+    {"delay": SECONDS}               waits before the next step
+
+A macro runs on the device as one shell command, so N steps cost one round trip instead of N.
+Consecutive key steps are merged into a single `input keyevent` invocation.
+
+Usage:
+    python3 macros.py list
+    python3 macros.py show NAME
+"""
+import json
+import os
+import re
+import shlex
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+MACROS_PATH = os.environ.get("CAST_REMOTE_MACROS", os.path.expanduser("~/.config/adb-cast-remote/macros.json"))
+GESTURES = ("long", "double", "triple")
+
+_KEYCODE = re.compile(r"^(KEYCODE_[A-Z0-9_]+|\d+)$")
+_INTENT_FLAGS = {"action": "-a", "data": "-d", "category": "-c", "component": "-n"}
+
+
+def _escape_input_text(text: str) -> str:
+    # `input text` splits its argument on spaces; it types %s as a space
+    return shlex.quote(text.replace(" ", "%s"))
+
+
+def compile_macro(steps: List[dict]) -> str:
+    """Compiles the steps of a macro into a single line of device shell.
+
+    Args:
+        steps: The steps of the macro, as described in the module docstring.
+
+    Returns:
+        A shell command that runs every step in order, e.g.
+        'input keyevent KEYCODE_DPAD_DOWN KEYCODE_DPAD_DOWN; sleep 1; input text news'.
+
+    Raises:
+        ValueError: If a step is malformed.
+    """
+    commands = []
+    pending_keys: List[str] = []
+
+    def flush_keys():
+        if pending_keys:
+            commands.append("input keyevent " + " ".join(pending_keys))
+            pending_keys.clear()
+
+    for step in steps:
+        if not isinstance(step, dict) or len(set(step) - {"repeat"}) != 1:
+            raise ValueError(f"Malformed macro step: {step!r}")
+
+        if "key" in step:
+            keycode = str(step["key"])
+            repeat = step.get("repeat", 1)
+            if not _KEYCODE.match(keycode):
+                raise ValueError(f"Invalid keycode in macro: {keycode!r}")
+            if not isinstance(repeat, int) or repeat < 1:
+                raise ValueError(f"Invalid repeat count for {keycode}: {repeat!r}")
+            pending_keys.extend([keycode] * repeat)
+            continue
+
+        if "repeat" in step:
+            raise ValueError(f"Only key steps can repeat: {step!r}")
+        flush_keys()
+        if "text" in step:
+            commands.append("input text " + _escape_input_text(str(step["text"])))
+        elif "delay" in step:
+            delay = step["delay"]
+            if not isinstance(delay, (int, float)) or delay < 0:
+                raise ValueError(f"Invalid delay in macro: {delay!r}")
+            commands.append(f"sleep {delay:g}")
+        elif "intent" in step:
+            intent = step["intent"]
+            if not isinstance(intent, dict) or not intent or set(intent) - set(_INTENT_FLAGS):
+                raise ValueError(f"Malformed intent in macro: {intent!r}")
+            arguments = [f"{_INTENT_FLAGS[key]} {shlex.quote(str(value))}" for key, value in intent.items()]
+            commands.append("am start " + " ".join(arguments))
+        else:
+            raise ValueError(f"Unknown macro step: {step!r}")
+
+    flush_keys()
+    if not commands:
+        raise ValueError("A macro needs at least one step")
+    return "; ".join(commands)
+
+
+@dataclass
+class MacroConfig:
+    """The macros and the button gestures bound to them.
+
+    Attributes:
+        macros: The compiled shell command of each macro, by name.
+        buttons: For each GPIO pin, the macro triggered by each gesture ('long', 'double', 'triple').
+    """
+    macros: Dict[str, str] = field(default_factory=dict)
+    buttons: Dict[int, Dict[str, str]] = field(default_factory=dict)
+
+    def script(self, name: str) -> str:
+        """Returns the shell command of a macro.
+
+        Raises:
+            RuntimeError: If there is no macro with that name.
+        """
+        try:
+            return self.macros[name]
+        except KeyError:
+            raise RuntimeError(f"Unknown macro: {name}") from None
+
+
+def parse_config(config: dict) -> MacroConfig:
+    """Compiles the macros and validates the button bindings of a macro file.
+
+    Raises:
+        ValueError: If a macro or binding is malformed.
+    """
+    macros = {name: compile_macro(steps) for name, steps in config.get("macros", {}).items()}
+
+    buttons = {}
+    for pin, gestures in config.get("buttons", {}).items():
+        for gesture, name in gestures.items():
+            if gesture not in GESTURES:
+                raise ValueError(f"Unknown gesture {gesture!r} for button {pin}")
+            if name not in macros:
+                raise ValueError(f"Button {pin} is bound to unknown macro {name!r}")
+        buttons[int(pin)] = dict(gestures)
+
+    return MacroConfig(macros, buttons)
+
+
+def load_config(path: str = MACROS_PATH) -> MacroConfig:
+    """Reads the macro file. A missing file means no macros.
+
+    Raises:
+        ValueError: If the file is not valid JSON or a macro is malformed.
+    """
+    try:
+        with open(path) as macros_file:
+            return parse_config(json.load(macros_file))
+    except FileNotFoundError:
+        return MacroConfig()
+
+
+def main(argv: List[str]):
+    config = load_config()
+
+    if argv[:1] == ["list"]:
+        for name in sorted(config.macros):
+            print(name)
+    elif argv[:1] == ["show"] and len(argv) == 2:
+        try:
+            print(config.script(argv[1]))
+        except RuntimeError as exc:
+            print(exc, file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(__doc__.strip().split("\n\n")[-1], file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
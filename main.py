@@ -1,4 +1,5 @@
-import subprocess
+import discovery
+import subnet_sweep
 
 # Note: We are assuming only one Chromecast on the local network right now
 def find_chromecast_on_network() -> str:
@@ -6,14 +7,18 @@ def find_chromecast_on_network() -> str:
     Finds the IP address of the Chromecast on network
 
     Returns:
-        str: The IP address of the Chromecast on network
+        str: The IP address of the Chromecast on network, or an empty string if none was found
     """
-    cmd = "avahi-browse -rt _googlecast._tcp | grep -E 'IPv4|address' | awk '{print $3}' | grep '\.' | tr -d '[]'"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    services = discovery.discover()
 
-    print(result)
+    print(services)
 
-    return "Done"
+    if not services:
+        # Multicast may be filtered on this network; look for ADB on every local address instead
+        addresses = subnet_sweep.find_adb_devices()
+        return addresses[0] if addresses else ""
+
+    return services[0].ip_address
 
 
 
@@ -0,0 +1,306 @@
+"""An asyncio mDNS browser for Google Cast-enabled devices (_googlecast._tcp).
+
+Replaces the `avahi-browse -rt _googlecast._tcp | grep | awk | tr` pipeline. The query is
+sent from an ephemeral port, so devices answer by unicast straight to this socket (RFC 6762,
+section 6.7) and the browser can run alongside avahi-daemon without binding port 5353.
+
+Usage:
+    python3 mdns_browser.py [--field ip|uuid|name] [--timeout SECONDS]
+"""
+import asyncio
+import os
+import socket
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+MDNS_GROUP = "224.0.0.251"
+MDNS_PORT = 5353
+SERVICE_TYPE = "_googlecast._tcp.local"
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_SRV = 33
+CLASS_IN = 1
+UNICAST_RESPONSE = 0x8000
+
+# Overrides where queries are sent as "host:port", e.g. to ask a single host by unicast
+QUERY_ADDRESS_ENV = "CAST_REMOTE_MDNS_ADDRESS"
+
+QUERY_INTERVAL = 1.0
+# Responders delay shared answers by 20-120 ms (RFC 6762, section 6), so every device on the
+# network has normally answered shortly after the first one
+SETTLE_TIME = 0.25
+
+
+@dataclass(frozen=True)
+class CastService:
+    """A Google Cast-enabled device found on the local network."""
+    ip_address: str
+    port: int
+    uuid: str
+    friendly_name: str
+    instance_name: str
+
+
+@dataclass
+class _Record:
+    name: str
+    rtype: int
+    data: object
+
+
+def _read_name(packet: bytes, offset: int) -> Tuple[str, int]:
+    """Reads a possibly compressed domain name, returning it and the offset after it."""
+    labels = []
+    end_offset = None
+    jumps = 0
+
+    while True:
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | packet[offset + 1]
+            jumps += 1
+            if jumps > 32:
+                raise ValueError("Compression loop in mDNS name")
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(packet[offset:offset + length].decode(errors="replace"))
+        offset += length
+
+    return ".".join(labels), end_offset if end_offset is not None else offset
+
+
+def _encode_name(name: str) -> bytes:
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        raw = label.encode()
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b"\x00"
+
+
+def build_query(name: str = SERVICE_TYPE, rtype: int = TYPE_PTR) -> bytes:
+    """Builds an mDNS query packet asking for a unicast response."""
+    header = struct.pack("!HHHHHH", 0, 0, 1, 0, 0, 0)
+    return header + _encode_name(name) + struct.pack("!HH", rtype, CLASS_IN | UNICAST_RESPONSE)
+
+
+def parse_records(packet: bytes) -> List[_Record]:
+    """Parses every resource record in an mDNS response.
+
+    Args:
+        packet: The raw mDNS packet.
+
+    Returns:
+        The A, PTR, SRV and TXT records found in the answer, authority and additional
+        sections. Other record types are skipped.
+
+    Raises:
+        ValueError: If the packet is truncated or malformed.
+    """
+    try:
+        _, _, qdcount, ancount, nscount, arcount = struct.unpack_from("!HHHHHH", packet, 0)
+        offset = 12
+
+        for _ in range(qdcount):
+            _, offset = _read_name(packet, offset)
+            offset += 4
+
+        records = []
+        for _ in range(ancount + nscount + arcount):
+            name, offset = _read_name(packet, offset)
+            rtype, _, _, rdlength = struct.unpack_from("!HHIH", packet, offset)
+            offset += 10
+            rdata_offset = offset
+            offset += rdlength
+            if offset > len(packet):
+                raise ValueError("Truncated mDNS record")
+
+            if rtype == TYPE_A and rdlength == 4:
+                data = socket.inet_ntoa(packet[rdata_offset:offset])
+            elif rtype == TYPE_PTR:
+                data, _ = _read_name(packet, rdata_offset)
+            elif rtype == TYPE_SRV:
+                _, _, port = struct.unpack_from("!HHH", packet, rdata_offset)
+                target, _ = _read_name(packet, rdata_offset + 6)
+                data = (port, target)
+            elif rtype == TYPE_TXT:
+                data = _parse_txt(packet[rdata_offset:offset])
+            else:
+                continue
+            records.append(_Record(name.lower(), rtype, data))
+    except (IndexError, struct.error) as exc:
+        raise ValueError("Malformed mDNS packet") from exc
+
+    return records
+
+
+def _parse_txt(rdata: bytes) -> Dict[str, str]:
+    entries = {}
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        entry = rdata[offset + 1:offset + 1 + length].decode(errors="replace")
+        offset += 1 + length
+        key, _, value = entry.partition("=")
+        entries[key.lower()] = value
+    return entries
+
+
+class _CastBrowserProtocol(asyncio.DatagramProtocol):
+    """Collects records from mDNS responses and resolves them into CastServices."""
+
+    def __init__(self, on_service: Callable[[CastService], None]):
+        self.on_service = on_service
+        self.instances = set()
+        self.srv: Dict[str, Tuple[int, str]] = {}
+        self.txt: Dict[str, Dict[str, str]] = {}
+        self.addresses: Dict[str, str] = {}
+        self.found: Dict[str, CastService] = {}
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            records = parse_records(data)
+        except ValueError:
+            return
+
+        for record in records:
+            if record.rtype == TYPE_PTR and record.name == SERVICE_TYPE.lower():
+                self.instances.add(record.data.lower())
+            elif record.rtype == TYPE_SRV:
+                port, target = record.data
+                self.srv[record.name] = (port, target.lower())
+            elif record.rtype == TYPE_TXT:
+                self.txt[record.name] = record.data
+            elif record.rtype == TYPE_A:
+                self.addresses[record.name] = record.data
+
+        self._resolve()
+
+    def _resolve(self):
+        for instance in self.instances:
+            if instance in self.found or instance not in self.srv:
+                continue
+            port, target = self.srv[instance]
+            ip_address = self.addresses.get(target)
+            if ip_address is None:
+                continue
+            txt = self.txt.get(instance, {})
+            service = CastService(ip_address=ip_address, port=port,
+                                  uuid=txt.get("id", target.split(".")[0]),
+                                  friendly_name=txt.get("fn", ""),
+                                  instance_name=instance)
+            self.found[instance] = service
+            self.on_service(service)
+
+    def unresolved_targets(self) -> List[str]:
+        return [self.srv[instance][1] for instance in self.instances
+                if instance in self.srv and self.srv[instance][1] not in self.addresses]
+
+
+def _query_address() -> Tuple[str, int]:
+    override = os.environ.get(QUERY_ADDRESS_ENV)
+    if override:
+        host, _, port = override.rpartition(":")
+        return host, int(port)
+    return MDNS_GROUP, MDNS_PORT
+
+
+def _open_query_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+    sock.bind(("", 0))
+    sock.setblocking(False)
+    return sock
+
+
+async def browse(timeout: float = 3.0, first_only: bool = False, settle_time: float = SETTLE_TIME,
+                 address: Optional[Tuple[str, int]] = None) -> List[CastService]:
+    """Browses the local network for Google Cast-enabled devices.
+
+    Returns as soon as the devices have answered instead of waiting for the full timeout:
+    immediately after the first device if first_only is set, otherwise settle_time seconds
+    after the first device, by which time every other device has normally answered too.
+
+    Args:
+        timeout: The maximum time in seconds to wait for any device to answer.
+        first_only: Whether to return as soon as a single device has been found.
+        settle_time: Seconds to keep listening for other devices after the first answer.
+        address: Where to send the query. Defaults to the address in the
+                 CAST_REMOTE_MDNS_ADDRESS environment variable, or the mDNS multicast group.
+
+    Returns:
+        The Cast-enabled devices that answered, in the order they were found.
+    """
+    if address is None:
+        address = _query_address()
+
+    loop = asyncio.get_running_loop()
+    first_found = loop.create_future()
+
+    def on_service(service: CastService):
+        if not first_found.done():
+            first_found.set_result(service)
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _CastBrowserProtocol(on_service), sock=_open_query_socket())
+
+    deadline = loop.time() + timeout
+    try:
+        transport.sendto(build_query(), address)
+        next_query = loop.time() + QUERY_INTERVAL
+
+        while loop.time() < deadline:
+            await asyncio.wait([first_found], timeout=min(next_query, deadline) - loop.time())
+            if first_found.done():
+                break
+            if loop.time() >= next_query:
+                transport.sendto(build_query(), address)
+                # Ask for addresses that were left out of the SRV answers
+                for target in protocol.unresolved_targets():
+                    transport.sendto(build_query(target, TYPE_A), address)
+                next_query = loop.time() + QUERY_INTERVAL
+
+        if first_found.done() and not first_only:
+            await asyncio.sleep(max(0.0, min(settle_time, deadline - loop.time())))
+    finally:
+        transport.close()
+
+    return list(protocol.found.values())
+
+
+def discover_cast_devices(timeout: float = 3.0, first_only: bool = False) -> List[CastService]:
+    """Blocking wrapper around browse() for callers without an event loop."""
+    return asyncio.run(browse(timeout=timeout, first_only=first_only))
+
+
+def main():
+    # Only the command line needs argparse; keep it out of every importer's startup time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find Google Cast-enabled devices on the local network.")
+    parser.add_argument("--field", choices=["ip", "uuid", "name"], default="ip")
+    parser.add_argument("--timeout", type=float, default=3.0)
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    services = discover_cast_devices(timeout=args.timeout)
+    for service in services:
+        print({"ip": service.ip_address, "uuid": service.uuid, "name": service.friendly_name}[args.field])
+
+    if not services:
+        raise SystemExit(f"No Google Cast-enabled devices found after {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Lightweight timers and counters for the hot paths, exported in Prometheus text format.
+
+Metrics are off by default. While they are off, timed() and inc() return after a single
+check of a module flag, so instrumented code costs next to nothing.
+
+Usage:
+    metrics.enable()
+    with metrics.timed("cast_remote_connect_seconds"):
+        ...
+    metrics.inc("cast_remote_connect_outcomes_total", outcome="refused")
+    metrics.serve(9464)              # or metrics.write_file(path)
+"""
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], "_Histogram"] = {}
+_null_timer = contextlib.nullcontext()
+
+
+class _Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def enable():
+    """Starts recording metrics."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops recording metrics and forgets everything recorded so far."""
+    global _enabled
+    _enabled = False
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _key(name: str, labels: Dict[str, str]):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Adds to a counter, e.g. inc('cast_remote_connect_outcomes_total', outcome='refused')."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    """Records a value (usually a duration in seconds) in a histogram."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(value)
+
+
+def timed(name: str, **labels):
+    """Returns a context manager that records how long its block took in a histogram."""
+    if not _enabled:
+        return _null_timer
+    return _Timer(name, labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render() -> str:
+    """Returns every metric recorded so far in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def write_file(path: str):
+    """Writes the metrics to a file atomically, e.g. for node_exporter's textfile collector."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(render())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """Enables metrics and serves them at http://host:port/metrics from a background thread.
+
+    Returns:
+        The http.server.ThreadingHTTPServer serving them.
+    """
+    # http.server pulls in the email and http.client packages; only load it when serving
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    enable()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
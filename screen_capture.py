@@ -0,0 +1,441 @@
+"""A live preview of what the TV shows, for the controller's display or a web browser.
+
+Frames come from `screencap` on the device through the ADB server's exec: service, which
+streams the raw framebuffer without the line ending translation of shell:. Each frame is
+read with recv_into() straight into a buffer reused for every frame, downscaled by keeping
+every Nth pixel, and compared with the previous frame in tiles, so only the tiles that
+changed are passed on. The frame rate is capped so the preview does not keep the device
+busy.
+
+Usage:
+    python3 screen_capture.py IP_ADDRESS [--scale N] [--fps FPS] [--tile-size PIXELS] [--port PORT]
+"""
+import socket
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import adb_client
+import metrics
+
+DEFAULT_SCALE = 4
+DEFAULT_MAX_FPS = 5.0
+DEFAULT_TILE_SIZE = 16
+PREVIEW_PORT = 8090
+
+# screencap's raw output starts with width, height and pixel format, and since Android 9
+# also a color space, all little-endian 32-bit integers
+_RAW_HEADER = struct.Struct("<3I")
+_COLOR_SPACE_SIZE = 4
+# Pixel format: (bytes per pixel, offsets of red, green and blue in a pixel)
+PIXEL_FORMATS = {
+    1: (4, (0, 1, 2)),  # RGBA_8888
+    2: (4, (0, 1, 2)),  # RGBX_8888
+    3: (3, (0, 1, 2)),  # RGB_888
+    5: (4, (2, 1, 0)),  # BGRA_8888
+}
+# Preview updates: sequence number, width, height and tile count, then each tile's x, y,
+# width and height followed by its RGB pixels
+_UPDATE_HEADER = struct.Struct("<IHHH")
+_TILE_HEADER = struct.Struct("<4H")
+
+
+class CaptureError(RuntimeError):
+    """Raised when the device sends a frame that cannot be read."""
+
+
+@dataclass
+class RawFrame:
+    """A framebuffer as sent by screencap.
+
+    Attributes:
+        width: The width in pixels.
+        height: The height in pixels.
+        pixel_format: One of PIXEL_FORMATS.
+        buffer: The buffer holding the pixels, reused for the next frame.
+        offset: Where the pixels start in the buffer.
+    """
+    width: int
+    height: int
+    pixel_format: int
+    buffer: bytearray
+    offset: int
+
+
+@dataclass
+class Tile:
+    """A rectangle of a frame, with its pixels as RGB bytes row by row."""
+    x: int
+    y: int
+    width: int
+    height: int
+    data: bytes
+
+
+@dataclass
+class FrameUpdate:
+    """The tiles of a downscaled frame that differ from the frame before.
+
+    Attributes:
+        width: The width of the downscaled frame in pixels.
+        height: The height of the downscaled frame in pixels.
+        tiles: The tiles that changed. Every tile of the frame if keyframe is set.
+        keyframe: Whether there was no earlier frame of the same size to compare with.
+        raw_bytes: The size of the framebuffer read from the device.
+    """
+    width: int
+    height: int
+    tiles: List[Tile]
+    keyframe: bool
+    raw_bytes: int = 0
+
+    @property
+    def tile_bytes(self) -> int:
+        return sum(len(tile.data) for tile in self.tiles)
+
+
+def _recv_exactly_into(sock: socket.socket, view: memoryview) -> int:
+    """Fills a buffer from a socket, stopping early if the stream ends.
+
+    Returns:
+        How many bytes were received.
+    """
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            break
+        received += count
+    return received
+
+
+def read_raw_frame(sock: socket.socket, buffer: bytearray) -> RawFrame:
+    """Reads the output of `screencap` (without -p) into a buffer, growing it if needed.
+
+    Raises:
+        CaptureError: If the pixel format is unknown or the frame is cut short.
+    """
+    header = bytearray(_RAW_HEADER.size)
+    if _recv_exactly_into(sock, memoryview(header)) < len(header):
+        raise CaptureError("The device sent no frame")
+    width, height, pixel_format = _RAW_HEADER.unpack(header)
+    if pixel_format not in PIXEL_FORMATS:
+        raise CaptureError(f"Unsupported pixel format {pixel_format}")
+
+    size = width * height * PIXEL_FORMATS[pixel_format][0]
+    if len(buffer) < size + _COLOR_SPACE_SIZE:
+        buffer.extend(bytes(size + _COLOR_SPACE_SIZE - len(buffer)))
+    received = _recv_exactly_into(sock, memoryview(buffer)[:size + _COLOR_SPACE_SIZE])
+    # Only the total length tells whether the header had the color space field
+    if received == size + _COLOR_SPACE_SIZE:
+        return RawFrame(width, height, pixel_format, buffer, _COLOR_SPACE_SIZE)
+    if received == size:
+        return RawFrame(width, height, pixel_format, buffer, 0)
+    raise CaptureError(f"Truncated frame: {received} of {size} bytes")
+
+
+def downscale(frame: RawFrame, scale: int, out: bytearray) -> Tuple[int, int]:
+    """Shrinks a frame by keeping every scale-th pixel of every scale-th row, as RGB bytes.
+
+    Args:
+        frame: The frame to shrink.
+        scale: How many times smaller the result is in each direction.
+        out: Receives the pixels; resized to fit if needed.
+
+    Returns:
+        The width and height of the result.
+    """
+    bytes_per_pixel, channels = PIXEL_FORMATS[frame.pixel_format]
+    width = (frame.width + scale - 1) // scale
+    height = (frame.height + scale - 1) // scale
+    if len(out) != width * height * 3:
+        out[:] = bytes(width * height * 3)
+
+    row_size = frame.width * bytes_per_pixel
+    out_row_size = width * 3
+    step = bytes_per_pixel * scale
+    buffer = frame.buffer
+    for out_row, y in enumerate(range(0, frame.height, scale)):
+        row_start = frame.offset + y * row_size
+        row_end = row_start + row_size
+        out_start = out_row * out_row_size
+        # Extended slices copy one color channel of the whole row at a time
+        for index, channel in enumerate(channels):
+            out[out_start + index:out_start + out_row_size:3] = buffer[row_start + channel:row_end:step]
+    return width, height
+
+
+def tile_data(frame: bytearray, width: int, x: int, y: int, tile_width: int, tile_height: int) -> bytes:
+    """Copies the RGB pixels of a rectangle of a frame, row by row."""
+    row_size = width * 3
+    return b"".join(frame[(y + row) * row_size + x * 3:(y + row) * row_size + (x + tile_width) * 3]
+                    for row in range(tile_height))
+
+
+class TileDiffer:
+    """Finds the tiles of each frame that changed since the frame before.
+
+    Args:
+        tile_size: The width and height of a tile in pixels.
+    """
+
+    def __init__(self, tile_size: int = DEFAULT_TILE_SIZE):
+        self.tile_size = tile_size
+        self._previous: Optional[bytearray] = None
+        self._previous_size: Tuple[int, int] = (0, 0)
+
+    def reset(self):
+        """Forgets the previous frame, so the next one is a keyframe."""
+        self._previous = None
+
+    def diff(self, frame: bytearray, width: int, height: int) -> FrameUpdate:
+        """Compares a frame with the previous one.
+
+        The frame is kept for the next comparison, so the caller must not change it until
+        the next call; two buffers used in turn avoid copying it.
+        """
+        size = self.tile_size
+        columns = (width + size - 1) // size
+        keyframe = self._previous is None or self._previous_size != (width, height)
+        row_size = width * 3
+
+        if keyframe:
+            changed = {(column, row) for row in range((height + size - 1) // size) for column in range(columns)}
+        else:
+            previous = self._previous
+            changed = set()
+            for y in range(height):
+                start = y * row_size
+                # Most rows of a menu or a paused video are unchanged: one comparison each
+                if frame[start:start + row_size] == previous[start:start + row_size]:
+                    continue
+                for column in range(columns):
+                    if (column, y // size) in changed:
+                        continue
+                    tile_start = start + column * size * 3
+                    tile_end = min(tile_start + size * 3, start + row_size)
+                    if frame[tile_start:tile_end] != previous[tile_start:tile_end]:
+                        changed.add((column, y // size))
+
+        tiles = []
+        for column, row in sorted(changed, key=lambda tile: (tile[1], tile[0])):
+            x, y = column * size, row * size
+            tile_width, tile_height = min(size, width - x), min(size, height - y)
+            tiles.append(Tile(x, y, tile_width, tile_height, tile_data(frame, width, x, y, tile_width, tile_height)))
+
+        self._previous = frame
+        self._previous_size = (width, height)
+        return FrameUpdate(width, height, tiles, keyframe)
+
+
+class ScreenCapture:
+    """Captures a device's screen as a stream of changed tiles.
+
+    Args:
+        serial: The serial of the device for the ADB server, e.g. '192.168.1.80:5555'.
+        client: The ADB server client. Defaults to the one shared with device_utils.
+        scale: How many times smaller the preview is than the screen in each direction.
+        max_fps: The most frames captured per second.
+        tile_size: The width and height of a tile in pixels of the preview.
+    """
+
+    def __init__(self, serial: str, client: Optional[adb_client.AdbClient] = None, scale: int = DEFAULT_SCALE,
+                 max_fps: float = DEFAULT_MAX_FPS, tile_size: int = DEFAULT_TILE_SIZE):
+        if scale < 1:
+            raise ValueError("scale must be at least 1")
+        if max_fps <= 0:
+            raise ValueError("max_fps must be positive")
+        self.serial = serial
+        self.client = client or adb_client.default_client()
+        self.scale = scale
+        self.max_fps = max_fps
+        self.differ = TileDiffer(tile_size)
+        self._raw = bytearray()
+        # The differ keeps the last frame, so frames are downscaled into two buffers in turn
+        self._frames = [bytearray(), bytearray()]
+        self._next_frame = 0
+        self._stopped = threading.Event()
+
+    def capture(self) -> FrameUpdate:
+        """Captures one frame and returns the tiles that changed since the last one.
+
+        Raises:
+            adb_client.AdbError: If the device cannot be reached.
+            CaptureError: If the frame cannot be read.
+        """
+        with metrics.timed("cast_remote_capture_seconds"):
+            with self.client.open_service(self.serial, "exec:screencap") as sock:
+                raw = read_raw_frame(sock, self._raw)
+            frame = self._frames[self._next_frame]
+            self._next_frame ^= 1
+            width, height = downscale(raw, self.scale, frame)
+            update = self.differ.diff(frame, width, height)
+        update.raw_bytes = raw.width * raw.height * PIXEL_FORMATS[raw.pixel_format][0]
+        metrics.inc("cast_remote_capture_frames_total")
+        metrics.inc("cast_remote_capture_tile_bytes_total", update.tile_bytes)
+        return update
+
+    def stream(self) -> Iterator[FrameUpdate]:
+        """Captures frames at up to max_fps until stop() is called.
+
+        Only frames with changed tiles are yielded.
+        """
+        interval = 1 / self.max_fps
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            update = self.capture()
+            if update.tiles:
+                yield update
+            self._stopped.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stopped.set()
+
+
+def encode_update(sequence: int, width: int, height: int, tiles: List[Tile]) -> bytes:
+    """Packs tiles for the web preview (see _UPDATE_HEADER)."""
+    parts = [_UPDATE_HEADER.pack(sequence, width, height, len(tiles))]
+    for tile in tiles:
+        parts.append(_TILE_HEADER.pack(tile.x, tile.y, tile.width, tile.height))
+        parts.append(tile.data)
+    return b"".join(parts)
+
+
+@dataclass
+class Preview:
+    """The latest preview frame, with which capture last changed each tile.
+
+    Viewers ask for the tiles changed since the last sequence number they saw, so a slow
+    viewer gets every tile it missed in one reply instead of every update in between.
+    """
+    width: int = 0
+    height: int = 0
+    sequence: int = 0
+    tiles: Dict[Tuple[int, int], Tuple[int, Tile]] = field(default_factory=dict)
+    changed: threading.Condition = field(default_factory=threading.Condition)
+
+    def apply(self, update: FrameUpdate):
+        with self.changed:
+            self.sequence += 1
+            if update.keyframe:
+                self.tiles = {}
+                self.width, self.height = update.width, update.height
+            for tile in update.tiles:
+                self.tiles[(tile.x, tile.y)] = (self.sequence, tile)
+            self.changed.notify_all()
+
+    def since(self, sequence: int, timeout: float = 10.0) -> bytes:
+        """Waits for tiles newer than a sequence number and returns them encoded.
+
+        A sequence number of 0, or one from before the last keyframe, gets the whole frame.
+        """
+        with self.changed:
+            if sequence > self.sequence:
+                # The viewer saw an earlier capture, before this process started
+                sequence = 0
+            self.changed.wait_for(lambda: self.sequence > sequence, timeout)
+            tiles = [tile for changed_at, tile in self.tiles.values() if changed_at > sequence]
+            return encode_update(self.sequence, self.width, self.height, tiles)
+
+
+_PREVIEW_PAGE = b"""<!DOCTYPE html>
+<title>TV preview</title>
+<canvas id="screen" style="width: 100%; image-rendering: pixelated"></canvas>
+<script>
+const canvas = document.getElementById("screen"), context = canvas.getContext("2d");
+async function poll(since) {
+  const data = new DataView(await (await fetch("/tiles?since=" + since)).arrayBuffer());
+  const width = data.getUint16(4, true), height = data.getUint16(6, true);
+  if (canvas.width != width || canvas.height != height) { canvas.width = width; canvas.height = height; }
+  let offset = 10;
+  for (let count = data.getUint16(8, true); count > 0; count--) {
+    const x = data.getUint16(offset, true), y = data.getUint16(offset + 2, true);
+    const image = context.createImageData(data.getUint16(offset + 4, true), data.getUint16(offset + 6, true));
+    offset += 8;
+    for (let pixel = 0; pixel < image.data.length; pixel += 4, offset += 3) {
+      image.data.set([data.getUint8(offset), data.getUint8(offset + 1), data.getUint8(offset + 2), 255], pixel);
+    }
+    context.putImageData(image, x, y);
+  }
+  poll(data.getUint32(0, true));
+}
+poll(0).catch(() => setTimeout(() => location.reload(), 2000));
+</script>
+"""
+
+
+def serve(preview: Preview, port: int = PREVIEW_PORT, host: str = "127.0.0.1"):
+    """Serves the preview at http://host:port/ from a background thread.
+
+    Returns:
+        The http.server.ThreadingHTTPServer serving it.
+    """
+    # http.server pulls in the email and http.client packages; only load it when serving
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/":
+                body, content_type = _PREVIEW_PAGE, "text/html"
+            elif url.path == "/tiles":
+                try:
+                    since = int(parse_qs(url.query).get("since", ["0"])[0])
+                except ValueError:
+                    self.send_error(400)
+                    return
+                body, content_type = preview.since(since), "application/octet-stream"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), PreviewHandler)
+    threading.Thread(target=server.serve_forever, name="preview-http", daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a live preview of a device's screen over HTTP.")
+    parser.add_argument("ip_address")
+    parser.add_argument("--scale", type=int, default=DEFAULT_SCALE)
+    parser.add_argument("--fps", type=float, default=DEFAULT_MAX_FPS)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--port", type=int, default=PREVIEW_PORT)
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Address to listen on. The preview has no authentication, so only use e.g. "
+                             "0.0.0.0 on a trusted network")
+    args = parser.parse_args()
+
+    capture = ScreenCapture(f"{args.ip_address}:5555", scale=args.scale, max_fps=args.fps,
+                            tile_size=args.tile_size)
+    preview = Preview()
+    serve(preview, args.port, args.host)
+    print(f"Serving the preview at http://{args.host}:{args.port}/")
+    try:
+        for update in capture.stream():
+            preview.apply(update)
+    except (adb_client.AdbError, CaptureError, OSError) as exc:
+        print(f"Capture failed: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Finds devices with ADB over TCP by probing every address of the local subnet at once.
+
+This is the fallback for networks that filter multicast (guest VLANs, some mesh routers),
+where mDNS discovery finds nothing. The subnet is taken from the host's network interfaces.
+Every address is probed on TCP port 5555 concurrently, at most `concurrency` at a time, so
+sweeping a /24 takes about one connect timeout. An address that accepts the connection is
+only reported if it answers an ADB handshake.
+
+Usage:
+    python3 subnet_sweep.py [--network CIDR ...] [--timeout SECONDS] [--concurrency N]
+"""
+import asyncio
+import ipaddress
+import os
+import socket
+import struct
+import sys
+from typing import Iterable, List, Optional, Sequence
+
+import metrics
+
+ADB_PORT = 5555
+PROBE_TIMEOUT = 1.0
+CONCURRENCY = 256
+# Wider networks are narrowed to the /24 around the host's address rather than swept whole
+MAX_SWEEP_PREFIX = 22
+NETWORKS_ENV = "CAST_REMOTE_SWEEP_NETWORKS"
+
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+
+# ADB wire protocol: a 24-byte little-endian header of command, arg0, arg1, payload length,
+# payload checksum and command ^ 0xffffffff, followed by the payload
+A_CNXN = 0x4E584E43
+A_AUTH = 0x48545541
+A_STLS = 0x534C5453
+A_VERSION = 0x01000001
+MAX_PAYLOAD = 256 * 1024
+_HEADER = struct.Struct("<6I")
+_HANDSHAKE_ANSWERS = {A_CNXN: "device", A_AUTH: "unauthorized", A_STLS: "tls"}
+
+
+def _interface_address(sock: socket.socket, name: str, request: int) -> str:
+    import fcntl
+
+    ifreq = struct.pack("256s", name.encode()[:15])
+    return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), request, ifreq)[20:24])
+
+
+def interface_networks() -> List[ipaddress.IPv4Interface]:
+    """Returns the IPv4 address and netmask of each network interface of the host (Linux only)."""
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            try:
+                address = _interface_address(sock, name, SIOCGIFADDR)
+                netmask = _interface_address(sock, name, SIOCGIFNETMASK)
+            except OSError:
+                # The interface is down or has no IPv4 address
+                continue
+            interfaces.append(ipaddress.IPv4Interface(f"{address}/{netmask}"))
+    return interfaces
+
+
+def sweep_networks(interfaces: Iterable[ipaddress.IPv4Interface]) -> List[ipaddress.IPv4Network]:
+    """Returns the networks worth sweeping from the host's interfaces.
+
+    Loopback and link-local interfaces are skipped, and networks wider than
+    MAX_SWEEP_PREFIX are narrowed to the /24 around the host's address.
+    """
+    networks = []
+    for interface in interfaces:
+        if interface.ip.is_loopback or interface.ip.is_link_local:
+            continue
+        network = interface.network
+        if network.prefixlen < MAX_SWEEP_PREFIX:
+            network = ipaddress.IPv4Interface(f"{interface.ip}/24").network
+        if network not in networks:
+            networks.append(network)
+    return networks
+
+
+def local_networks() -> List[ipaddress.IPv4Network]:
+    """Returns the networks to sweep: those in CAST_REMOTE_SWEEP_NETWORKS, or else the host's own."""
+    configured = os.environ.get(NETWORKS_ENV)
+    if configured:
+        return [ipaddress.IPv4Network(cidr.strip(), strict=False) for cidr in configured.split(",") if cidr.strip()]
+    return sweep_networks(interface_networks())
+
+
+def sweep_targets(networks: Sequence[ipaddress.IPv4Network], exclude: Iterable[str] = ()) -> List[str]:
+    """Returns every host address of the networks once, leaving out the excluded addresses."""
+    excluded = set(exclude)
+    targets = {}
+    for network in networks:
+        for host in network.hosts():
+            if str(host) not in excluded:
+                targets[str(host)] = None
+    return list(targets)
+
+
+def _cnxn_packet() -> bytes:
+    payload = b"host::\x00"
+    return _HEADER.pack(A_CNXN, A_VERSION, MAX_PAYLOAD, len(payload), sum(payload) & 0xFFFFFFFF,
+                        A_CNXN ^ 0xFFFFFFFF) + payload
+
+
+async def adb_handshake(ip_address: str, port: int = ADB_PORT, timeout: float = PROBE_TIMEOUT) -> Optional[str]:
+    """Connects to an address and sends it the opening message of an ADB connection.
+
+    Returns:
+        'device' if the device accepted the host, 'unauthorized' if it asked the host to
+        authenticate, 'tls' if it asked for TLS (Wireless debugging), or None if nothing
+        answered like ADB within the timeout.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+    try:
+        writer.write(_cnxn_packet())
+        await writer.drain()
+        header = await asyncio.wait_for(reader.readexactly(_HEADER.size), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        writer.close()
+
+    command, _, _, _, _, magic = _HEADER.unpack(header)
+    if magic != command ^ 0xFFFFFFFF:
+        return None
+    return _HANDSHAKE_ANSWERS.get(command)
+
+
+async def sweep(networks: Optional[Sequence[ipaddress.IPv4Network]] = None, port: int = ADB_PORT,
+                timeout: float = PROBE_TIMEOUT, concurrency: int = CONCURRENCY) -> List[str]:
+    """Probes every address of the networks for ADB over TCP, concurrently.
+
+    Args:
+        networks: The networks to sweep. Defaults to local_networks().
+        port: The TCP port ADB listens on.
+        timeout: The maximum time in seconds to wait for each address to connect and to answer.
+        concurrency: The most addresses probed at the same time.
+
+    Returns:
+        The addresses that answered the ADB handshake, in address order.
+    """
+    networks = local_networks() if networks is None else networks
+    own_addresses = [str(interface.ip) for interface in interface_networks()]
+    targets = sweep_targets(networks, exclude=own_addresses)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def probe(ip_address: str) -> Optional[str]:
+        async with limit:
+            return await adb_handshake(ip_address, port, timeout)
+
+    with metrics.timed("cast_remote_sweep_seconds"):
+        answers = await asyncio.gather(*(probe(ip_address) for ip_address in targets))
+    metrics.inc("cast_remote_sweep_probes_total", len(targets))
+
+    found = [ip_address for ip_address, answer in zip(targets, answers) if answer is not None]
+    return sorted(found, key=ipaddress.IPv4Address)
+
+
+def find_adb_devices(networks: Optional[Sequence[ipaddress.IPv4Network]] = None,
+                     timeout: float = PROBE_TIMEOUT) -> List[str]:
+    """Blocking wrapper around sweep() for callers without an event loop."""
+    return asyncio.run(sweep(networks, timeout=timeout))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find devices with ADB over TCP on the local subnet.")
+    parser.add_argument("--network", action="append", type=lambda cidr: ipaddress.IPv4Network(cidr, strict=False),
+                        help="Sweep this network instead of the host's own (may be repeated)")
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+
+    found = asyncio.run(sweep(args.network, timeout=args.timeout, concurrency=args.concurrency))
+    for ip_address in found:
+        print(ip_address)
+    if not found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from adb_client import AdbClient, AdbError, AsyncAdbClient
+from fake_adb_server import FakeAdbServer
+import command_runner
+import device_utils
+
+
+class TestAdbClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.client = AdbClient(port=self.server.port)
+
+    def test_version(self):
+        self.assertEqual(self.client.version(), 0x29)
+
+    def test_devices(self):
+        self.server.devices = {"192.168.1.80:5555": "device", "192.168.1.90:5555": "unauthorized"}
+
+        self.assertEqual(self.client.devices(), [("192.168.1.80:5555", "device"),
+                                                 ("192.168.1.90:5555", "unauthorized")])
+
+    def test_no_devices(self):
+        self.assertEqual(self.client.devices(), [])
+
+    def test_get_state(self):
+        self.server.devices = {"192.168.1.80:5555": "offline"}
+
+        self.assertEqual(self.client.get_state("192.168.1.80:5555"), "offline")
+
+    def test_connect(self):
+        self.assertEqual(self.client.connect("192.168.1.80:5555"), "connected to 192.168.1.80:5555")
+        self.assertEqual(self.client.connect("192.168.1.80:5555"), "already connected to 192.168.1.80:5555")
+        self.assertIn("host:connect:192.168.1.80:5555", self.server.requests)
+
+    def test_connect_waits_for_authorization(self):
+        self.server.auth_delay = 0.05
+
+        self.assertEqual(self.client.connect("192.168.1.80:5555"), "failed to authenticate to 192.168.1.80:5555")
+        self.assertEqual(self.client.get_state("192.168.1.80:5555"), "unauthorized")
+        time.sleep(0.2)
+        self.assertEqual(self.client.get_state("192.168.1.80:5555"), "device")
+
+    def test_connect_refused(self):
+        self.server.failure_rate = 1.0
+
+        self.assertEqual(self.client.connect("192.168.1.80:5555"),
+                         "failed to connect to '192.168.1.80:5555': Connection refused")
+        self.assertEqual(self.client.devices(), [])
+
+    def test_disconnect_unknown_device(self):
+        with self.assertRaises(AdbError) as context:
+            self.client.disconnect("192.168.1.80")
+
+        self.assertIn("no such device", str(context.exception))
+
+    def test_shell(self):
+        self.server.devices = {"192.168.1.80:5555": "device"}
+        self.server.shell_handler = lambda serial, command: f"{serial} ran {command}".encode()
+
+        output = self.client.shell("192.168.1.80:5555", "input keyevent KEYCODE_HOME")
+
+        self.assertEqual(output, "192.168.1.80:5555 ran input keyevent KEYCODE_HOME")
+
+    def test_shell_unknown_device(self):
+        with self.assertRaises(AdbError) as context:
+            self.client.shell("192.168.1.80:5555", "true")
+
+        self.assertIn("not found", str(context.exception))
+
+    def test_track_devices_streams_transitions(self):
+        self.server.devices = {"192.168.1.80:5555": "unauthorized"}
+        tables = self.client.track_devices(timeout=5)
+
+        self.assertEqual(next(tables), {"192.168.1.80:5555": "unauthorized"})
+        self.server.set_device_state("192.168.1.80:5555", "device")
+        self.assertEqual(next(tables), {"192.168.1.80:5555": "device"})
+        self.server.set_device_state("192.168.1.80:5555", None)
+        self.assertEqual(next(tables), {})
+        tables.close()
+
+    def test_track_devices_timeout(self):
+        tables = self.client.track_devices(timeout=0.2)
+        next(tables)
+
+        with self.assertRaises(TimeoutError):
+            next(tables)
+
+    @patch("adb_client.command_runner.run")
+    def test_starts_server_when_not_running(self, mock_run):
+        self.server.stop()
+
+        with self.assertRaises(ConnectionRefusedError):
+            self.client.version()
+
+        mock_run.assert_called_once_with(["adb", "start-server"], timeout=10)
+
+
+class TestDeviceUtilsOverAdbProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        for target, client in [("device_utils.adb_client.default_client", AdbClient(port=self.server.port)),
+                               ("device_utils.adb_client.default_async_client",
+                                AsyncAdbClient(port=self.server.port, adb_path="true"))]:
+            patcher = patch(target, return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        device_utils.invalidate_device_statuses()
+
+    @patch("builtins.print")
+    def test_connect_status_disconnect(self, mock_print):
+        self.assertTrue(device_utils.connect_to_cast_device("192.168.1.80"))
+        self.assertEqual(device_utils.get_device_status("192.168.1.80"), "device")
+
+        device_utils.disconnect_from_device("192.168.1.80")
+
+        mock_print.assert_not_called()
+        self.assertEqual(self.server.devices, {})
+
+    def test_wait_wakes_on_authorization(self):
+        self.server.devices = {"192.168.1.80:5555": "unauthorized"}
+        threading.Timer(0.2, self.server.set_device_state, ("192.168.1.80:5555", "device")).start()
+
+        start = time.monotonic()
+        self.assertTrue(device_utils.wait_for_device_state("192.168.1.80", "device", timeout=5))
+        self.assertLess(time.monotonic() - start, 1)
+
+    @patch("builtins.print")
+    def test_spawn_count_per_operation(self, mock_print):
+        operations = [
+            (lambda: device_utils.connect_to_cast_device("192.168.1.80"), 0),
+            (lambda: device_utils.get_device_status("192.168.1.80"), 0),
+            (lambda: device_utils.wait_for_device_state("192.168.1.80", "device", timeout=1), 0),
+            (lambda: device_utils.disconnect_from_device("192.168.1.80"), 0),
+            (device_utils.restart_adb_server, 1),
+        ]
+
+        for operation, expected_spawns in operations:
+            spawns_before = command_runner.spawn_count()
+            operation()
+            self.assertEqual(command_runner.spawn_count() - spawns_before, expected_spawns)
+
+    def test_hung_connect_bounded_by_timeout(self):
+        self.server.latency = 1
+
+        start = time.monotonic()
+        with self.assertRaises(RuntimeError) as context:
+            device_utils.connect_to_cast_device("192.168.1.80", timeout=0.1)
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertIn("Timed out connecting", str(context.exception))
+
+    def test_overlapping_status_queries_share_one_request(self):
+        self.server.devices = {"192.168.1.80:5555": "device", "192.168.1.90:5555": "unauthorized"}
+        self.server.latency = 0.1
+
+        async def statuses():
+            return await asyncio.gather(*(device_utils.get_device_status_async(ip)
+                                          for ip in ["192.168.1.80", "192.168.1.90"] * 5))
+
+        self.assertEqual(asyncio.run(statuses()), ["device", "unauthorized"] * 5)
+        self.assertEqual(self.server.requests.count("host:devices"), 1)
+
+    def test_cancelled_connect_does_not_block(self):
+        self.server.latency = 1
+
+        async def connect_then_cancel():
+            task = asyncio.create_task(device_utils.connect_to_cast_device_async("192.168.1.80"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(connect_then_cancel())
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_wait_times_out(self):
+        self.server.devices = {"192.168.1.80:5555": "unauthorized"}
+
+        self.assertFalse(device_utils.wait_for_device_state("192.168.1.80", "device", timeout=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
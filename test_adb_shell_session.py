@@ -0,0 +1,105 @@
+import subprocess
+import unittest
+from unittest.mock import patch, MagicMock
+from adb_shell_session import AdbShellSession
+import command_runner
+
+
+def make_process(alive: bool = True):
+    process = MagicMock()
+    process.poll.return_value = None if alive else 1
+    return process
+
+
+@patch("adb_shell_session.subprocess.Popen")
+class TestAdbShellSession(unittest.TestCase):
+
+    def test_shell_started_once_for_many_presses(self, mock_popen):
+        process = make_process()
+        mock_popen.return_value = process
+
+        session = AdbShellSession()
+        session.send_keyevent("KEYCODE_HOME")
+        session.send_keyevent("KEYCODE_BACK")
+
+        mock_popen.assert_called_once()
+        self.assertEqual(mock_popen.call_args.args[0], ["adb", "shell"])
+        process.stdin.write.assert_any_call(b"input keyevent KEYCODE_HOME\n")
+        process.stdin.write.assert_any_call(b"input keyevent KEYCODE_BACK\n")
+
+    def test_one_process_for_many_presses(self, mock_popen):
+        mock_popen.return_value = make_process()
+        spawns_before = command_runner.spawn_count()
+
+        with AdbShellSession() as session:
+            for _ in range(20):
+                session.send_keyevent("KEYCODE_DPAD_DOWN")
+
+        self.assertEqual(command_runner.spawn_count() - spawns_before, 1)
+
+    def test_targets_serial(self, mock_popen):
+        mock_popen.return_value = make_process()
+
+        AdbShellSession(serial="192.168.1.80:5555").send_keyevent("KEYCODE_HOME")
+
+        self.assertEqual(mock_popen.call_args.args[0], ["adb", "-s", "192.168.1.80:5555", "shell"])
+
+    def test_restarts_dead_shell(self, mock_popen):
+        dead_process = make_process()
+        new_process = make_process()
+        mock_popen.side_effect = [dead_process, new_process]
+
+        session = AdbShellSession()
+        session.send_keyevent("KEYCODE_HOME")
+        dead_process.poll.return_value = 1
+        session.send_keyevent("KEYCODE_BACK")
+
+        self.assertEqual(mock_popen.call_count, 2)
+        self.assertEqual(session.restarts, 1)
+        new_process.stdin.write.assert_called_once_with(b"input keyevent KEYCODE_BACK\n")
+
+    def test_retries_on_broken_pipe(self, mock_popen):
+        broken_process = make_process()
+        broken_process.stdin.write.side_effect = BrokenPipeError
+        new_process = make_process()
+        mock_popen.side_effect = [broken_process, new_process]
+
+        session = AdbShellSession()
+        session.send_keyevent("KEYCODE_HOME")
+
+        new_process.stdin.write.assert_called_once_with(b"input keyevent KEYCODE_HOME\n")
+        self.assertEqual(session.restarts, 1)
+
+    def test_send_fails_after_retry(self, mock_popen):
+        broken_process = make_process()
+        broken_process.stdin.write.side_effect = BrokenPipeError
+        mock_popen.return_value = broken_process
+
+        with self.assertRaises(RuntimeError) as context:
+            AdbShellSession().send_keyevent("KEYCODE_HOME")
+
+        self.assertIn("Unable to send command", str(context.exception))
+
+    def test_send_keyevents_batches_into_one_command(self, mock_popen):
+        process = make_process()
+        mock_popen.return_value = process
+
+        AdbShellSession().send_keyevents(["KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_DOWN"])
+
+        process.stdin.write.assert_called_once_with(b"input keyevent KEYCODE_DPAD_DOWN KEYCODE_DPAD_DOWN\n")
+
+    def test_close_kills_hung_shell(self, mock_popen):
+        process = make_process()
+        process.wait.side_effect = [subprocess.TimeoutExpired("adb", 5), 0]
+        mock_popen.return_value = process
+
+        session = AdbShellSession()
+        session.send_keyevent("KEYCODE_HOME")
+        session.close()
+
+        process.kill.assert_called_once()
+        self.assertFalse(session.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
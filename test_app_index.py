@@ -0,0 +1,227 @@
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+import app_index
+import device_utils
+from app_index import AppIndex
+from device_registry import DeviceRegistry
+
+IP_ADDRESS = "192.168.1.80"
+UUID = "4a5b6c7d8e9f0a1b2c3d4e5f60718293"
+OTHER_UUID = "0f1e2d3c4b5a69788796a5b4c3d2e1f0"
+
+
+class FakeDeviceShell:
+    """Answers the package manager and activity manager commands of a device with some apps installed."""
+
+    def __init__(self):
+        self.packages = {
+            "com.netflix.ninja": ("/data/app/~~a1==/com.netflix.ninja-b2==/base.apk", 1, ".MainActivity"),
+            "com.google.android.youtube.tv": ("/data/app/~~c3==/com.google.android.youtube.tv-d4==/base.apk", 5,
+                                              "com.google.android.apps.youtube.tv.activity.ShellActivity"),
+            "com.google.android.youtube.tvmusic": ("/data/app/~~e5==/com.google.android.youtube.tvmusic-f6==/base.apk",
+                                                   2, ".MainActivity"),
+            "com.android.providers.settings": ("/system/priv-app/SettingsProvider/SettingsProvider.apk", 30, None),
+        }
+        self.commands = []
+
+    def _component(self, package):
+        activity = self.packages[package][2]
+        return f"{package}/{activity}"
+
+    def __call__(self, command):
+        self.commands.append(command)
+        if command == "pm list packages -f --show-versioncode":
+            return "".join(f"package:{path}={package} versionCode:{version}\n"
+                           for package, (path, version, _) in self.packages.items())
+        if command.startswith("cmd package query-activities"):
+            return "".join(f"priority=0 preferredOrder=0 match=0x108000 specificIndex=-1 isDefault=false\n"
+                           f"  {self._component(package)}\n"
+                           for package, (_, _, activity) in self.packages.items() if activity)
+        if command.startswith("echo "):
+            output = []
+            for part in command.split("; "):
+                if part.startswith("echo "):
+                    output.append(part[len("echo "):].strip("'"))
+                    continue
+                package = part.split()[-1]
+                if package in self.packages and self.packages[package][2]:
+                    output.append("priority=0 preferredOrder=0 match=0x108000 specificIndex=-1 isDefault=true")
+                    output.append(self._component(package))
+                else:
+                    output.append("No activity found")
+            return "\n".join(output) + "\n"
+        match = re.match(r"am start -n (\S+)/(\S+)$", command)
+        if match:
+            if match[1] in self.packages and self._component(match[1]) == f"{match[1]}/{match[2]}":
+                return f"Starting: Intent {{ cmp={match[1]}/{match[2]} }}\n"
+            return f"Error: Activity class {{{match[1]}/{match[2]}}} does not exist.\n"
+        raise AssertionError(f"Unexpected command: {command}")
+
+    def update(self, package, activity=None):
+        path, version, old_activity = self.packages[package]
+        self.packages[package] = (path.replace("==/", "x==/", 1), version + 1, activity or old_activity)
+
+    def queries(self):
+        return [command.split()[0] + " " + command.split()[1] for command in self.commands]
+
+
+class TestAppIndex(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "apps.json")
+        self.index = AppIndex(self.path)
+        self.shell = FakeDeviceShell()
+
+    def test_parse_package_list(self):
+        stamps = app_index.parse_package_list(
+            "package:/data/app/~~a1==/com.netflix.ninja-b2==/base.apk=com.netflix.ninja versionCode:1\n"
+            "package:/system/app/Bluetooth/Bluetooth.apk=com.android.bluetooth versionCode:30\n")
+
+        self.assertEqual(stamps, {"com.netflix.ninja": "/data/app/~~a1==/com.netflix.ninja-b2==/base.apk:1",
+                                  "com.android.bluetooth": "/system/app/Bluetooth/Bluetooth.apk:30"})
+
+    def test_default_label(self):
+        self.assertEqual(app_index.default_label("com.netflix.ninja"), "netflix ninja")
+        self.assertEqual(app_index.default_label("com.google.android.youtube.tv"), "youtube tv")
+
+    def test_first_refresh_lists_every_launcher_activity(self):
+        changed = self.index.refresh(UUID, self.shell)
+
+        self.assertEqual(len(changed), 4)
+        self.assertEqual(self.shell.queries(), ["pm list", "cmd package"])
+        self.assertEqual([entry.package for entry in self.index.apps(UUID)],
+                         ["com.netflix.ninja", "com.google.android.youtube.tv", "com.google.android.youtube.tvmusic"])
+
+    def test_refresh_only_queries_updated_packages(self):
+        self.index.refresh(UUID, self.shell)
+        self.shell.commands.clear()
+
+        self.assertEqual(self.index.refresh(UUID, self.shell), [])
+        self.assertEqual(self.shell.queries(), ["pm list"])
+
+        self.shell.update("com.netflix.ninja", activity=".HomeActivity")
+        del self.shell.packages["com.google.android.youtube.tvmusic"]
+        self.shell.commands.clear()
+
+        changed = self.index.refresh(UUID, self.shell)
+
+        self.assertEqual(changed, ["com.netflix.ninja", "com.google.android.youtube.tvmusic"])
+        self.assertEqual(self.shell.queries(), ["pm list", "echo '@@package"])
+        self.assertEqual(self.index.find(UUID, "netflix").activity, "com.netflix.ninja/.HomeActivity")
+        self.assertEqual(len(self.index.apps(UUID)), 2)
+
+    def test_find(self):
+        self.index.refresh(UUID, self.shell)
+
+        self.assertEqual(self.index.find(UUID, "Netflix").package, "com.netflix.ninja")
+        self.assertEqual(self.index.find(UUID, "youtube").package, "com.google.android.youtube.tv")
+        self.assertEqual(self.index.find(UUID, "tvmusic").package, "com.google.android.youtube.tvmusic")
+        self.assertIsNone(self.index.find(UUID, "settings"))
+        self.assertIsNone(self.index.find(OTHER_UUID, "netflix"))
+
+    def test_label_survives_refresh(self):
+        self.index.refresh(UUID, self.shell)
+        self.index.set_label(UUID, "com.google.android.youtube.tvmusic", "Music")
+        self.shell.update("com.google.android.youtube.tvmusic")
+
+        self.index.refresh(UUID, self.shell)
+
+        self.assertEqual(AppIndex(self.path).find(UUID, "music").package, "com.google.android.youtube.tvmusic")
+        with self.assertRaises(RuntimeError):
+            self.index.set_label(UUID, "com.hulu.plus", "Hulu")
+
+    def test_index_is_synced_before_it_replaces_the_old_one(self):
+        calls = []
+        fsync, replace = os.fsync, os.replace
+        with patch("os.fsync", side_effect=lambda fd: calls.append("fsync") or fsync(fd)), \
+                patch("os.replace", side_effect=lambda *args: calls.append("replace") or replace(*args)):
+            self.index.refresh(UUID, self.shell)
+
+        self.assertEqual(calls, ["fsync", "replace"])
+
+    def test_unreadable_index_is_rebuilt(self):
+        with open(self.path, "w") as index_file:
+            index_file.write("[not an index")
+
+        self.assertEqual(self.index.apps(UUID), [])
+        self.assertEqual(len(self.index.refresh(UUID, self.shell)), 4)
+
+
+@patch("device_utils.adb_client.default_client")
+class TestLaunchApp(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = AppIndex(os.path.join(directory.name, "apps.json"))
+        self.registry = DeviceRegistry(os.path.join(directory.name, "devices.json"))
+        self.registry.remember(UUID, IP_ADDRESS, last_success=1000.0)
+        self.shell = FakeDeviceShell()
+
+    def use_shell(self, mock_default_client):
+        mock_default_client.return_value.shell.side_effect = lambda serial, command: self.shell(command)
+
+    def test_known_app_is_one_command(self, mock_default_client):
+        self.use_shell(mock_default_client)
+        self.index.refresh(UUID, self.shell)
+        self.shell.commands.clear()
+
+        activity = device_utils.launch_app(IP_ADDRESS, "netflix", self.index, self.registry)
+
+        self.assertEqual(activity, "com.netflix.ninja/.MainActivity")
+        self.assertEqual(self.shell.commands, ["am start -n com.netflix.ninja/.MainActivity"])
+        mock_default_client.return_value.shell.assert_called_with(f"{IP_ADDRESS}:5555", self.shell.commands[0])
+
+    def test_unknown_app_refreshes_index(self, mock_default_client):
+        self.use_shell(mock_default_client)
+
+        self.assertEqual(device_utils.launch_app(IP_ADDRESS, "youtube", self.index, self.registry),
+                         "com.google.android.youtube.tv/com.google.android.apps.youtube.tv.activity.ShellActivity")
+        self.assertEqual(self.shell.queries(), ["pm list", "cmd package", "am start"])
+
+    def test_stale_activity_refreshes_index(self, mock_default_client):
+        self.use_shell(mock_default_client)
+        self.index.refresh(UUID, self.shell)
+        self.shell.update("com.netflix.ninja", activity=".HomeActivity")
+        self.shell.commands.clear()
+
+        self.assertEqual(device_utils.launch_app(IP_ADDRESS, "netflix", self.index, self.registry),
+                         "com.netflix.ninja/.HomeActivity")
+        self.assertEqual(self.shell.queries(), ["am start", "pm list", "echo '@@package", "am start"])
+
+    def test_index_follows_the_device_not_the_address(self, mock_default_client):
+        self.use_shell(mock_default_client)
+        self.index.refresh(UUID, self.shell)
+        # Another TV got the address from DHCP, and the first one moved
+        self.registry.remember(OTHER_UUID, IP_ADDRESS, last_success=2000.0)
+        self.registry.remember(UUID, "192.168.1.81", last_success=1500.0)
+        self.shell.packages["com.netflix.ninja"] = ("/data/app/~~g7==/com.netflix.ninja-h8==/base.apk", 3,
+                                                    ".HomeActivity")
+        self.shell.commands.clear()
+
+        self.assertEqual(device_utils.launch_app(IP_ADDRESS, "netflix", self.index, self.registry),
+                         "com.netflix.ninja/.HomeActivity")
+        self.assertEqual(self.shell.queries(), ["pm list", "cmd package", "am start"])
+        self.assertEqual(self.index.find(UUID, "netflix").activity, "com.netflix.ninja/.MainActivity")
+
+    def test_unknown_device(self, mock_default_client):
+        self.use_shell(mock_default_client)
+
+        with self.assertRaises(RuntimeError):
+            device_utils.launch_app("192.168.1.90", "netflix", self.index, self.registry)
+        self.assertEqual(self.shell.commands, [])
+
+    def test_no_such_app(self, mock_default_client):
+        self.use_shell(mock_default_client)
+
+        with self.assertRaises(RuntimeError):
+            device_utils.launch_app(IP_ADDRESS, "hulu", self.index, self.registry)
+
+
+if __name__ == "__main__":
+    unittest.main()
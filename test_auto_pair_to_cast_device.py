@@ -1,61 +1,118 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 import auto_pair_to_cast_device as auto_pair
+import connection_state
+from device_registry import DeviceRegistry
+from mdns_browser import CastService
 
 
-@patch("auto_pair_to_cast_device.utils.connect_to_cast_device")
-@patch("auto_pair_to_cast_device.utils.get_device_status")
+def connection(ip_address: str, *events: str) -> connection_state.ConnectionStateMachine:
+    machine = connection_state.ConnectionStateMachine(ip_address)
+    machine.connecting()
+    machine.connect_output(events[0])
+    for status in events[1:]:
+        machine.device_status(status)
+    return machine
+
+
+@patch("auto_pair_to_cast_device.utils.establish_connection")
 class TestAutoPairToCastDevice(unittest.TestCase):
 
     def setUp(self):
         self.ip_address = "192.168.1.80"
 
     @patch("builtins.print")
-    def test_auto_pair_success(self, mock_print, mock_device_status, mock_connect):
-        mock_connect.return_value = None
-        mock_device_status.return_value = "device"
-
-        auto_pair.auto_pair_to_device(self.ip_address)
+    def test_auto_pair_success(self, mock_print, mock_connect):
+        mock_connect.return_value = connection(self.ip_address, f"connected to {self.ip_address}:5555")
 
-        mock_connect.assert_called_once_with(self.ip_address, quiet_connect=True)
-        mock_device_status.assert_called_once_with(self.ip_address)
-        mock_print.assert_called_with(f"Connected to Google Cast-enabled device at {self.ip_address}!")
+        self.assertEqual(auto_pair.auto_pair_to_device(self.ip_address), "device")
 
-    @patch("auto_pair_to_cast_device.subprocess.run")
-    @patch("builtins.print")
-    def test_auto_pair_unauthorized(self, mock_print, mock_subprocess_run, mock_device_status,
-                                    mock_connect):
-        mock_connect.return_value = None
-        mock_device_status.return_value = "unauthorized"
-        mock_subprocess_run.return_value = None
+        mock_connect.assert_called_once_with(self.ip_address)
+        # Runs in the daemon too, so it reports through its return value rather than stdout
+        mock_print.assert_not_called()
 
-        auto_pair.auto_pair_to_device(self.ip_address)
+    @patch("auto_pair_to_cast_device.utils.disconnect_from_device")
+    def test_auto_pair_unauthorized(self, mock_disconnect, mock_connect):
+        mock_connect.return_value = connection(self.ip_address, f"already connected to {self.ip_address}:5555",
+                                               "unauthorized")
 
-        mock_connect.assert_called_once_with(self.ip_address, quiet_connect=True)
-        mock_device_status.assert_called_once_with(self.ip_address)
-        mock_subprocess_run.assert_called_once()
-        mock_print.assert_called_once_with(
-            f"Connection to Google Cast-enabled device at {self.ip_address} is unauthorized. "
-            f"Forgetting device...")
+        self.assertEqual(auto_pair.auto_pair_to_device(self.ip_address), "unauthorized")
 
-    @patch("builtins.print")
-    def test_auto_pair_unsuccessful(self, mock_print, mock_device_status, mock_connect):
-        mock_connect.return_value = None
-        mock_device_status.return_value = "offline"
+        mock_disconnect.assert_called_once_with(self.ip_address)
 
-        auto_pair.auto_pair_to_device(self.ip_address)
+    def test_auto_pair_unsuccessful(self, mock_connect):
+        mock_connect.return_value = connection(self.ip_address, f"already connected to {self.ip_address}:5555",
+                                               "offline")
 
-        mock_connect.assert_called_once_with(self.ip_address, quiet_connect=True)
-        mock_device_status.assert_called_once_with(self.ip_address)
-        mock_print.assert_called_with("Unable to connect to Google Cast-enabled device.")
+        self.assertEqual(auto_pair.auto_pair_to_device(self.ip_address), "offline")
 
-    def test_auto_pair_unknown_status(self, mock_device_status, mock_connect):
-        mock_connect.return_value = None
-        mock_device_status.return_value = "unknown status"
+    def test_auto_pair_unreachable(self, mock_connect):
+        mock_connect.return_value = connection(
+            self.ip_address, f"failed to connect to '{self.ip_address}:5555': Connection refused")
 
-        with self.assertRaises(NotImplementedError) as context:
+        with self.assertRaises(RuntimeError) as context:
             auto_pair.auto_pair_to_device(self.ip_address)
 
-        mock_connect.assert_called_once_with(self.ip_address, quiet_connect=True)
-        mock_device_status.assert_called_once_with(self.ip_address)
-        self.assertIn("Handling of unknown connection status", str(context.exception))
\ No newline at end of file
+        self.assertIn("Connection refused", str(context.exception))
+
+
+@patch("auto_pair_to_cast_device.auto_pair_to_device")
+@patch("auto_pair_to_cast_device.utils.find_cast_devices")
+@patch("builtins.print")
+class TestAutoPairToAllDevices(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = DeviceRegistry(os.path.join(directory.name, "devices.json"))
+        self.living_room = CastService("192.168.1.80", 8009, "4a5b6c7d", "Living Room TV", "chromecast-4a5b6c7d")
+        self.bedroom = CastService("192.168.1.90", 8009, "0f1e2d3c", "Bedroom TV", "chromecast-0f1e2d3c")
+
+    def test_auto_pair_every_device(self, mock_print, mock_find_devices, mock_auto_pair):
+        mock_find_devices.return_value = [self.living_room, self.bedroom]
+        mock_auto_pair.side_effect = lambda ip: "device" if ip == "192.168.1.80" else "offline"
+
+        results = auto_pair.auto_pair_to_all_devices(self.registry)
+
+        self.assertEqual({call.args[0] for call in mock_auto_pair.call_args_list}, {"192.168.1.80", "192.168.1.90"})
+        self.assertEqual([(result.ip_address, result.value) for result in results],
+                         [("192.168.1.80", "device"), ("192.168.1.90", "offline")])
+        self.assertEqual([device.uuid for device in self.registry.devices()], ["4a5b6c7d"])
+
+    def test_no_devices_found(self, mock_print, mock_find_devices, mock_auto_pair):
+        mock_find_devices.return_value = []
+
+        self.assertEqual(auto_pair.auto_pair_to_all_devices(self.registry), [])
+        mock_print.assert_not_called()
+
+        with patch("auto_pair_to_cast_device.DeviceRegistry", return_value=self.registry):
+            auto_pair.main()
+        mock_print.assert_called_with("No Google Cast-enabled devices found on the local network.")
+
+    def test_known_device_skips_discovery(self, mock_print, mock_find_devices, mock_auto_pair):
+        self.registry.remember("4a5b6c7d", "192.168.1.80", "Living Room TV", last_success=100)
+        mock_auto_pair.return_value = "device"
+
+        results = auto_pair.auto_pair_to_all_devices(self.registry)
+
+        mock_find_devices.assert_not_called()
+        mock_auto_pair.assert_called_once_with("192.168.1.80")
+        self.assertEqual([result.value for result in results], ["device"])
+        self.assertGreater(self.registry.get("4a5b6c7d").last_success, 100)
+
+    def test_known_device_moved_to_new_address(self, mock_print, mock_find_devices, mock_auto_pair):
+        self.registry.remember("4a5b6c7d", "192.168.1.50", "Living Room TV", last_success=100)
+        mock_find_devices.return_value = [self.living_room]
+
+        def auto_pair_to_device(ip_address):
+            if ip_address == "192.168.1.50":
+                raise RuntimeError("No device with IP address 192.168.1.50 found.")
+            return "device"
+        mock_auto_pair.side_effect = auto_pair_to_device
+
+        results = auto_pair.auto_pair_to_all_devices(self.registry)
+
+        self.assertEqual([(result.ip_address, result.value) for result in results], [("192.168.1.80", "device")])
+        self.assertEqual(self.registry.get("4a5b6c7d").ip_address, "192.168.1.80")
@@ -0,0 +1,64 @@
+import time
+import unittest
+from button_gestures import GestureDetector
+
+
+class TestGestureDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.gestures = []
+        self.detector = GestureDetector(lambda button, gesture: self.gestures.append((button, gesture)),
+                                        {27: {"long", "double"}, 5: {"triple"}},
+                                        long_press=0.15, multi_press_window=0.1)
+        self.addCleanup(self.detector.close)
+
+    def click(self, button, hold=0.01):
+        self.detector.pressed(button)
+        time.sleep(hold)
+        self.detector.released(button)
+
+    def test_unbound_button_reported_on_press(self):
+        self.detector.pressed(22)
+
+        self.assertEqual(self.gestures, [(22, "press")])
+
+    def test_single_press_after_window(self):
+        self.click(27)
+        self.assertEqual(self.gestures, [])
+
+        time.sleep(0.2)
+        self.assertEqual(self.gestures, [(27, "press")])
+
+    def test_double_press_reported_straight_away(self):
+        self.click(27)
+        self.click(27)
+
+        self.assertEqual(self.gestures, [(27, "double")])
+
+    def test_long_press_fires_while_held(self):
+        self.detector.pressed(27)
+        time.sleep(0.25)
+        self.assertEqual(self.gestures, [(27, "long")])
+
+        self.detector.released(27)
+        time.sleep(0.2)
+        self.assertEqual(self.gestures, [(27, "long")])
+
+    def test_triple_press(self):
+        self.click(5)
+        self.click(5)
+        self.assertEqual(self.gestures, [])
+
+        self.click(5)
+        self.assertEqual(self.gestures, [(5, "triple")])
+
+    def test_double_press_without_binding_waits_out_window(self):
+        self.click(5)
+        self.click(5)
+        time.sleep(0.2)
+
+        self.assertEqual(self.gestures, [(5, "double")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+import cast_control
+from cast_control import CastMessage
+
+APP_TRANSPORT = "web-7"
+
+
+class FakeCastReceiver:
+    """A Cast device on localhost: answers receiver and media requests over TLS."""
+
+    def __init__(self, certfile: str, keyfile: str, playing: bool = True):
+        self.level = 0.5
+        self.muted = False
+        self.player_state = "PLAYING" if playing else None
+        self.requests = []
+        self.connects = 0
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(certfile, keyfile)
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.clients = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                raw, _ = self.server.accept()
+                client = self.context.wrap_socket(raw, server_side=True)
+            except OSError:
+                return
+            self.connects += 1
+            self.clients.append(client)
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _status(self) -> dict:
+        status = {"volume": {"level": self.level, "muted": self.muted, "stepInterval": 0.05}}
+        if self.player_state:
+            status["applications"] = [{"transportId": APP_TRANSPORT,
+                                       "namespaces": [{"name": cast_control.NS_MEDIA}]}]
+        return status
+
+    def _reply(self, client, message: CastMessage, payload: dict):
+        client.sendall(cast_control.frame(CastMessage(message.destination_id, message.source_id,
+                                                      message.namespace, json.dumps(payload))))
+
+    def _handle(self, client):
+        while True:
+            try:
+                message = cast_control.decode_message(cast_control.read_frame(client))
+            except OSError:
+                return
+            payload = json.loads(message.payload_utf8)
+            self.requests.append((message.destination_id, payload["type"]))
+            answer = {"requestId": payload.get("requestId", 0)}
+            if payload["type"] == "PING":
+                self._reply(client, message, {"type": "PONG"})
+            elif message.namespace == cast_control.NS_RECEIVER:
+                if payload["type"] == "SET_VOLUME":
+                    self.level = payload["volume"].get("level", self.level)
+                    self.muted = payload["volume"].get("muted", self.muted)
+                self._reply(client, message, dict(answer, type="RECEIVER_STATUS", status=self._status()))
+            elif message.namespace == cast_control.NS_MEDIA:
+                if payload["type"] == "PLAY":
+                    self.player_state = "PLAYING"
+                elif payload["type"] == "PAUSE":
+                    self.player_state = "PAUSED"
+                self._reply(client, message, dict(answer, type="MEDIA_STATUS", status=[
+                    {"mediaSessionId": 3, "playerState": self.player_state}]))
+
+    def drop_clients(self):
+        for client in self.clients:
+            client.close()
+
+    def close(self):
+        self.server.close()
+        self.drop_clients()
+
+
+class TestCastMessage(unittest.TestCase):
+
+    def test_round_trip(self):
+        message = CastMessage("sender-0", "receiver-0", cast_control.NS_RECEIVER, '{"type": "GET_STATUS"}')
+
+        self.assertEqual(cast_control.decode_message(cast_control.encode_message(message)), message)
+
+    def test_skips_unused_fields(self):
+        message = CastMessage("receiver-0", "sender-0", cast_control.NS_HEARTBEAT, '{"type": "PING"}')
+        # payload_binary (field 7) and an unknown varint field 9
+        extra = b"\x3a\x03abc" + b"\x48\x96\x01"
+
+        self.assertEqual(cast_control.decode_message(cast_control.encode_message(message) + extra), message)
+
+    def test_truncated_message(self):
+        encoded = cast_control.encode_message(CastMessage("a", "b", "c", "d"))
+
+        with self.assertRaises(cast_control.CastError):
+            cast_control.decode_message(encoded[:-1])
+
+
+class TestSplitCastKeys(unittest.TestCase):
+
+    def test_volume_steps_share_a_run(self):
+        keycodes = ["KEYCODE_DPAD_UP", "KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN",
+                    "KEYCODE_MEDIA_PLAY_PAUSE", "KEYCODE_MEDIA_PLAY_PAUSE", "KEYCODE_HOME", "KEYCODE_BACK"]
+
+        runs = cast_control.split_cast_keys(keycodes, cast_control.CAST_KEYCODES)
+
+        self.assertEqual(runs, [
+            (False, ["KEYCODE_DPAD_UP"]),
+            (True, ["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN"]),
+            (True, ["KEYCODE_MEDIA_PLAY_PAUSE"]),
+            (True, ["KEYCODE_MEDIA_PLAY_PAUSE"]),
+            (False, ["KEYCODE_HOME", "KEYCODE_BACK"]),
+        ])
+
+    def test_only_configured_keys_go_over_cast(self):
+        runs = cast_control.split_cast_keys(["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN"], {"KEYCODE_VOLUME_UP"})
+
+        self.assertEqual(runs, [(True, ["KEYCODE_VOLUME_UP"]), (False, ["KEYCODE_VOLUME_DOWN"])])
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs openssl to make the fake receiver's certificate")
+class TestCastConnection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cert_dir = tempfile.mkdtemp()
+        cls.certfile = os.path.join(cls.cert_dir, "cert.pem")
+        cls.keyfile = os.path.join(cls.cert_dir, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-subj", "/CN=fake-cast", "-keyout", cls.keyfile, "-out", cls.certfile],
+                       check=True, capture_output=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cert_dir)
+
+    def setUp(self):
+        self.receiver = FakeCastReceiver(self.certfile, self.keyfile)
+        self.connection = cast_control.CastConnection("127.0.0.1", self.receiver.port, timeout=2)
+
+    def tearDown(self):
+        self.connection.close()
+        self.receiver.close()
+
+    def test_set_volume(self):
+        self.connection.set_volume(0.3)
+
+        self.assertEqual(self.receiver.level, 0.3)
+        self.assertEqual(self.receiver.requests[0], ("receiver-0", "CONNECT"))
+
+    def test_volume_is_clamped(self):
+        self.connection.set_volume(1.7)
+
+        self.assertEqual(self.receiver.level, 1.0)
+
+    def test_volume_steps_are_one_request(self):
+        self.connection.send_keys(["KEYCODE_VOLUME_UP"] * 3)
+
+        self.assertAlmostEqual(self.receiver.level, 0.65)
+        self.assertEqual([kind for _, kind in self.receiver.requests].count("SET_VOLUME"), 1)
+
+    def test_toggle_mute(self):
+        self.connection.send_keys(["KEYCODE_VOLUME_MUTE"])
+        self.assertTrue(self.receiver.muted)
+
+        self.connection.send_keys(["KEYCODE_VOLUME_MUTE"])
+        self.assertFalse(self.receiver.muted)
+
+    def test_play_pause_toggles(self):
+        self.connection.send_keys(["KEYCODE_MEDIA_PLAY_PAUSE"])
+        self.assertEqual(self.receiver.player_state, "PAUSED")
+
+        self.connection.send_keys(["KEYCODE_MEDIA_PLAY_PAUSE"])
+        self.assertEqual(self.receiver.player_state, "PLAYING")
+        # The media session's transport is connected to once
+        self.assertEqual(self.receiver.requests.count((APP_TRANSPORT, "CONNECT")), 1)
+
+    def test_nothing_playing(self):
+        self.receiver.player_state = None
+
+        with self.assertRaises(cast_control.NoMediaSessionError):
+            self.connection.play_pause()
+
+    def test_reconnects_after_the_connection_drops(self):
+        self.connection.set_volume(0.2)
+        self.receiver.drop_clients()
+
+        self.connection.set_volume(0.4)
+
+        self.assertEqual(self.receiver.level, 0.4)
+        self.assertEqual(self.receiver.connects, 2)
+
+    def test_unreachable_device(self):
+        self.receiver.close()
+
+        with self.assertRaises(cast_control.CastError):
+            self.connection.set_volume(0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import time
+import unittest
+import command_runner
+from command_runner import CommandError
+
+
+def python(code: str):
+    return [sys.executable, "-c", code]
+
+
+class TestRun(unittest.TestCase):
+
+    def test_output_captured(self):
+        result = command_runner.run(python("print('connected to 192.168.1.80:5555')"))
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "connected to 192.168.1.80:5555\n")
+
+    def test_no_shell_in_between(self):
+        result = command_runner.run(python("import sys; print(sys.argv[1])") + ["$HOME; echo injected"])
+
+        self.assertEqual(result.stdout, "$HOME; echo injected\n")
+
+    def test_exit_code_raises(self):
+        with self.assertRaises(CommandError) as context:
+            command_runner.run(python("import sys; sys.stderr.write('no devices'); sys.exit(3)"))
+
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertIn("exited with code 3: no devices", str(context.exception))
+
+    def test_exit_code_returned_when_unchecked(self):
+        result = command_runner.run(python("import sys; sys.exit(3)"), check=False)
+
+        self.assertEqual(result.returncode, 3)
+
+    def test_timeout_kills_command(self):
+        start = time.monotonic()
+        with self.assertRaises(CommandError) as context:
+            command_runner.run(python("import time; time.sleep(10)"), timeout=0.2)
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertIn("timed out", str(context.exception))
+        self.assertIsNone(context.exception.returncode)
+
+    def test_missing_program(self):
+        with self.assertRaises(CommandError) as context:
+            command_runner.run(["/nonexistent/adb", "devices"])
+
+        self.assertIn("Unable to run /nonexistent/adb", str(context.exception))
+
+    def test_spawns_counted(self):
+        spawns_before = command_runner.spawn_count()
+
+        command_runner.run(python("pass"))
+        command_runner.run(python("pass"))
+
+        self.assertEqual(command_runner.spawn_count() - spawns_before, 2)
+
+
+class TestRunAsync(unittest.TestCase):
+
+    def test_output_captured(self):
+        result = asyncio.run(command_runner.run_async(python("print('ok')")))
+
+        self.assertEqual(result.stdout, "ok\n")
+
+    def test_timeout_kills_command(self):
+        start = time.monotonic()
+        with self.assertRaises(CommandError):
+            asyncio.run(command_runner.run_async(python("import time; time.sleep(10)"), timeout=0.2))
+
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
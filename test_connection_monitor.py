@@ -0,0 +1,111 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from adb_client import AdbClient
+from connection_monitor import ConnectionMonitor, backoff_delay
+from device_registry import DeviceRegistry, KnownDevice
+from fake_adb_server import FakeAdbServer
+from mdns_browser import CastService
+import device_utils
+
+DEVICE = KnownDevice(uuid="4a5b6c7d", ip_address="192.168.1.80", friendly_name="Living Room TV")
+
+
+class TestBackoffDelay(unittest.TestCase):
+
+    def test_doubles_with_jitter(self):
+        for attempt, ceiling in [(0, 1.0), (1, 2.0), (3, 8.0)]:
+            delay = backoff_delay(attempt, base=1.0, maximum=60.0)
+            self.assertGreaterEqual(delay, ceiling / 2)
+            self.assertLessEqual(delay, ceiling)
+
+    def test_capped(self):
+        self.assertLessEqual(backoff_delay(20, base=1.0, maximum=60.0), 60.0)
+
+
+@patch("builtins.print")
+class TestConnectionMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        patcher = patch("connection_monitor.adb_client.default_client", return_value=AdbClient(port=self.server.port))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        device_utils.invalidate_device_statuses()
+
+    def start_monitor(self, device=DEVICE, registry=None):
+        monitor = ConnectionMonitor(device, registry, interval=0.02, backoff_base=0.02, backoff_max=0.1)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        return monitor
+
+    def wait_until(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out")
+            time.sleep(0.01)
+
+    def test_connected_device_left_alone(self, mock_print):
+        self.server.devices = {"192.168.1.80:5555": "device"}
+
+        monitor = self.start_monitor()
+        self.wait_until(lambda: self.server.requests.count("shell:echo") >= 3)
+
+        self.assertTrue(monitor.report()["connected"])
+        self.assertEqual(monitor.outages, 0)
+        self.assertNotIn("host:connect:192.168.1.80:5555", self.server.requests)
+
+    def test_reconnects_with_backoff_and_reports_downtime(self, mock_print):
+        self.server.devices = {"192.168.1.80:5555": "device"}
+        monitor = self.start_monitor()
+        self.wait_until(lambda: monitor.connected)
+
+        self.server.connect_replies["192.168.1.80:5555"] = ("failed to connect to '192.168.1.80:5555': "
+                                                            "Connection refused")
+        with patch("connection_monitor.utils.find_cast_devices", return_value=[]):
+            self.server.set_device_state("192.168.1.80:5555", None)
+            self.wait_until(lambda: monitor.reconnect_attempts >= 3)
+            self.assertFalse(monitor.report()["connected"])
+            del self.server.connect_replies["192.168.1.80:5555"]
+            self.wait_until(lambda: monitor.connected)
+
+        report = monitor.report()
+        self.assertEqual(report["outages"], 1)
+        self.assertGreater(report["last_downtime"], 0)
+        self.assertEqual(report["down_for"], 0)
+
+    def test_offline_transport_dropped_before_reconnecting(self, mock_print):
+        self.server.devices = {"192.168.1.80:5555": "offline"}
+
+        monitor = self.start_monitor()
+        self.wait_until(lambda: monitor.connected)
+
+        self.assertIn("host:disconnect:192.168.1.80:5555", self.server.requests)
+        self.assertEqual(self.server.devices, {"192.168.1.80:5555": "device"})
+
+    def test_follows_device_to_new_ip_address(self, mock_print):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        registry = DeviceRegistry(os.path.join(directory.name, "devices.json"))
+        registry.remember(DEVICE.uuid, DEVICE.ip_address, DEVICE.friendly_name)
+        self.server.connect_replies["192.168.1.80:5555"] = ("failed to connect to '192.168.1.80:5555': "
+                                                            "No route to host")
+        moved = CastService(ip_address="192.168.1.81", port=8009, uuid=DEVICE.uuid,
+                            friendly_name="Living Room TV", instance_name="Chromecast-4a5b6c7d")
+
+        with patch("connection_monitor.utils.find_cast_devices", return_value=[moved]):
+            monitor = self.start_monitor(registry=registry)
+            self.wait_until(lambda: monitor.connected)
+
+        self.assertEqual(monitor.device.ip_address, "192.168.1.81")
+        self.assertEqual(registry.get(DEVICE.uuid).ip_address, "192.168.1.81")
+        self.assertEqual(self.server.devices, {"192.168.1.81:5555": "device"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import connection_state as cs
+
+
+class TestParseConnectOutput(unittest.TestCase):
+
+    def test_outcomes(self):
+        cases = [
+            ("connected to 192.168.1.80:5555\n", cs.CONNECTED),
+            ("Connected to 192.168.1.80:5555", cs.CONNECTED),
+            ("already connected to 192.168.1.80:5555", cs.ALREADY_CONNECTED),
+            ("failed to authenticate to 192.168.1.80:5555", cs.AUTH_FAILED),
+            ("failed to connect to '192.168.1.80:5555': Connection refused", cs.REFUSED),
+            ("cannot connect to 192.168.1.80:5555: Connection refused (111)", cs.REFUSED),
+            ("failed to connect to '192.168.1.80:5555': No route to host", cs.NO_ROUTE),
+            ("failed to connect to 192.168.1.80:5555: Network is unreachable", cs.NO_ROUTE),
+            ("failed to connect to '192.168.1.80:5555': Connection timed out", cs.TIMED_OUT),
+            ("failed to resolve host '192.168.1.800': Name or service not known", cs.INVALID_ADDRESS),
+            ("cannot resolve host 'tv' and port 5555: Name or service not known", cs.INVALID_ADDRESS),
+            ("", cs.UNEXPECTED),
+            ("unknown", cs.UNEXPECTED),
+        ]
+        for output, kind in cases:
+            with self.subTest(output=output):
+                outcome = cs.parse_connect_output(output)
+                self.assertEqual(outcome.kind, kind)
+                self.assertEqual(outcome.output, output.strip())
+
+
+class TestConnectionStateMachine(unittest.TestCase):
+
+    def test_connection_attempts(self):
+        # The output of `adb connect`, then the device statuses reported by the ADB server
+        cases = [
+            (["connected to 192.168.1.80:5555"], cs.AUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "device"], cs.AUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "unauthorized"], cs.UNAUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "authorizing"], cs.UNAUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "offline"], cs.OFFLINE),
+            (["already connected to 192.168.1.80:5555", "missing"], cs.OFFLINE),
+            (["already connected to 192.168.1.80:5555", "connecting", "device"], cs.AUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "connecting", "unauthorized"], cs.UNAUTHORIZED),
+            (["already connected to 192.168.1.80:5555", "recovery"], cs.FAILED),
+            (["failed to authenticate to 192.168.1.80:5555"], cs.UNAUTHORIZED),
+            (["failed to authenticate to 192.168.1.80:5555", "device"], cs.AUTHORIZED),
+            (["connected to 192.168.1.80:5555", "offline"], cs.OFFLINE),
+            (["connected to 192.168.1.80:5555", "offline", "device"], cs.AUTHORIZED),
+            (["failed to connect to '192.168.1.80:5555': Connection refused"], cs.FAILED),
+            (["failed to connect to '192.168.1.80:5555': No route to host"], cs.FAILED),
+            (["what?"], cs.FAILED),
+        ]
+        for events, state in cases:
+            with self.subTest(events=events):
+                machine = cs.ConnectionStateMachine("192.168.1.80")
+                machine.connecting()
+                machine.connect_output(events[0])
+                for status in events[1:]:
+                    machine.device_status(status)
+
+                self.assertEqual(machine.state, state)
+                self.assertTrue(machine.settled)
+
+    def test_status_only_needed_when_already_connected(self):
+        for output, needs_status in [("connected to 192.168.1.80:5555", False),
+                                     ("already connected to 192.168.1.80:5555", True),
+                                     ("failed to authenticate to 192.168.1.80:5555", False),
+                                     ("failed to connect to '192.168.1.80:5555': Connection refused", False)]:
+            with self.subTest(output=output):
+                machine = cs.ConnectionStateMachine("192.168.1.80")
+                machine.connecting()
+                machine.connect_output(output)
+
+                self.assertEqual(machine.needs_status, needs_status)
+                self.assertEqual(machine.settled, not needs_status)
+
+    def test_reconnect_after_offline(self):
+        machine = cs.ConnectionStateMachine("192.168.1.80")
+        machine.connecting()
+        machine.connect_output("already connected to 192.168.1.80:5555")
+        machine.device_status("offline")
+        machine.connecting()
+        machine.connect_output("connected to 192.168.1.80:5555")
+
+        self.assertEqual(machine.history, [
+            (cs.DISCOVERED, cs.CONNECT, cs.CONNECTING),
+            (cs.CONNECTING, cs.ALREADY_CONNECTED, cs.CONNECTING),
+            (cs.CONNECTING, cs.OFFLINE, cs.OFFLINE),
+            (cs.OFFLINE, cs.CONNECT, cs.CONNECTING),
+            (cs.CONNECTING, cs.CONNECTED, cs.AUTHORIZED),
+        ])
+
+    def test_handshake_in_progress_is_not_offline(self):
+        machine = cs.ConnectionStateMachine("192.168.1.80")
+        machine.connecting()
+        machine.connect_output("already connected to 192.168.1.80:5555")
+        machine.device_status("connecting")
+
+        self.assertEqual(machine.state, cs.CONNECTING)
+        self.assertTrue(machine.needs_status)
+        self.assertFalse(machine.settled)
+
+    def test_invalid_transitions(self):
+        for state, event in [(cs.DISCOVERED, cs.CONNECTED), (cs.DISCOVERED, cs.DEVICE),
+                             (cs.AUTHORIZED, cs.ALREADY_CONNECTED), (cs.FAILED, cs.DEVICE)]:
+            with self.subTest(state=state, event=event), self.assertRaises(ValueError):
+                cs.ConnectionStateMachine("192.168.1.80", state=state).fire(event)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import event_log
+from controller_client import ControllerClient
+from controller_daemon import ControllerDaemon
+
+
+class FakeAdbBackend:
+    """Records daemon commands instead of sending them to devices."""
+
+    def __init__(self):
+        self.keys = []
+        self.macros = []
+        self.broadcasts = []
+        self.launches = []
+        self.statuses = {"192.168.1.80": "device", "192.168.1.90": "unauthorized"}
+        self.delay = 0.0
+
+    def send_keys(self, keycodes, ip_address=None):
+        time.sleep(self.delay)
+        if "KEYCODE_UNKNOWN" in keycodes:
+            raise RuntimeError("Unknown keycode")
+        self.keys.extend((keycode, ip_address) for keycode in keycodes)
+
+    def run_macro(self, name, ip_address=None):
+        if name != "netflix":
+            raise RuntimeError(f"Unknown macro: {name}")
+        self.macros.append((name, ip_address))
+
+    def launch_app(self, app, ip_address=None):
+        if app != "netflix":
+            raise RuntimeError(f"No app matching {app!r}")
+        self.launches.append((app, ip_address))
+        return "com.netflix.ninja/.MainActivity"
+
+    def broadcast(self, group, keycodes=None, macro=None):
+        if group != "lobby":
+            raise RuntimeError(f"Unknown device group: {group}")
+        self.broadcasts.append((group, keycodes, macro))
+        return {"results": [{"ip_address": ip, "ok": True, "value": 0.001, "error": None, "elapsed": 0.01}
+                            for ip in self.statuses], "skew": 0.001, "elapsed": 0.01}
+
+    def status(self, ip_address=None):
+        if ip_address:
+            return {ip_address: self.statuses.get(ip_address, "missing")}
+        return dict(self.statuses)
+
+    def pair(self):
+        return [{"ip_address": ip, "ok": True, "value": "device", "error": None, "elapsed": 0.1}
+                for ip in self.statuses]
+
+    def list_devices(self):
+        return [{"uuid": "4a5b6c7d", "ip_address": "192.168.1.80", "friendly_name": "Living Room TV",
+                 "last_success": 100.0, "status": "device"}]
+
+    def health(self):
+        return [{"uuid": "4a5b6c7d", "ip_address": "192.168.1.80", "connected": False, "down_for": 2.5,
+                 "outages": 1, "last_downtime": 4.0, "total_downtime": 6.5, "reconnect_attempts": 3}]
+
+
+class TestControllerDaemon(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, "controller.sock")
+        self.backend = FakeAdbBackend()
+        self.daemon = ControllerDaemon(self.backend, self.socket_path)
+
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.daemon.start())
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+
+        def stop_loop():
+            asyncio.run_coroutine_threadsafe(self.daemon.stop(), self.loop).result(timeout=5)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join()
+            self.loop.close()
+        self.addCleanup(stop_loop)
+
+        self.client = ControllerClient(self.socket_path, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def test_send_keys_over_one_connection(self):
+        self.client.send_key("KEYCODE_HOME")
+        self.client.send_key("KEYCODE_BACK", device="192.168.1.90")
+
+        self.assertEqual(self.backend.keys, [("KEYCODE_HOME", None), ("KEYCODE_BACK", "192.168.1.90")])
+
+    def test_send_batch_of_keys(self):
+        self.client.send_keys(["KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_DOWN"])
+        self.client.request("key", keycode="KEYCODE_HOME")
+
+        self.assertEqual(self.backend.keys, [("KEYCODE_DPAD_DOWN", None), ("KEYCODE_DPAD_DOWN", None),
+                                             ("KEYCODE_HOME", None)])
+
+    def test_macro(self):
+        self.client.run_macro("netflix")
+        self.client.run_macro("netflix", device="192.168.1.90")
+
+        self.assertEqual(self.backend.macros, [("netflix", None), ("netflix", "192.168.1.90")])
+        with self.assertRaises(RuntimeError):
+            self.client.run_macro("youtube")
+
+    def test_launch_app(self):
+        self.assertEqual(self.client.launch_app("netflix"), "com.netflix.ninja/.MainActivity")
+        self.client.launch_app("netflix", device="192.168.1.90")
+
+        self.assertEqual(self.backend.launches, [("netflix", None), ("netflix", "192.168.1.90")])
+        with self.assertRaises(RuntimeError):
+            self.client.launch_app("hulu")
+
+    def test_broadcast(self):
+        reply = self.client.broadcast("lobby", ["KEYCODE_SLEEP"])
+        self.client.broadcast("lobby", macro="netflix")
+
+        self.assertEqual(self.backend.broadcasts, [("lobby", ["KEYCODE_SLEEP"], None), ("lobby", None, "netflix")])
+        self.assertEqual(reply["skew"], 0.001)
+        self.assertEqual([result["ip_address"] for result in reply["results"]], ["192.168.1.80", "192.168.1.90"])
+        with self.assertRaises(RuntimeError):
+            self.client.broadcast("bar", ["KEYCODE_SLEEP"])
+
+    def test_status(self):
+        self.assertEqual(self.client.request("status")["statuses"], self.backend.statuses)
+        self.assertEqual(self.client.request("status", device="192.168.1.70")["statuses"],
+                         {"192.168.1.70": "missing"})
+
+    def test_pair_and_devices(self):
+        self.assertEqual([result["ip_address"] for result in self.client.request("pair")["results"]],
+                         ["192.168.1.80", "192.168.1.90"])
+        self.assertEqual(self.client.request("devices")["devices"][0]["friendly_name"], "Living Room TV")
+
+    def test_health(self):
+        health = self.client.request("health")["health"]
+
+        self.assertEqual(health[0]["ip_address"], "192.168.1.80")
+        self.assertFalse(health[0]["connected"])
+        self.assertEqual(health[0]["outages"], 1)
+
+    def test_events(self):
+        event_log.clear()
+        event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_HOME"], presses=1, latency=0.01)
+        event_log.record(event_log.STATUS_CHANGE, ip_address="192.168.1.80", state="lost")
+        event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_BACK"], presses=1, latency=0.02)
+
+        self.assertEqual([event["kind"] for event in self.client.events()],
+                         [event_log.KEY_SENT, event_log.STATUS_CHANGE, event_log.KEY_SENT])
+        events = self.client.events(1, event_log.KEY_SENT)
+        self.assertEqual([event["fields"]["keycodes"] for event in events], [["KEYCODE_BACK"]])
+
+    def test_timed_out_reply_does_not_break_later_requests(self):
+        self.client.timeout = 0.2
+        self.backend.delay = 0.5
+
+        with self.assertRaises(TimeoutError):
+            self.client.send_key("KEYCODE_HOME")
+        self.backend.delay = 0.0
+        time.sleep(0.5)  # The late reply arrives on the abandoned connection
+
+        self.assertEqual(self.client.request("status")["statuses"], self.backend.statuses)
+        self.client.send_key("KEYCODE_BACK")
+        self.assertEqual(self.backend.keys, [("KEYCODE_HOME", None), ("KEYCODE_BACK", None)])
+
+    def test_backend_error_reported(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.client.send_key("KEYCODE_UNKNOWN")
+
+        self.assertIn("Unknown keycode", str(context.exception))
+
+    def test_unknown_command(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.client.request("reboot")
+
+        self.assertIn("Unknown command", str(context.exception))
+
+    def test_missing_field(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.client.request("key")
+
+        self.assertIn("Missing field", str(context.exception))
+
+
+class TestDaemonSocket(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, "controller.sock")
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_refuses_to_take_over_a_running_daemon(self):
+        running = ControllerDaemon(FakeAdbBackend(), self.socket_path)
+        self.loop.run_until_complete(running.start())
+        self.addCleanup(self.loop.run_until_complete, running.stop())
+        second = ControllerDaemon(FakeAdbBackend(), self.socket_path)
+
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(second.start())
+        self.loop.run_until_complete(second.stop())
+
+        self.assertTrue(os.path.exists(self.socket_path))
+
+    def test_replaces_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()  # The socket file stays, but nothing listens on it
+        daemon = ControllerDaemon(FakeAdbBackend(), self.socket_path)
+
+        self.loop.run_until_complete(daemon.start())
+        self.addCleanup(self.loop.run_until_complete, daemon.stop())
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(probe.close)
+        probe.connect(self.socket_path)
+
+
+class TestControllerClient(unittest.TestCase):
+
+    def test_daemon_not_running(self):
+        client = ControllerClient("/nonexistent/controller.sock")
+
+        with self.assertRaises(ConnectionError):
+            client.send_key("KEYCODE_HOME")
+
+
+if __name__ == '__main__':
+    unittest.main()
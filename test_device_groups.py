@@ -0,0 +1,136 @@
+import json
+import os
+import stat
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import device_groups
+from adb_shell_session import AdbShellSession
+from device_registry import DeviceRegistry
+
+# Stands in for adb: the shell of 192.168.1.90 cannot be reached, the others run what they are sent
+FAKE_ADB = """#!/bin/sh
+[ "$2" = "192.168.1.90:5555" ] && exit 1
+exec sh
+"""
+
+
+class TestDeviceGroups(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "groups.json")
+        self.registry = DeviceRegistry(os.path.join(directory.name, "devices.json"))
+        self.registry.remember("4a5b6c7d", "192.168.1.80", "Lobby Left", last_success=200)
+        self.registry.remember("0f1e2d3c", "192.168.1.90", "Lobby Right", last_success=100)
+
+    def write_groups(self, groups):
+        with open(self.path, "w") as groups_file:
+            json.dump(groups, groups_file)
+
+    def test_members_by_address_uuid_and_name(self):
+        self.write_groups({"lobby": ["192.168.1.70", "0f1e2d3c", "Lobby Left", "192.168.1.80"]})
+
+        groups = device_groups.load_groups(self.path)
+
+        self.assertEqual(device_groups.resolve_group("lobby", groups, self.registry),
+                         ["192.168.1.70", "192.168.1.90", "192.168.1.80"])
+
+    def test_all_devices(self):
+        self.assertEqual(device_groups.resolve_group("all", {}, self.registry), ["192.168.1.80", "192.168.1.90"])
+
+    def test_unknown_group_or_member(self):
+        with self.assertRaises(RuntimeError) as context:
+            device_groups.resolve_group("bar", {}, self.registry)
+        self.assertIn("Unknown device group: bar", str(context.exception))
+
+        with self.assertRaises(RuntimeError) as context:
+            device_groups.resolve_group("bar", {"bar": ["Bar TV"]}, self.registry)
+        self.assertIn("'Bar TV' of group bar is not a known device", str(context.exception))
+
+    def test_missing_file_means_no_groups(self):
+        self.assertEqual(device_groups.load_groups(self.path), {})
+
+    def test_malformed_groups(self):
+        for groups in [["192.168.1.80"], {"bar": "192.168.1.80"}, {"bar": [80]}]:
+            with self.subTest(groups=groups):
+                self.write_groups(groups)
+                with self.assertRaises(ValueError):
+                    device_groups.load_groups(self.path)
+
+
+@patch("device_groups.AdbShellSession")
+class TestBroadcaster(unittest.TestCase):
+
+    def test_one_persistent_shell_per_device(self, mock_session):
+        mock_session.side_effect = lambda serial: MagicMock(serial=serial)
+        broadcaster = device_groups.Broadcaster()
+        ip_addresses = [f"192.168.1.{host}" for host in range(100, 120)]
+
+        broadcaster.send_keys(["KEYCODE_SLEEP"], ip_addresses)
+        report = broadcaster.send_keys(["KEYCODE_MUTE"], ip_addresses)
+
+        self.assertEqual(mock_session.call_count, 20)
+        self.assertTrue(all(result.ok for result in report.results))
+        session = broadcaster.session("192.168.1.100")
+        self.assertEqual(session.serial, "192.168.1.100:5555")
+        session.open.assert_called()
+        self.assertEqual([call.args[0] for call in session.send.call_args_list],
+                         ["input keyevent KEYCODE_SLEEP", "input keyevent KEYCODE_MUTE"])
+
+        broadcaster.close()
+        session.close.assert_called_once()
+
+    def test_failed_device_reported(self, mock_session):
+        def session(serial):
+            shell = MagicMock(serial=serial)
+            if serial.startswith("192.168.1.90"):
+                shell.send.side_effect = RuntimeError("Unable to send command to device through adb shell")
+            return shell
+        mock_session.side_effect = session
+
+        report = device_groups.Broadcaster().send("input keyevent KEYCODE_HOME", ["192.168.1.80", "192.168.1.90"])
+
+        self.assertEqual([(result.ip_address, result.ok) for result in report.results],
+                         [("192.168.1.80", True), ("192.168.1.90", False)])
+        self.assertIn("Unable to send", report.results[1].error)
+
+
+class TestBroadcastDelivery(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.adb_path = os.path.join(directory.name, "adb")
+        with open(self.adb_path, "w") as script:
+            script.write(FAKE_ADB)
+        os.chmod(self.adb_path, stat.S_IRWXU)
+        self.output = os.path.join(directory.name, "ran")
+
+    def test_unreachable_device_is_reported_failed(self):
+        with patch("device_groups.AdbShellSession",
+                   lambda serial: AdbShellSession(serial, adb_path=self.adb_path)):
+            broadcaster = device_groups.Broadcaster(confirm_timeout=2)
+            self.addCleanup(broadcaster.close)
+            for _ in range(3):
+                report = broadcaster.send(f"echo ran >> {self.output}", ["192.168.1.80", "192.168.1.90"])
+
+                self.assertEqual([(result.ip_address, result.ok) for result in report.results],
+                                 [("192.168.1.80", True), ("192.168.1.90", False)])
+
+        with open(self.output) as ran:
+            self.assertEqual(ran.read(), "ran\n" * 3)
+
+    def test_unconfirmed_command_times_out(self):
+        session = AdbShellSession("192.168.1.80:5555", adb_path=self.adb_path)
+        self.addCleanup(session.close, timeout=0)
+
+        with self.assertRaises(RuntimeError) as context:
+            session.send("sleep 5", confirm_timeout=0.2)
+
+        self.assertIn("did not confirm the command within 0.2 s", str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
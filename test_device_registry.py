@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from device_registry import DeviceRegistry, KnownDevice
+
+
+class TestDeviceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "config", "devices.json")
+        self.registry = DeviceRegistry(self.path)
+
+    def test_empty_when_file_missing(self):
+        self.assertEqual(self.registry.devices(), [])
+
+    def test_remember_and_reload(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80", "Living Room TV", last_success=100)
+
+        self.assertEqual(DeviceRegistry(self.path).devices(),
+                         [KnownDevice("4a5b6c7d", "192.168.1.80", "Living Room TV", 100)])
+
+    def test_refresh_keeps_friendly_name(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80", "Living Room TV", last_success=100)
+        self.registry.remember("4a5b6c7d", "192.168.1.81", last_success=200)
+
+        self.assertEqual(self.registry.get("4a5b6c7d"),
+                         KnownDevice("4a5b6c7d", "192.168.1.81", "Living Room TV", 200))
+
+    def test_most_recent_first(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80", last_success=100)
+        self.registry.remember("0f1e2d3c", "192.168.1.90", last_success=200)
+
+        self.assertEqual([device.uuid for device in self.registry.devices()], ["0f1e2d3c", "4a5b6c7d"])
+
+    def test_find_by_ip(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80", last_success=100)
+        # Another device got the address, and the first one has not been seen since
+        self.registry.remember("0f1e2d3c", "192.168.1.80", last_success=200)
+
+        self.assertEqual(self.registry.find_by_ip("192.168.1.80").uuid, "0f1e2d3c")
+        self.assertIsNone(self.registry.find_by_ip("192.168.1.90"))
+
+    def test_forget(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80")
+        self.registry.forget("4a5b6c7d")
+        self.registry.forget("unknown")
+
+        self.assertEqual(self.registry.devices(), [])
+
+    def test_no_temporary_files_left(self):
+        self.registry.remember("4a5b6c7d", "192.168.1.80")
+        self.registry.remember("0f1e2d3c", "192.168.1.90")
+
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["devices.json"])
+
+    def test_corrupt_file_treated_as_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as registry_file:
+            registry_file.write("{not json")
+
+        self.assertEqual(self.registry.devices(), [])
+        self.registry.remember("4a5b6c7d", "192.168.1.80")
+        self.assertEqual(len(self.registry.devices()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
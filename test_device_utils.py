@@ -1,32 +1,71 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 import device_utils
+import event_log
+from mdns_browser import CastService
 
-@patch("device_utils.subprocess.run")
+
+def mock_async_client() -> MagicMock:
+    """Stands in for adb_client.default_async_client, returning a client whose requests are awaitable."""
+    return MagicMock(return_value=AsyncMock())
+
+
+def cast_service(ip_address: str) -> CastService:
+    return CastService(ip_address=ip_address, port=8009, uuid="4a5b6c7d8e9f0a1b2c3d4e5f60718293",
+                       friendly_name="Living Room TV",
+                       instance_name="chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293._googlecast._tcp.local")
+
+
+@patch("device_utils.mdns_browser.browse")
 class TestGetIpAddress(unittest.TestCase):
 
-    def test_one_ip_address_found(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "192.168.1.80\n"
-        mock_subprocess_run.return_value = mock_result
+    def test_one_ip_address_found(self, mock_discover):
+        mock_discover.return_value = [cast_service("192.168.1.80")]
 
         actual_result = device_utils.find_device_ip_address()
         self.assertEqual(actual_result, "192.168.1.80")
 
-    def test_no_ip_address_found(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = ""
-        mock_subprocess_run.return_value = mock_result
+    @patch("device_utils.subnet_sweep.sweep")
+    def test_no_ip_address_found(self, mock_sweep, mock_discover):
+        mock_discover.return_value = []
+        mock_sweep.return_value = []
 
         with self.assertRaises(SystemExit) as context:
             device_utils.find_device_ip_address()
 
         self.assertEqual(context.exception.code, 0)
+        mock_sweep.assert_called_once()
+
+    @patch("device_utils.subnet_sweep.sweep")
+    def test_found_by_subnet_sweep(self, mock_sweep, mock_discover):
+        mock_discover.return_value = []
+        mock_sweep.return_value = ["192.168.1.80"]
+
+        self.assertEqual(device_utils.find_device_ip_address(), "192.168.1.80")
+
+    @patch("device_utils.subnet_sweep.sweep")
+    def test_no_sweep_when_mdns_answers(self, mock_sweep, mock_discover):
+        mock_discover.return_value = [cast_service("192.168.1.80")]
+
+        device_utils.find_device_ip_address()
+
+        mock_sweep.assert_not_called()
+
+    @patch("device_utils.subnet_sweep.sweep")
+    def test_find_cast_devices_falls_back_to_sweep(self, mock_sweep, mock_discover):
+        mock_discover.return_value = []
+        mock_sweep.return_value = ["192.168.1.80", "192.168.1.90"]
+
+        devices = device_utils.find_cast_devices()
 
-    def multiple_ip_addresses_found(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "192.168.1.70\n192.168.1.80\n192.168.1.90\n"
-        mock_subprocess_run.return_value = mock_result
+        self.assertEqual([(device.ip_address, device.uuid) for device in devices],
+                         [("192.168.1.80", "adb-192.168.1.80"), ("192.168.1.90", "adb-192.168.1.90")])
+        self.assertEqual(device_utils.find_cast_devices(sweep=False), [])
+        mock_sweep.assert_called_once()
+
+    def multiple_ip_addresses_found(self, mock_discover):
+        mock_discover.return_value = [cast_service("192.168.1.70"), cast_service("192.168.1.80"),
+                                      cast_service("192.168.1.90")]
 
         with self.assertRaises(NotImplementedError) as context:
             device_utils.find_device_ip_address()
@@ -34,146 +73,178 @@ class TestGetIpAddress(unittest.TestCase):
         self.assertIn("Handling of multiple Cast-enabled devices", str(context.exception))
 
 
-@patch("device_utils.subprocess.run")
+@patch("device_utils.adb_client.default_async_client", new_callable=mock_async_client)
 class TestConnectToDeviceSuccessful(unittest.TestCase):
 
     def setUp(self):
         self.ip_address = "192.168.1.80"
+        device_utils.invalidate_device_statuses()
 
-    @patch("device_utils.get_device_status")
-    def test_connect_auth_failed(self, mock_device_status, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"failed to authenticate to {self.ip_address}:5555\n"
-        mock_subprocess_run.return_value = mock_result
+    @patch("device_utils.get_device_status_async")
+    def test_connect_auth_failed(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"failed to authenticate to {self.ip_address}:5555\n"
         mock_device_status.return_value = None
 
         actual_result = device_utils.connect_to_cast_device(self.ip_address)
         self.assertEqual(actual_result, False)
+        mock_device_status.assert_not_called()
 
-    @patch("device_utils.get_device_status")
-    def test_connect_already_paired(self, mock_device_status, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"already connected to {self.ip_address}:5555\n"
-        mock_subprocess_run.return_value = mock_result
+    @patch("device_utils.get_device_status_async")
+    def test_connect_already_paired(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"already connected to {self.ip_address}:5555\n"
         mock_device_status.return_value = "device"
 
         actual_result = device_utils.connect_to_cast_device(self.ip_address)
         self.assertEqual(actual_result, True)
 
-    @patch("device_utils.get_device_status")
-    def test_connect_unauthorized_pair(self, mock_device_status, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"already connected to {self.ip_address}:5555\n"
-        mock_subprocess_run.return_value = mock_result
+    @patch("device_utils.get_device_status_async")
+    def test_connect_unauthorized_pair(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"already connected to {self.ip_address}:5555\n"
         mock_device_status.return_value = "unauthorized"
 
         actual_result = device_utils.connect_to_cast_device(self.ip_address)
         self.assertEqual(actual_result, False)
 
-    @patch("device_utils.get_device_status")
-    def test_connect_host_remembered(self, mock_device_status, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"connected to {self.ip_address}:5555\n"
-        mock_subprocess_run.return_value = mock_result
+    @patch("device_utils.get_device_status_async")
+    def test_connect_host_remembered(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"connected to {self.ip_address}:5555\n"
         mock_device_status.return_value = None
 
         actual_result = device_utils.connect_to_cast_device(self.ip_address)
         self.assertEqual(actual_result, True)
+        mock_device_status.assert_not_called()
+
+    @patch("builtins.print")
+    def test_offline_transport_reconnected(self, _, mock_default_client):
+        mock_client = mock_default_client.return_value
+        mock_client.connect.side_effect = [f"already connected to {self.ip_address}:5555",
+                                           f"connected to {self.ip_address}:5555"]
+        mock_client.devices.return_value = [(f"{self.ip_address}:5555", "offline")]
+
+        actual_result = device_utils.connect_to_cast_device(self.ip_address)
+
+        self.assertEqual(actual_result, True)
+        mock_client.disconnect.assert_called_once_with(f"{self.ip_address}:5555")
+        self.assertEqual(mock_client.connect.call_count, 2)
+
+    @patch("device_utils.HANDSHAKE_POLL_INTERVAL", 0.01)
+    @patch("device_utils.get_device_status_async")
+    def test_waits_for_handshake(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"already connected to {self.ip_address}:5555\n"
+        mock_device_status.side_effect = ["connecting", "connecting", "device"]
+
+        self.assertEqual(device_utils.connect_to_cast_device(self.ip_address), True)
+        self.assertEqual(mock_device_status.call_count, 3)
+        mock_default_client.return_value.disconnect.assert_not_called()
+
+    @patch("device_utils.HANDSHAKE_POLL_INTERVAL", 0.01)
+    @patch("device_utils.get_device_status_async")
+    def test_handshake_never_finishes(self, mock_device_status, mock_default_client):
+        mock_default_client.return_value.connect.return_value = f"already connected to {self.ip_address}:5555\n"
+        mock_device_status.return_value = "connecting"
+
+        with self.assertRaises(RuntimeError) as context:
+            device_utils.connect_to_cast_device(self.ip_address, timeout=0.05)
+
+        self.assertIn("still connecting", str(context.exception))
+
+    def test_connection_stays_offline(self, mock_default_client):
+        mock_client = mock_default_client.return_value
+        mock_client.connect.return_value = f"already connected to {self.ip_address}:5555"
+        mock_client.devices.return_value = [(f"{self.ip_address}:5555", "offline")]
+
+        with self.assertRaises(RuntimeError) as context:
+            device_utils.connect_to_cast_device(self.ip_address)
 
-    def test_device_status_offline(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "offline"
-        mock_subprocess_run.return_value = mock_result
+        self.assertIn("is offline", str(context.exception))
+        self.assertEqual(mock_client.connect.call_count, 2)
+
+    def test_device_status_offline(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = [(f"{self.ip_address}:5555", "offline")]
 
         actual_result = device_utils.get_device_status(self.ip_address)
-        self.assertEqual(actual_result, mock_result.stdout)
+        self.assertEqual(actual_result, "offline")
 
-    def test_device_status_unauthorized(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "unauthorized"
-        mock_subprocess_run.return_value = mock_result
+    def test_device_status_unauthorized(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = [(f"{self.ip_address}:5555", "unauthorized")]
 
         actual_result = device_utils.get_device_status(self.ip_address)
-        self.assertEqual(actual_result, mock_result.stdout)
+        self.assertEqual(actual_result, "unauthorized")
 
-    def test_device_status_connected(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "device"
-        mock_subprocess_run.return_value = mock_result
+    def test_device_status_connected(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = [("192.168.1.8:5555", "offline"),
+                                                                  (f"{self.ip_address}:5555", "device")]
 
         actual_result = device_utils.get_device_status(self.ip_address)
-        self.assertEqual(actual_result, mock_result.stdout)
+        self.assertEqual(actual_result, "device")
 
-    @patch("builtins.print")
-    def test_disconnect_from_device_success(self, mock_print, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"disconnected {self.ip_address}"
-        mock_subprocess_run.return_value = mock_result
+    def test_disconnect_from_device_success(self, mock_default_client):
+        event_log.clear()
+        mock_default_client.return_value.disconnect.return_value = f"disconnected {self.ip_address}"
 
         device_utils.disconnect_from_device(self.ip_address)
-        mock_print.assert_called_with(f"Disconnected from device {self.ip_address}")
+
+        self.assertEqual(event_log.recent(1)[0].fields, {"ip_address": self.ip_address, "state": "disconnected"})
 
 
-@patch("device_utils.subprocess.run")
+@patch("device_utils.adb_client.default_async_client", new_callable=mock_async_client)
 class TestConnectToDeviceFailed(unittest.TestCase):
 
     def setUp(self):
         self.ip_address = "192.168.1.80"
+        device_utils.invalidate_device_statuses()
 
-    def test_connect_invalid_ip_address(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"failed to connect to '{self.ip_address}:5555': No route to host\n"
-        mock_subprocess_run.return_value = mock_result
+    def mock_connect_outcome(self, mock_default_client, outcome: str):
+        mock_client = mock_default_client.return_value
+        mock_client.connect.return_value = outcome
+        mock_client.devices.return_value = [(f"{self.ip_address}:5555", "offline")]
+
+    def test_connect_invalid_ip_address(self, mock_default_client):
+        self.mock_connect_outcome(mock_default_client,
+                                  f"failed to connect to '{self.ip_address}:5555': No route to host\n")
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.connect_to_cast_device(self.ip_address)
 
         self.assertIn("Check if device is connected to the local network", str(context.exception))
 
-    def test_connect_invalid_input(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"failed to resolve host '{self.ip_address}': Name or service not known"
-        mock_subprocess_run.return_value = mock_result
+    def test_connect_invalid_input(self, mock_default_client):
+        self.mock_connect_outcome(mock_default_client,
+                                  f"failed to resolve host '{self.ip_address}': Name or service not known")
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.connect_to_cast_device(self.ip_address)
 
         self.assertIn("is an invalid IP address", str(context.exception))
 
-    def test_unknown_connection_outcome(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "unknown"
-        mock_subprocess_run.return_value = mock_result
+    def test_unknown_connection_outcome(self, mock_default_client):
+        self.mock_connect_outcome(mock_default_client, "unknown")
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.connect_to_cast_device(self.ip_address)
 
         self.assertIn("Unexpected connection outcome", str(context.exception))
 
-    def test_connect_refused(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"failed to connect to '{self.ip_address}:5555': Connection refused"
-        mock_subprocess_run.return_value = mock_result
+    def test_connect_refused(self, mock_default_client):
+        self.mock_connect_outcome(mock_default_client,
+                                  f"failed to connect to '{self.ip_address}:5555': Connection refused")
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.connect_to_cast_device(self.ip_address)
 
         self.assertIn("Check if Developer Options and USB Debugging", str(context.exception))
 
-    def test_device_status_not_found(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = ""
-        mock_subprocess_run.return_value = mock_result
+    def test_device_status_not_found(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = []
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.get_device_status(self.ip_address)
 
         self.assertIn("No device with IP address", str(context.exception))
 
-    def test_disconnect_from_device_fail(self, mock_subprocess_run):
-        mock_result = MagicMock()
-        mock_result.stdout = f"error: no such device '{self.ip_address}':5555"
-        mock_subprocess_run.return_value = mock_result
+    def test_disconnect_from_device_fail(self, mock_default_client):
+        mock_default_client.return_value.disconnect.side_effect = device_utils.adb_client.AdbError(
+            f"no such device '{self.ip_address}'")
 
         with self.assertRaises(RuntimeError) as context:
             device_utils.disconnect_from_device(self.ip_address)
@@ -181,5 +252,44 @@ class TestConnectToDeviceFailed(unittest.TestCase):
         self.assertIn("No such device", str(context.exception))
 
 
+@patch("device_utils.adb_client.default_async_client", new_callable=mock_async_client)
+class TestDeviceStatusSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        device_utils.invalidate_device_statuses()
+
+    def test_statuses_of_many_devices_in_one_query(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = [("192.168.1.70:5555", "device"),
+                                                                 ("192.168.1.80:5555", "unauthorized"),
+                                                                 ("192.168.1.90:5555", "offline")]
+
+        statuses = device_utils.get_device_statuses(["192.168.1.70", "192.168.1.80", "192.168.1.90",
+                                                     "192.168.1.100"])
+
+        self.assertEqual(statuses, {"192.168.1.70": "device", "192.168.1.80": "unauthorized",
+                                    "192.168.1.90": "offline", "192.168.1.100": "missing"})
+        mock_default_client.return_value.devices.assert_called_once()
+
+    def test_table_cached_within_ttl(self, mock_default_client):
+        mock_default_client.return_value.devices.return_value = [("192.168.1.80:5555", "unauthorized")]
+
+        self.assertEqual(device_utils.get_device_status("192.168.1.80"), "unauthorized")
+        mock_default_client.return_value.devices.return_value = [("192.168.1.80:5555", "device")]
+        self.assertEqual(device_utils.get_device_status("192.168.1.80"), "unauthorized")
+        self.assertEqual(device_utils.get_device_table(max_age=0), {"192.168.1.80:5555": "device"})
+
+        self.assertEqual(mock_default_client.return_value.devices.call_count, 2)
+
+    def test_connect_invalidates_cache(self, mock_default_client):
+        mock_client = mock_default_client.return_value
+        mock_client.devices.return_value = [("192.168.1.80:5555", "offline")]
+        device_utils.get_device_table()
+
+        mock_client.connect.return_value = "already connected to 192.168.1.80:5555"
+        mock_client.devices.return_value = [("192.168.1.80:5555", "device")]
+
+        self.assertTrue(device_utils.connect_to_cast_device("192.168.1.80"))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
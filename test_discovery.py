@@ -0,0 +1,160 @@
+import asyncio
+import importlib.util
+import os
+import socket
+import tempfile
+import time
+import unittest
+import uuid
+from unittest.mock import patch
+import discovery
+import event_log
+from device_registry import DeviceRegistry
+from mdns_browser import CastService
+
+
+def cast_service(ip_address: str, port: int = 8009) -> CastService:
+    return CastService(ip_address=ip_address, port=port, uuid="4a5b6c7d8e9f0a1b2c3d4e5f60718293",
+                       friendly_name="Living Room TV", instance_name="")
+
+
+class StubBackend(discovery.DiscoveryBackend):
+    """Answers with fixed devices after a delay, or fails."""
+
+    def __init__(self, name, delay, services=(), error=None):
+        self.name = name
+        self.delay = delay
+        self.services = list(services)
+        self.error = error
+        self.cancelled = False
+
+    async def discover(self, timeout):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.services
+
+
+class TestRace(unittest.TestCase):
+
+    def test_fastest_backend_wins_and_others_cancelled(self):
+        slow = StubBackend("slow", 2, [cast_service("192.168.1.90")])
+        fast = StubBackend("fast", 0.05, [cast_service("192.168.1.80")])
+
+        start = time.monotonic()
+        services = discovery.discover([slow, fast])
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual([service.ip_address for service in services], ["192.168.1.80"])
+        self.assertTrue(slow.cancelled)
+
+    def test_failed_and_empty_backends_do_not_win(self):
+        backends = [StubBackend("broken", 0, error=RuntimeError("avahi-daemon is not running")),
+                    StubBackend("empty", 0.01),
+                    StubBackend("mdns", 0.1, [cast_service("192.168.1.80")])]
+
+        services = discovery.discover(backends)
+
+        self.assertEqual([service.ip_address for service in services], ["192.168.1.80"])
+
+    def test_failures_are_recorded(self):
+        event_log.clear()
+
+        discovery.discover([StubBackend("broken", 0, error=RuntimeError("avahi-daemon is not running"))])
+
+        self.assertEqual([event.fields for event in event_log.recent(kind=event_log.DISCOVERY_FAILED)],
+                         [{"backend": "broken", "error": "RuntimeError: avahi-daemon is not running"}])
+
+    def test_timeout(self):
+        start = time.monotonic()
+        services = discovery.discover([StubBackend("slow", 5, [cast_service("192.168.1.80")])], timeout=0.2)
+
+        self.assertEqual(services, [])
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class TestCacheBackend(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = DeviceRegistry(os.path.join(directory.name, "devices.json"))
+
+    def test_unreachable_cached_device_does_not_win(self):
+        self.registry.remember("4a5b6c7d", "127.0.0.1")
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()  # Nothing listens on the port any more
+
+        backend = discovery.CacheBackend(self.registry)
+        with patch("discovery.CAST_PORT", port):
+            self.assertEqual(asyncio.run(discovery._run_backend(backend, 1))[1], [])
+
+    def test_reachable_cached_device_verified(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        self.addCleanup(listener.close)
+        verified = asyncio.run(discovery.is_reachable(cast_service("127.0.0.1", listener.getsockname()[1])))
+
+        self.assertTrue(verified)
+
+
+@unittest.skipUnless(importlib.util.find_spec("pychromecast"), "pychromecast is not installed")
+class TestPyChromecastBackend(unittest.TestCase):
+
+    def cast_info(self, services):
+        from pychromecast.models import CastInfo
+
+        return CastInfo(services=services, uuid=uuid.UUID("4a5b6c7d-8e9f-0a1b-2c3d-4e5f60718293"),
+                        model_name="Chromecast", friendly_name="Living Room TV", host="192.168.1.80", port=8009,
+                        cast_type="cast", manufacturer="Google Inc.")
+
+    def test_discovered_devices(self):
+        from pychromecast.models import HostServiceInfo, MDNSServiceInfo
+
+        info = self.cast_info({HostServiceInfo("192.168.1.80", 8009),
+                               MDNSServiceInfo("Chromecast-4a5b6c7d._googlecast._tcp.local.")})
+
+        with patch("pychromecast.discovery.discover_chromecasts", return_value=([info], None)), \
+                patch("pychromecast.discovery.stop_discovery"):
+            services = discovery.discover([discovery.PyChromecastBackend()])
+
+        self.assertEqual(services, [CastService(ip_address="192.168.1.80", port=8009,
+                                                uuid="4a5b6c7d8e9f0a1b2c3d4e5f60718293",
+                                                friendly_name="Living Room TV",
+                                                instance_name="Chromecast-4a5b6c7d._googlecast._tcp.local.")])
+
+    def test_known_host_has_no_instance_name(self):
+        from pychromecast.models import HostServiceInfo
+
+        service = discovery.cast_info_service(self.cast_info({HostServiceInfo("192.168.1.80", 8009)}))
+
+        self.assertEqual(service.instance_name, "")
+
+
+class TestParseAvahiBrowse(unittest.TestCase):
+
+    def test_resolved_devices(self):
+        output = (
+            "+;wlan0;IPv4;Chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293;_googlecast._tcp;local\n"
+            "=;wlan0;IPv4;Chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293;_googlecast._tcp;local;"
+            "4a5b6c7d-8e9f-0a1b-2c3d-4e5f60718293.local;192.168.1.80;8009;"
+            "\"rs=\" \"nf=1\" \"fn=Living Room TV\" \"md=Chromecast\" \"id=4a5b6c7d8e9f0a1b2c3d4e5f60718293\"\n"
+            "=;wlan0;IPv6;Chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293;_googlecast._tcp;local;"
+            "4a5b6c7d-8e9f-0a1b-2c3d-4e5f60718293.local;fe80::1;8009;\"id=4a5b6c7d8e9f0a1b2c3d4e5f60718293\"\n"
+        )
+
+        self.assertEqual(discovery.parse_avahi_browse(output), [CastService(
+            ip_address="192.168.1.80", port=8009, uuid="4a5b6c7d8e9f0a1b2c3d4e5f60718293",
+            friendly_name="Living Room TV",
+            instance_name="Chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293._googlecast._tcp.local")])
+
+
+if __name__ == '__main__':
+    unittest.main()
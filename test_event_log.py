@@ -0,0 +1,207 @@
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import deque
+from unittest.mock import patch
+import event_log
+from connection_state import ConnectionStateMachine
+from event_log import Event, JournaldSink, JsonLinesSink
+
+
+class ListSink:
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def write(self, events):
+        self.batches.append(events)
+
+    def close(self):
+        self.closed = True
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        event_log.clear()
+        self.addCleanup(event_log.stop)
+
+    def test_recent(self):
+        event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_HOME"], presses=1, latency=0.01)
+        event_log.record(event_log.KEY_DROPPED, keycodes=["KEYCODE_BACK"], count=1, reason="stale")
+        event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_BACK"], presses=1, latency=0.02)
+
+        self.assertEqual([event.kind for event in event_log.recent()],
+                         [event_log.KEY_SENT, event_log.KEY_DROPPED, event_log.KEY_SENT])
+        self.assertEqual([event.fields["keycodes"] for event in event_log.recent(1, event_log.KEY_SENT)],
+                         [["KEYCODE_BACK"]])
+        sequences = [event.sequence for event in event_log.recent()]
+        self.assertEqual(sequences, sorted(sequences))
+
+    def test_state_machine_records_transitions(self):
+        machine = ConnectionStateMachine("192.168.1.80")
+        machine.connecting()
+        machine.connect_output("failed to connect to '192.168.1.80:5555': Connection refused")
+
+        outcome, change = event_log.recent()[-2:]
+        self.assertEqual((outcome.kind, outcome.fields["outcome"]), (event_log.CONNECT_OUTCOME, "refused"))
+        self.assertEqual(change.kind, event_log.STATUS_CHANGE)
+        self.assertEqual((change.fields["previous"], change.fields["state"]), ("connecting", "failed"))
+
+    @patch("event_log._events", deque(maxlen=4))
+    def test_overflow_is_reported(self):
+        sink = ListSink()
+        event_log.start(sink, interval=60)
+        event_log.record(event_log.MACRO, name="netflix")
+        event_log.flush()
+        for index in range(10):
+            event_log.record(event_log.KEY_SENT, keycodes=[f"KEYCODE_{index}"])
+        event_log.flush()
+
+        missed, *kept = sink.batches[1]
+        self.assertEqual((missed.kind, missed.fields), (event_log.EVENTS_MISSED, {"count": 6}))
+        self.assertEqual([event.fields["keycodes"] for event in kept], [[f"KEYCODE_{index}"] for index in range(6, 10)])
+
+    @patch("event_log._events", deque(maxlen=4))
+    def test_overflow_before_first_flush_is_reported(self):
+        event_log.record(event_log.MACRO, name="netflix")
+        event_log.clear()
+        for index in range(10):
+            event_log.record(event_log.KEY_SENT, keycodes=[f"KEYCODE_{index}"])
+
+        sink = ListSink()
+        event_log.start(sink, interval=60)
+        event_log.flush()
+
+        missed, *kept = sink.batches[0]
+        self.assertEqual((missed.kind, missed.fields), (event_log.EVENTS_MISSED, {"count": 6}))
+        self.assertEqual(len(kept), 4)
+
+    def test_concurrent_records_are_written_once_in_order(self):
+        sink = ListSink()
+        event_log.start(sink, interval=0.001)
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+
+        def record_many(thread):
+            for index in range(500):
+                event_log.record(event_log.KEY_SENT, thread=thread, index=index)
+        threads = [threading.Thread(target=record_many, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        event_log.stop()
+
+        written = [event for batch in sink.batches for event in batch]
+        self.assertEqual([event.kind for event in written if event.kind != event_log.KEY_SENT], [])
+        sequences = [event.sequence for event in written]
+        self.assertEqual(sequences, sorted(set(sequences)))
+        self.assertEqual(len(written), 2000)
+
+    def test_record_does_not_wait_for_flush(self):
+        written = threading.Event()
+
+        class SlowSink(ListSink):
+            def write(self, events):
+                time.sleep(0.5)
+                super().write(events)
+                written.set()
+
+        sink = SlowSink()
+        event_log.start(sink, interval=0.01)
+        event_log.record(event_log.MACRO, name="netflix")
+        time.sleep(0.05)  # The flusher is now writing
+
+        start = time.perf_counter()
+        for _ in range(100):
+            event_log.record(event_log.KEY_SENT, keycodes=["KEYCODE_HOME"])
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+        event_log.stop()
+        self.assertTrue(written.is_set())
+        self.assertTrue(sink.closed)
+        self.assertEqual(sum(len(batch) for batch in sink.batches), 101)
+
+    def test_sink_errors_are_counted(self):
+        class BrokenSink(ListSink):
+            def write(self, events):
+                raise OSError("No space left on device")
+
+        event_log.start(BrokenSink(), interval=60)
+        event_log.record(event_log.MACRO, name="netflix")
+        event_log.flush()
+
+        self.assertEqual(event_log._flusher.failures, 1)
+
+
+class TestJsonLinesSink(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "events.jsonl")
+
+    def test_write_and_read(self):
+        sink = JsonLinesSink(self.path)
+        sink.write([Event(1, 1700000000.0, event_log.KEY_SENT, {"keycodes": ["KEYCODE_HOME"], "latency": 0.01}),
+                    Event(2, 1700000001.0, event_log.MACRO, {"name": "netflix"})])
+
+        with open(self.path) as log_file:
+            self.assertEqual(json.loads(log_file.readline()),
+                             {"time": 1700000000.0, "kind": "key_sent", "keycodes": ["KEYCODE_HOME"],
+                              "latency": 0.01})
+        self.assertEqual(event_log.read_file(self.path, kind=event_log.MACRO),
+                         [{"time": 1700000001.0, "kind": "macro", "name": "netflix"}])
+
+    def test_rotation(self):
+        sink = JsonLinesSink(self.path, max_bytes=100)
+        for sequence in range(1, 6):
+            sink.write([Event(sequence, 0.0, event_log.MACRO, {"name": f"macro{sequence}"})])
+
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertEqual([event["name"] for event in event_log.read_file(self.path, count=3)],
+                         ["macro3", "macro4", "macro5"])
+
+
+class TestJournaldSink(unittest.TestCase):
+
+    def test_entry(self):
+        sink = JournaldSink()
+        self.addCleanup(sink.close)
+
+        entry = sink.entry(Event(1, 0.0, event_log.CONNECT_OUTCOME,
+                                 {"ip_address": "192.168.1.80", "outcome": "refused", "output": "failed\nto connect"}))
+
+        self.assertIn(b"CAST_REMOTE_EVENT=connect_outcome\n", entry)
+        self.assertIn(b"CAST_REMOTE_IP_ADDRESS=192.168.1.80\n", entry)
+        self.assertIn(b"SYSLOG_IDENTIFIER=adb-cast-remote\n", entry)
+        # Values with a newline are sent with their length instead of '='
+        self.assertIn(b"CAST_REMOTE_OUTPUT\n" + struct.pack("<Q", 17) + b"failed\nto connect\n", entry)
+
+    def test_sends_one_datagram_per_event(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "journal.socket")
+        journal = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(journal.close)
+        journal.bind(path)
+        sink = JournaldSink(path)
+        self.addCleanup(sink.close)
+
+        sink.write([Event(1, 0.0, event_log.KEY_SENT, {"keycodes": ["KEYCODE_HOME"]}),
+                    Event(2, 0.0, event_log.MACRO, {"name": "netflix"})])
+
+        self.assertIn(b'CAST_REMOTE_KEYCODES=["KEYCODE_HOME"]\n', journal.recv(4096))
+        self.assertIn(b"CAST_REMOTE_NAME=netflix\n", journal.recv(4096))
+
+
+if __name__ == "__main__":
+    unittest.main()
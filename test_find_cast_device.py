@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+import find_cast_device
+
+
+@patch("find_cast_device.utils.disconnect_from_device")
+@patch("find_cast_device.utils.wait_for_device_state")
+class TestWaitForUserAuthentication(unittest.TestCase):
+
+    def setUp(self):
+        self.ip_address = "192.168.1.80"
+
+    @patch("builtins.print")
+    def test_authorized(self, mock_print, mock_wait, mock_disconnect):
+        mock_wait.return_value = True
+
+        find_cast_device.wait_for_user_authentication_on_device(self.ip_address)
+
+        mock_wait.assert_called_once_with(self.ip_address, "device", timeout=find_cast_device.TIMEOUT_SECONDS)
+        mock_disconnect.assert_not_called()
+
+    @patch("builtins.print")
+    def test_timeout_disconnects_and_exits(self, mock_print, mock_wait, mock_disconnect):
+        mock_wait.return_value = False
+
+        with self.assertRaises(SystemExit) as context:
+            find_cast_device.wait_for_user_authentication_on_device(self.ip_address)
+
+        self.assertEqual(context.exception.code, 0)
+        mock_disconnect.assert_called_once_with(self.ip_address)
+        mock_print.assert_called_with("Timeout reached. Exiting...")
+
+    @patch("find_cast_device.time.sleep")
+    @patch("find_cast_device.is_authorized_device")
+    @patch("builtins.print")
+    def test_falls_back_to_polling(self, mock_print, mock_is_authorized, mock_sleep, mock_wait, mock_disconnect):
+        mock_wait.side_effect = find_cast_device.utils.adb_client.AdbError("unknown host service")
+        mock_is_authorized.side_effect = [False, False, True]
+
+        find_cast_device.wait_for_user_authentication_on_device(self.ip_address)
+
+        self.assertEqual(mock_sleep.call_count, 2)
+        mock_disconnect.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
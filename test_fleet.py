@@ -0,0 +1,104 @@
+import time
+import unittest
+from unittest.mock import patch
+import fleet
+from test_device_utils import mock_async_client
+
+
+class TestRunOnDevices(unittest.TestCase):
+
+    def setUp(self):
+        self.ip_addresses = ["192.168.1.70", "192.168.1.80", "192.168.1.90"]
+
+    def test_bounded_by_slowest_device(self):
+        start = time.monotonic()
+        results = fleet.run_on_devices(lambda ip: time.sleep(0.2) or ip, self.ip_addresses * 3)
+
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual([result.value for result in results], self.ip_addresses * 3)
+
+    def test_failures_reported_per_device(self):
+        def operation(ip_address):
+            if ip_address == "192.168.1.80":
+                raise RuntimeError(f"Unable to connect to device at {ip_address}")
+            if ip_address == "192.168.1.90":
+                raise SystemExit(0)
+            return "device"
+
+        results = fleet.run_on_devices(operation, self.ip_addresses)
+
+        self.assertEqual([result.ok for result in results], [True, False, False])
+        self.assertEqual(results[0].value, "device")
+        self.assertIn("Unable to connect", results[1].error)
+        self.assertEqual(results[2].error, "exited with code 0")
+
+    def test_no_devices(self):
+        self.assertEqual(fleet.run_on_devices(lambda ip: ip, []), [])
+
+    @patch("fleet.utils.adb_client.default_async_client", new_callable=mock_async_client)
+    def test_status_all_single_query(self, mock_default_client):
+        fleet.utils.invalidate_device_statuses()
+        mock_default_client.return_value.devices.return_value = [("192.168.1.70:5555", "unauthorized"),
+                                                                 ("192.168.1.80:5555", "device")]
+
+        results = fleet.status_all(self.ip_addresses)
+
+        mock_default_client.return_value.devices.assert_called_once()
+        self.assertEqual([result.value for result in results], ["unauthorized", "device", None])
+        self.assertIn("No device with IP address 192.168.1.90", results[2].error)
+
+
+class TestBroadcast(unittest.TestCase):
+
+    def setUp(self):
+        self.ip_addresses = [f"192.168.1.{host}" for host in range(100, 120)]
+
+    def test_twenty_devices_as_fast_as_one(self):
+        start = time.monotonic()
+        report = fleet.broadcast(lambda ip: time.sleep(0.2), self.ip_addresses)
+
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertTrue(all(result.ok for result in report.results))
+        self.assertEqual([result.ip_address for result in report.results], self.ip_addresses)
+
+    def test_sent_together_despite_slow_preparation(self):
+        sent_at = {}
+        delays = {ip: index * 0.01 for index, ip in enumerate(self.ip_addresses)}
+
+        report = fleet.broadcast(lambda ip: sent_at.setdefault(ip, time.monotonic()), self.ip_addresses,
+                                 prepare=lambda ip: time.sleep(delays[ip]))
+
+        self.assertLess(max(sent_at.values()) - min(sent_at.values()), 0.05)
+        self.assertLess(report.skew, 0.05)
+        self.assertEqual(min(result.value for result in report.results), 0)
+
+    def test_failures_reported_per_device(self):
+        def prepare(ip_address):
+            if ip_address == "192.168.1.100":
+                raise RuntimeError("Unable to start adb shell")
+
+        def send(ip_address):
+            if ip_address == "192.168.1.101":
+                raise RuntimeError("Unable to send command to device through adb shell")
+
+        report = fleet.broadcast(send, self.ip_addresses, prepare=prepare)
+
+        self.assertEqual([result.ok for result in report.results], [False, False] + [True] * 18)
+        self.assertIn("Unable to start", report.results[0].error)
+
+    def test_stuck_device_does_not_hold_up_the_rest(self):
+        start = time.monotonic()
+        report = fleet.broadcast(lambda ip: None, self.ip_addresses[:3],
+                                 prepare=lambda ip: time.sleep(0.5 if ip == "192.168.1.100" else 0),
+                                 sync_timeout=0.1)
+
+        self.assertTrue(all(result.ok for result in report.results))
+        self.assertLess(sorted(result.value for result in report.results)[1], 0.3)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_no_devices(self):
+        self.assertEqual(fleet.broadcast(lambda ip: None, []).results, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import io
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import cast_control
+import device_groups
+import event_log
+import googleTVController
+import gpio_input
+import macros
+
+
+class TestRemote(unittest.TestCase):
+
+    def setUp(self):
+        event_log.clear()
+        self.controller = MagicMock()
+        self.adb_shell = MagicMock()
+        config = macros.parse_config({"macros": {"home_twice": [{"key": "KEYCODE_HOME", "repeat": 2}]},
+                                      "buttons": {"5": {"double": "home_twice"}}})
+        self.remote = googleTVController.Remote(gpio_input.Keymap(), config, self.controller, self.adb_shell)
+        self.gpio = gpio_input.SimulatedGpio()
+        self.buttons = gpio_input.ButtonInput(self.gpio, self.remote.keymap, self.remote.pressed,
+                                              self.remote.released, no_repeat=config.buttons)
+        self.remote.start()
+        self.buttons.start()
+
+    def tearDown(self):
+        self.buttons.close()
+        with patch("builtins.print"):
+            self.remote.close()
+
+    @patch("builtins.print")
+    def test_press_sends_key(self, _):
+        googleTVController.simulate(self.gpio, io.StringIO("22\n"))
+        self.remote.key_queue.stop()
+
+        self.controller.send_keys.assert_called_once_with(["KEYCODE_DPAD_DOWN"])
+        sent = event_log.recent(kind=event_log.KEY_SENT)
+        self.assertEqual([event.fields["keycodes"] for event in sent], [["KEYCODE_DPAD_DOWN"]])
+        self.assertGreaterEqual(sent[0].fields["latency"], 0)
+
+    @patch("builtins.print")
+    def test_falls_back_to_adb_shell(self, _):
+        self.controller.send_keys.side_effect = ConnectionError
+
+        googleTVController.simulate(self.gpio, io.StringIO("27\n"))
+        self.remote.key_queue.stop()
+
+        self.adb_shell.send_keyevents.assert_called_once_with(["KEYCODE_DPAD_CENTER"])
+
+    @patch("builtins.print")
+    def test_double_press_runs_macro(self, _):
+        self.controller.run_macro.side_effect = ConnectionError
+
+        googleTVController.simulate(self.gpio, io.StringIO("5\n5\n"))
+
+        self.adb_shell.send.assert_called_once_with("input keyevent KEYCODE_HOME KEYCODE_HOME")
+
+    @patch("builtins.print")
+    def test_daemon_timeout_is_not_sent_again(self, _):
+        self.controller.send_keys.side_effect = TimeoutError("timed out")
+        self.controller.run_macro.side_effect = TimeoutError("timed out")
+
+        googleTVController.simulate(self.gpio, io.StringIO("27\n5\n5\n"))
+        self.remote.key_queue.stop()
+
+        self.adb_shell.send_keyevents.assert_not_called()
+        self.adb_shell.send.assert_not_called()
+        self.assertEqual([event.fields["error"] for event in event_log.recent(kind=event_log.KEY_FAILED)],
+                         ["timed out"])
+        self.assertEqual([event.fields for event in event_log.recent(kind=event_log.MACRO)],
+                         [{"name": "home_twice", "error": "timed out"}])
+
+    @patch("builtins.print")
+    def test_held_key_repeats(self, _):
+        googleTVController.simulate(self.gpio, io.StringIO("down 17\n"))
+        time.sleep(0.8)
+        googleTVController.simulate(self.gpio, io.StringIO("up 17\n"))
+        self.remote.key_queue.stop()
+
+        sent = [key for call in self.controller.send_keys.call_args_list for key in call.args[0]]
+        self.assertGreater(len(sent), 3)
+        self.assertEqual(set(sent), {"KEYCODE_DPAD_UP"})
+
+    def test_group_keymap_broadcasts(self):
+        self.remote.keymap.group = "lobby"
+        self.controller.broadcast.return_value = {"results": [
+            {"ip_address": "192.168.1.80", "ok": True, "value": 0.0, "error": None, "elapsed": 0.01},
+            {"ip_address": "192.168.1.90", "ok": False, "value": None, "error": "Unable to start adb shell",
+             "elapsed": 0.01}]}
+
+        googleTVController.simulate(self.gpio, io.StringIO("26\n"))
+        self.remote.key_queue.stop()
+
+        self.controller.broadcast.assert_called_once_with("lobby", ["KEYCODE_POWER"], None)
+        self.controller.send_keys.assert_not_called()
+        self.assertEqual([event.fields for event in event_log.recent(kind=event_log.SEND_FAILED)],
+                         [{"ip_address": "192.168.1.90", "error": "Unable to start adb shell"}])
+
+    @patch("device_groups.Broadcaster")
+    def test_group_broadcast_is_not_sent_again_after_daemon_timeout(self, mock_broadcaster):
+        self.remote.keymap.group = "lobby"
+        self.controller.broadcast.side_effect = TimeoutError("timed out")
+
+        with self.assertRaises(TimeoutError):
+            self.remote.send_keycodes(["KEYCODE_POWER"])
+
+        mock_broadcaster.assert_not_called()
+
+    def test_daemon_timeout_outlasts_a_broadcast(self):
+        self.assertGreater(googleTVController.DAEMON_TIMEOUT,
+                           device_groups.SYNC_TIMEOUT + device_groups.CONFIRM_TIMEOUT)
+
+    @patch("builtins.print")
+    def test_cast_keys_go_over_cast(self, _):
+        self.remote.keymap.cast = {"KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN"}
+        self.remote.cast = MagicMock()
+
+        self.remote.send_keycodes(["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_UP", "KEYCODE_HOME"])
+
+        self.remote.cast.send_keys.assert_called_once_with(["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_UP"])
+        self.controller.send_keys.assert_called_once_with(["KEYCODE_HOME"])
+
+    @patch("builtins.print")
+    def test_cast_failure_falls_back_to_adb(self, _):
+        self.remote.keymap.cast = {"KEYCODE_VOLUME_UP"}
+        self.remote.cast = MagicMock()
+        self.remote.cast.send_keys.side_effect = cast_control.CastError("Unable to connect")
+
+        self.remote.send_keycodes(["KEYCODE_VOLUME_UP"])
+        self.remote.send_keycodes(["KEYCODE_VOLUME_UP"])
+
+        # Cast is not tried again right away
+        self.remote.cast.send_keys.assert_called_once()
+        self.assertEqual(self.controller.send_keys.call_count, 2)
+        self.assertEqual(len(event_log.recent(kind=event_log.TRANSPORT_FALLBACK)), 1)
+
+    @patch("builtins.print")
+    def test_nothing_playing_does_not_hold_off_cast(self, _):
+        self.remote.keymap.cast = {"KEYCODE_MEDIA_PLAY_PAUSE", "KEYCODE_VOLUME_UP"}
+        self.remote.cast = MagicMock()
+        self.remote.cast.send_keys.side_effect = [cast_control.NoMediaSessionError("Nothing is playing"), None]
+
+        self.remote.send_keycodes(["KEYCODE_MEDIA_PLAY_PAUSE"])
+        self.remote.send_keycodes(["KEYCODE_VOLUME_UP"])
+
+        self.controller.send_keys.assert_called_once_with(["KEYCODE_MEDIA_PLAY_PAUSE"])
+        self.remote.cast.send_keys.assert_called_with(["KEYCODE_VOLUME_UP"])
+
+    @patch("builtins.print")
+    def test_unknown_command(self, mock_print):
+        googleTVController.simulate(self.gpio, io.StringIO("press seventeen\n"))
+
+        mock_print.assert_called_once_with("Unknown command: press seventeen")
+
+
+if __name__ == '__main__':
+    unittest.main()
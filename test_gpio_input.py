@@ -0,0 +1,138 @@
+import itertools
+import json
+import os
+import tempfile
+import time
+import unittest
+import gpio_input
+from gpio_input import ButtonInput, Debouncer, Keymap, SimulatedGpio
+
+
+class TestKeymap(unittest.TestCase):
+
+    def test_load_keymap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "keymap.json")
+        with open(path, "w") as keymap_file:
+            json.dump({"buttons": {"17": "KEYCODE_DPAD_UP", "27": "KEYCODE_DPAD_CENTER"},
+                       "repeat": ["KEYCODE_DPAD_UP"], "debounce": 0.005}, keymap_file)
+
+        keymap = gpio_input.load_keymap(path)
+
+        self.assertEqual(keymap.buttons, {17: "KEYCODE_DPAD_UP", 27: "KEYCODE_DPAD_CENTER"})
+        self.assertEqual(keymap.repeating_pins(), {17})
+        self.assertEqual(keymap.debounce, 0.005)
+        self.assertEqual(keymap.repeat_delay, Keymap().repeat_delay)
+
+    def test_missing_file_means_default_keymap(self):
+        keymap = gpio_input.load_keymap("/nonexistent/keymap.json")
+
+        self.assertEqual(keymap, Keymap())
+        self.assertEqual(keymap.buttons[27], "KEYCODE_DPAD_CENTER")
+        self.assertIn(22, keymap.repeating_pins())
+        self.assertNotIn(26, keymap.repeating_pins())
+
+    def test_invalid_settings(self):
+        for config in [{"debounce": -1}, {"repeat_delay": "fast"}, {"repeat_acceleration": 1.5},
+                       {"repeat_min_interval": 0}, {"cast": ["KEYCODE_HOME"]}]:
+            with self.subTest(config=config), self.assertRaises(ValueError):
+                gpio_input.parse_keymap(config)
+
+    def test_cast_keys(self):
+        keymap = gpio_input.parse_keymap({"cast": ["KEYCODE_VOLUME_UP", "KEYCODE_MEDIA_PLAY_PAUSE"],
+                                          "cast_device": "192.168.1.80"})
+
+        self.assertEqual(keymap.cast, {"KEYCODE_VOLUME_UP", "KEYCODE_MEDIA_PLAY_PAUSE"})
+        self.assertEqual(keymap.cast_device, "192.168.1.80")
+        self.assertEqual(Keymap().cast, set())
+
+    def test_repeat_accelerates_down_to_minimum(self):
+        keymap = Keymap(repeat_delay=0.4, repeat_interval=0.2, repeat_min_interval=0.1, repeat_acceleration=0.5)
+
+        self.assertEqual(list(itertools.islice(keymap.repeat_delays(), 5)), [0.4, 0.2, 0.1, 0.1, 0.1])
+
+
+class TestDebouncer(unittest.TestCase):
+
+    def test_bounces_dropped(self):
+        debouncer = Debouncer(0.02)
+
+        edges = [(True, 1.000), (False, 1.001), (True, 1.002), (False, 1.100), (True, 1.105), (True, 1.200),
+                 (True, 1.300)]
+        accepted = [level for level, timestamp in edges if debouncer.accept(5, level, timestamp)]
+
+        self.assertEqual(accepted, [True, False, True])
+        self.assertEqual(debouncer.rejected, 4)
+
+    def test_pins_debounced_separately(self):
+        debouncer = Debouncer(0.02)
+
+        self.assertTrue(debouncer.accept(5, True, 1.0))
+        self.assertTrue(debouncer.accept(6, True, 1.001))
+
+    def test_faster_than_fixed_bouncetime(self):
+        debouncer = Debouncer(0.02)
+
+        presses = sum(debouncer.accept(5, level, i * 0.025) for i, level in enumerate([True, False] * 20))
+
+        # RPi.GPIO's bouncetime=200 would have allowed 5 presses in this second
+        self.assertEqual(presses, 40)
+
+
+class TestButtonInput(unittest.TestCase):
+
+    def setUp(self):
+        self.gpio = SimulatedGpio()
+        self.events = []
+        keymap = Keymap(buttons={17: "KEYCODE_DPAD_UP", 27: "KEYCODE_DPAD_CENTER", 6: "KEYCODE_VOLUME_UP"},
+                        debounce=0.02, repeat_delay=0.1, repeat_interval=0.05, repeat_min_interval=0.02)
+        self.buttons = ButtonInput(self.gpio, keymap, lambda pin: self.events.append(("press", pin)),
+                                   lambda pin: self.events.append(("release", pin)), no_repeat={6})
+        self.buttons.start()
+        self.addCleanup(self.buttons.close)
+
+    def test_bouncing_press_reported_once(self):
+        self.gpio.press(27, timestamp=1.0, bounces=3)
+        self.gpio.release(27, timestamp=1.2)
+
+        self.assertEqual(self.events, [("press", 27), ("release", 27)])
+
+    def test_unmapped_pin_ignored(self):
+        self.gpio.press(4, timestamp=1.0)
+
+        self.assertEqual(self.events, [])
+
+    def test_held_button_repeats_until_released(self):
+        self.gpio.press(17)
+        time.sleep(0.3)
+        self.gpio.release(17)
+        repeats = self.buttons.repeats
+        time.sleep(0.1)
+
+        self.assertGreaterEqual(repeats, 3)
+        self.assertEqual(self.buttons.repeats, repeats)
+        self.assertEqual(self.events[-1], ("release", 17))
+        self.assertEqual(self.events.count(("press", 17)), repeats + 1)
+
+    def test_button_not_repeated(self):
+        self.gpio.press(27)
+        self.gpio.press(6)
+        time.sleep(0.2)
+
+        self.assertEqual(self.events, [("press", 27), ("press", 6)])
+        self.assertEqual(self.buttons.repeats, 0)
+
+    def test_quick_tap_released_after_settling(self):
+        self.gpio.press(17)
+        self.gpio.release(17)
+        self.assertEqual(self.events, [("press", 17)])
+
+        time.sleep(0.05)
+
+        self.assertEqual(self.events, [("press", 17), ("release", 17)])
+        self.assertEqual(self.buttons.repeats, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
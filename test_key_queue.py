@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from key_queue import KeyEventQueue, collapse_volume_steps
+
+
+class TestCollapseVolumeSteps(unittest.TestCase):
+
+    def test_net_volume_steps(self):
+        self.assertEqual(collapse_volume_steps(["KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_UP", "KEYCODE_VOLUME_DOWN"]),
+                         ["KEYCODE_VOLUME_UP"])
+
+    def test_opposite_steps_cancel(self):
+        self.assertEqual(collapse_volume_steps(["KEYCODE_VOLUME_DOWN", "KEYCODE_VOLUME_UP"]), [])
+
+    def test_other_keys_keep_order(self):
+        self.assertEqual(collapse_volume_steps(["KEYCODE_VOLUME_DOWN", "KEYCODE_VOLUME_DOWN", "KEYCODE_HOME",
+                                                "KEYCODE_VOLUME_UP", "KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_DOWN"]),
+                         ["KEYCODE_VOLUME_DOWN", "KEYCODE_VOLUME_DOWN", "KEYCODE_HOME", "KEYCODE_VOLUME_UP",
+                          "KEYCODE_DPAD_DOWN", "KEYCODE_DPAD_DOWN"])
+
+
+class TestKeyEventQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def send_batch(self, keycodes):
+        self.release.wait()
+        self.batches.append(keycodes)
+
+    def test_presses_while_busy_sent_as_one_batch(self):
+        key_queue = KeyEventQueue(self.send_batch)
+        key_queue.start()
+        self.release.clear()
+
+        key_queue.press("KEYCODE_HOME")
+        time.sleep(0.05)
+        for _ in range(5):
+            key_queue.press("KEYCODE_DPAD_DOWN")
+        self.release.set()
+        key_queue.stop()
+
+        self.assertEqual(self.batches, [["KEYCODE_HOME"], ["KEYCODE_DPAD_DOWN"] * 5])
+        self.assertEqual(key_queue.stats()["sent"], 6)
+        self.assertEqual(key_queue.stats()["batches"], 2)
+        self.assertEqual(key_queue.stats()["max_depth"], 5)
+
+    def test_full_queue_drops_presses(self):
+        key_queue = KeyEventQueue(self.send_batch, max_size=2)
+
+        results = [key_queue.press("KEYCODE_DPAD_DOWN") for _ in range(4)]
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(key_queue.stats()["dropped_full"], 2)
+
+    def test_stale_presses_dropped(self):
+        key_queue = KeyEventQueue(self.send_batch, max_age=0.05)
+        key_queue.press("KEYCODE_DPAD_DOWN")
+        time.sleep(0.1)
+        key_queue.press("KEYCODE_HOME")
+
+        key_queue.start()
+        key_queue.stop()
+
+        self.assertEqual(self.batches, [["KEYCODE_HOME"]])
+        self.assertEqual(key_queue.stats()["dropped_stale"], 1)
+
+    def test_latency_recorded(self):
+        key_queue = KeyEventQueue(self.send_batch)
+        key_queue.start()
+        key_queue.press("KEYCODE_HOME")
+        key_queue.stop()
+
+        stats = key_queue.stats()
+        self.assertGreaterEqual(stats["latency_p50"], 0)
+        self.assertLess(stats["latency_p99"], 1)
+        self.assertEqual(stats["depth"], 0)
+
+    def test_failed_send_counted(self):
+        def send_batch(keycodes):
+            raise RuntimeError("device offline")
+
+        key_queue = KeyEventQueue(send_batch)
+        key_queue.press("KEYCODE_HOME")
+        key_queue.start()
+        key_queue.stop()
+
+        self.assertEqual(key_queue.stats()["failed"], 1)
+        self.assertEqual(key_queue.stats()["sent"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+import macros
+
+
+class TestCompileMacro(unittest.TestCase):
+
+    def test_navigation_compiled_into_one_command(self):
+        script = macros.compile_macro([
+            {"intent": {"component": "com.netflix.ninja/.MainActivity"}},
+            {"delay": 3},
+            {"key": "KEYCODE_DPAD_DOWN", "repeat": 3},
+            {"key": "KEYCODE_DPAD_CENTER"},
+        ])
+
+        self.assertEqual(script, "am start -n com.netflix.ninja/.MainActivity; sleep 3; "
+                                 "input keyevent KEYCODE_DPAD_DOWN KEYCODE_DPAD_DOWN KEYCODE_DPAD_DOWN "
+                                 "KEYCODE_DPAD_CENTER")
+
+    def test_text_escaped(self):
+        self.assertEqual(macros.compile_macro([{"text": "tom's news"}]), "input text 'tom'\"'\"'s%snews'")
+
+    def test_intent_with_action_and_data(self):
+        script = macros.compile_macro([{"intent": {"action": "android.intent.action.VIEW",
+                                                   "data": "https://www.youtube.com/watch?v=abc&t=1"}}])
+
+        self.assertEqual(script, "am start -a android.intent.action.VIEW "
+                                 "-d 'https://www.youtube.com/watch?v=abc&t=1'")
+
+    def test_fractional_delay(self):
+        self.assertEqual(macros.compile_macro([{"key": "KEYCODE_HOME"}, {"delay": 0.5}, {"key": "3"}]),
+                         "input keyevent KEYCODE_HOME; sleep 0.5; input keyevent 3")
+
+    def test_malformed_steps(self):
+        for steps in [[], [{"key": "KEYCODE_HOME; reboot"}], [{"key": "KEYCODE_HOME", "repeat": 0}],
+                      [{"delay": -1}], [{"intent": {"extra": "x"}}], [{"key": "KEYCODE_HOME", "text": "a"}],
+                      [{"swipe": [0, 0, 100, 100]}], [{"delay": 1, "repeat": 2}], [{"text": "a", "repeat": 2}],
+                      [{"intent": {"action": "android.intent.action.VIEW"}, "repeat": 2}]]:
+            with self.subTest(steps=steps), self.assertRaises(ValueError):
+                macros.compile_macro(steps)
+
+
+class TestMacroConfig(unittest.TestCase):
+
+    def test_load_config(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "macros.json")
+        with open(path, "w") as macros_file:
+            json.dump({"macros": {"home_twice": [{"key": "KEYCODE_HOME", "repeat": 2}]},
+                       "buttons": {"5": {"double": "home_twice"}}}, macros_file)
+
+        config = macros.load_config(path)
+
+        self.assertEqual(config.script("home_twice"), "input keyevent KEYCODE_HOME KEYCODE_HOME")
+        self.assertEqual(config.buttons, {5: {"double": "home_twice"}})
+
+    def test_missing_file_means_no_macros(self):
+        self.assertEqual(macros.load_config("/nonexistent/macros.json"), macros.MacroConfig())
+
+    def test_unknown_macro(self):
+        with self.assertRaises(RuntimeError) as context:
+            macros.MacroConfig().script("netflix")
+
+        self.assertIn("Unknown macro: netflix", str(context.exception))
+
+    def test_invalid_bindings(self):
+        for buttons in [{"5": {"hold": "home"}}, {"5": {"long": "netflix"}}]:
+            with self.subTest(buttons=buttons), self.assertRaises(ValueError):
+                macros.parse_config({"macros": {"home": [{"key": "KEYCODE_HOME"}]}, "buttons": buttons})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import mdns_browser
+
+# mDNS responses recorded from two Chromecasts answering a _googlecast._tcp query
+LIVING_ROOM_RESPONSE = bytes.fromhex(
+    "0000840000010001000000030b5f676f6f676c6563617374045f746370056c6f63616c00000c0001c00c000c00010000"
+    "0078002e2b4368726f6d65636173742d3461356236633764386539663061316232633364346535663630373138323933"
+    "c00cc034001080010000119400932369643d346135623663376438653966306131623263336434653566363037313832"
+    "39330963643d41424344454603726d3d0576653d30350d6d643d4368726f6d65636173741269633d2f73657475702f69"
+    "636f6e2e706e6711666e3d4c6976696e6720526f6f6d2054560963613d3436353431330473743d300f62733d46413846"
+    "4341303030303030046e663d310372733dc0340021800100000078002d000000001f492434613562366337642d386539"
+    "662d306131622d326333642d346535663630373138323933c01dc11300018001000000780004c0a80150"
+)
+BEDROOM_RESPONSE = bytes.fromhex(
+    "0000840000010001000000030b5f676f6f676c6563617374045f746370056c6f63616c00000c0001c00c000c00010000"
+    "0078002e2b4368726f6d65636173742d3066316532643363346235613639373838373936613562346333643265316630"
+    "c00cc0340010800100001194008f2369643d306631653264336334623561363937383837393661356234633364326531"
+    "66300963643d41424344454603726d3d0576653d30350d6d643d4368726f6d65636173741269633d2f73657475702f69"
+    "636f6e2e706e670d666e3d426564726f6f6d2054560963613d3436353431330473743d300f62733d4641384643413030"
+    "30303030046e663d310372733dc0340021800100000078002d000000001f492430663165326433632d346235612d3639"
+    "37382d383739362d613562346333643265316630c01dc10f00018001000000780004c0a8015a"
+)
+
+
+class ReplayResponder:
+    """Replays recorded mDNS responses to whoever sends a query to a loopback socket."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.05)
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def _serve(self):
+        while self.running:
+            try:
+                query, sender = self.sock.recvfrom(9000)
+            except socket.timeout:
+                continue
+            self.queries.append(query)
+            for response in self.responses:
+                self.sock.sendto(response, sender)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class TestParseRecords(unittest.TestCase):
+
+    def test_parse_recorded_response(self):
+        records = mdns_browser.parse_records(LIVING_ROOM_RESPONSE)
+        by_type = {record.rtype: record for record in records}
+
+        self.assertEqual(by_type[mdns_browser.TYPE_PTR].data,
+                         "Chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293._googlecast._tcp.local")
+        self.assertEqual(by_type[mdns_browser.TYPE_SRV].data,
+                         (8009, "4a5b6c7d-8e9f-0a1b-2c3d-4e5f60718293.local"))
+        self.assertEqual(by_type[mdns_browser.TYPE_TXT].data["fn"], "Living Room TV")
+        self.assertEqual(by_type[mdns_browser.TYPE_A].data, "192.168.1.80")
+
+    def test_truncated_response(self):
+        with self.assertRaises(ValueError):
+            mdns_browser.parse_records(LIVING_ROOM_RESPONSE[:60])
+
+    def test_build_query(self):
+        query = mdns_browser.build_query()
+
+        self.assertIn(b"\x0b_googlecast\x04_tcp\x05local\x00", query)
+        self.assertTrue(query.endswith(b"\x00\x0c\x80\x01"))
+
+
+class TestBrowse(unittest.TestCase):
+
+    def browse(self, responses, **kwargs):
+        responder = ReplayResponder(responses)
+        self.addCleanup(responder.stop)
+        return asyncio.run(mdns_browser.browse(address=responder.address, **kwargs)), responder
+
+    def test_first_device_returned_early(self):
+        start = time.monotonic()
+        services, _ = self.browse([LIVING_ROOM_RESPONSE], timeout=5, first_only=True)
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(services, [mdns_browser.CastService(
+            ip_address="192.168.1.80", port=8009, uuid="4a5b6c7d8e9f0a1b2c3d4e5f60718293",
+            friendly_name="Living Room TV",
+            instance_name="chromecast-4a5b6c7d8e9f0a1b2c3d4e5f60718293._googlecast._tcp.local")])
+
+    def test_all_devices_found_within_settle_time(self):
+        start = time.monotonic()
+        services, _ = self.browse([LIVING_ROOM_RESPONSE, BEDROOM_RESPONSE], timeout=5)
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(sorted(service.ip_address for service in services), ["192.168.1.80", "192.168.1.90"])
+        self.assertEqual(sorted(service.friendly_name for service in services), ["Bedroom TV", "Living Room TV"])
+
+    def test_malformed_response_ignored(self):
+        services, _ = self.browse([b"\x00\x01garbage", LIVING_ROOM_RESPONSE], timeout=5, first_only=True)
+
+        self.assertEqual([service.ip_address for service in services], ["192.168.1.80"])
+
+    def test_query_address_from_environment(self):
+        responder = ReplayResponder([LIVING_ROOM_RESPONSE])
+        self.addCleanup(responder.stop)
+        host, port = responder.address
+
+        with patch.dict(os.environ, {mdns_browser.QUERY_ADDRESS_ENV: f"{host}:{port}"}):
+            services = mdns_browser.discover_cast_devices(timeout=5, first_only=True)
+
+        self.assertEqual([service.ip_address for service in services], ["192.168.1.80"])
+
+    def test_no_devices(self):
+        services, responder = self.browse([], timeout=0.3)
+
+        self.assertEqual(services, [])
+        self.assertEqual(responder.queries[0], mdns_browser.build_query())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+from unittest.mock import patch
+import device_utils
+import metrics
+from test_device_utils import mock_async_client
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.enable()
+        self.addCleanup(metrics.disable)
+
+    def test_disabled_records_nothing(self):
+        metrics.disable()
+
+        with metrics.timed("cast_remote_connect_seconds"):
+            pass
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="refused")
+
+        self.assertEqual(metrics.render(), "")
+
+    def test_counter(self):
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="refused")
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="refused")
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="no_route")
+
+        self.assertEqual(metrics.render(),
+                         "# TYPE cast_remote_connect_outcomes_total counter\n"
+                         'cast_remote_connect_outcomes_total{outcome="no_route"} 1\n'
+                         'cast_remote_connect_outcomes_total{outcome="refused"} 2\n')
+
+    def test_histogram(self):
+        metrics.observe("cast_remote_connect_seconds", 0.003)
+        metrics.observe("cast_remote_connect_seconds", 0.2)
+        metrics.observe("cast_remote_connect_seconds", 30)
+
+        lines = metrics.render().splitlines()
+
+        self.assertEqual(lines[0], "# TYPE cast_remote_connect_seconds histogram")
+        self.assertIn('cast_remote_connect_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('cast_remote_connect_seconds_bucket{le="0.25"} 2', lines)
+        self.assertIn('cast_remote_connect_seconds_bucket{le="10.0"} 2', lines)
+        self.assertIn('cast_remote_connect_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("cast_remote_connect_seconds_count 3", lines)
+
+    def test_timed(self):
+        with metrics.timed("cast_remote_status_query_seconds"):
+            pass
+
+        self.assertIn("cast_remote_status_query_seconds_count 1", metrics.render())
+
+    def test_label_escaping(self):
+        metrics.inc("cast_remote_errors_total", reason='say "hi"\n')
+
+        self.assertIn('cast_remote_errors_total{reason="say \\"hi\\"\\n"} 1', metrics.render())
+
+    def test_write_file(self):
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="connected")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cast_remote.prom")
+            metrics.write_file(path)
+
+            with open(path) as metrics_file:
+                self.assertEqual(metrics_file.read(), metrics.render())
+
+    def test_serve(self):
+        metrics.inc("cast_remote_connect_outcomes_total", outcome="connected")
+        server = metrics.serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            self.assertIn('cast_remote_connect_outcomes_total{outcome="connected"} 1', response.read().decode())
+
+    @patch("device_utils.adb_client.default_async_client", new_callable=mock_async_client)
+    def test_connect_outcomes_classified(self, mock_default_client):
+        device_utils.invalidate_device_statuses()
+        mock_client = mock_default_client.return_value
+        mock_client.devices.return_value = [("192.168.1.80:5555", "offline")]
+        mock_client.connect.return_value = "failed to connect to '192.168.1.80:5555': Connection refused"
+
+        with self.assertRaises(RuntimeError):
+            device_utils.connect_to_cast_device("192.168.1.80")
+
+        rendered = metrics.render()
+        self.assertIn('cast_remote_connect_outcomes_total{outcome="refused"} 1', rendered)
+        self.assertIn("cast_remote_connect_seconds_count 1", rendered)
+        # A refused connection is conclusive, so the device table is not queried
+        self.assertNotIn("cast_remote_status_query_seconds", rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
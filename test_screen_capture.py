@@ -0,0 +1,154 @@
+import struct
+import time
+import unittest
+import screen_capture
+from adb_client import AdbClient, AdbError
+from fake_adb_server import FakeAdbServer
+from screen_capture import FrameUpdate, Preview, RawFrame, ScreenCapture, Tile, TileDiffer
+
+SERIAL = "192.168.1.80:5555"
+
+
+def framebuffer(width: int, height: int, pixel, color_space: bool = True, pixel_format: int = 1) -> bytes:
+    """Builds screencap's raw output for a frame whose pixel at (x, y) is pixel(x, y)."""
+    header = struct.pack("<3I", width, height, pixel_format) + (struct.pack("<I", 1) if color_space else b"")
+    return header + b"".join(bytes(pixel(x, y)) for y in range(height) for x in range(width))
+
+
+class TestDownscale(unittest.TestCase):
+
+    def test_keeps_every_nth_pixel(self):
+        raw = framebuffer(4, 4, lambda x, y: (x, y, 10 * x + y, 255))
+        frame = RawFrame(4, 4, 1, bytearray(raw[16:]), 0)
+        out = bytearray()
+
+        size = screen_capture.downscale(frame, 2, out)
+
+        self.assertEqual(size, (2, 2))
+        self.assertEqual(bytes(out), bytes([0, 0, 0, 2, 0, 20, 0, 2, 2, 2, 2, 22]))
+
+    def test_bgra_is_converted_to_rgb(self):
+        frame = RawFrame(1, 1, 5, bytearray(b"\x01\x02\x03\xff"), 0)
+        out = bytearray()
+
+        screen_capture.downscale(frame, 1, out)
+
+        self.assertEqual(bytes(out), b"\x03\x02\x01")
+
+
+class TestTileDiffer(unittest.TestCase):
+
+    def test_first_frame_is_a_keyframe(self):
+        update = TileDiffer(tile_size=2).diff(bytearray(3 * 3 * 3), 3, 3)
+
+        self.assertTrue(update.keyframe)
+        self.assertEqual([(tile.x, tile.y, tile.width, tile.height) for tile in update.tiles],
+                         [(0, 0, 2, 2), (2, 0, 1, 2), (0, 2, 2, 1), (2, 2, 1, 1)])
+
+    def test_only_changed_tiles(self):
+        differ = TileDiffer(tile_size=2)
+        differ.diff(bytearray(4 * 4 * 3), 4, 4)
+        frame = bytearray(4 * 4 * 3)
+        frame[(3 * 4 + 2) * 3:(3 * 4 + 3) * 3] = b"\xff\x00\x00"  # The pixel at (2, 3)
+
+        update = differ.diff(frame, 4, 4)
+
+        self.assertFalse(update.keyframe)
+        self.assertEqual(update.tiles, [Tile(2, 2, 2, 2, bytes(6) + b"\xff\x00\x00" + bytes(3))])
+
+    def test_unchanged_frame_has_no_tiles(self):
+        differ = TileDiffer()
+        differ.diff(bytearray(b"\x07" * 48 * 3), 8, 6)
+
+        self.assertEqual(differ.diff(bytearray(b"\x07" * 48 * 3), 8, 6).tiles, [])
+
+
+class TestPreview(unittest.TestCase):
+
+    def test_tiles_since_sequence(self):
+        preview = Preview()
+        preview.apply(FrameUpdate(2, 1, [Tile(0, 0, 1, 1, b"abc"), Tile(1, 0, 1, 1, b"def")], True))
+        preview.apply(FrameUpdate(2, 1, [Tile(1, 0, 1, 1, b"xyz")], False))
+
+        self.assertEqual(preview.since(1),
+                         struct.pack("<IHHH", 2, 2, 1, 1) + struct.pack("<4H", 1, 0, 1, 1) + b"xyz")
+        self.assertEqual(len(preview.since(0)), 10 + 2 * (8 + 3))
+
+    def test_waits_for_new_tiles(self):
+        preview = Preview()
+        preview.apply(FrameUpdate(1, 1, [Tile(0, 0, 1, 1, b"abc")], True))
+
+        start = time.monotonic()
+        encoded = preview.since(1, timeout=0.1)
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(struct.unpack("<IHHH", encoded), (1, 1, 1, 0))
+
+
+class TestScreenCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.set_device_state(SERIAL, "device")
+        self.frames = [framebuffer(8, 8, lambda x, y: (0, 0, 0, 255)),
+                       framebuffer(8, 8, lambda x, y: (255, 0, 0, 255) if (x, y) == (6, 6) else (0, 0, 0, 255))]
+        self.server.exec_handler = lambda serial, command: self.frames[0] if len(self.frames) == 1 else \
+            self.frames.pop(0)
+        self.capture = ScreenCapture(SERIAL, AdbClient(port=self.server.port), scale=2, tile_size=2)
+
+    def test_streams_changed_tiles(self):
+        first = self.capture.capture()
+        second = self.capture.capture()
+        third = self.capture.capture()
+
+        self.assertEqual(self.server.requests[-1], "exec:screencap")
+        self.assertTrue(first.keyframe)
+        self.assertEqual((first.width, first.height, len(first.tiles)), (4, 4, 4))
+        self.assertEqual(first.raw_bytes, 8 * 8 * 4)
+        self.assertEqual([(tile.x, tile.y) for tile in second.tiles], [(2, 2)])
+        self.assertEqual(second.tiles[0].data, bytes(9) + b"\xff\x00\x00")
+        self.assertEqual(third.tiles, [])
+
+    def test_header_without_color_space(self):
+        self.frames = [framebuffer(2, 2, lambda x, y: (1, 2, 3, 4), color_space=False)]
+        self.capture.scale = 1
+
+        update = self.capture.capture()
+
+        self.assertEqual(update.tiles[0].data, b"\x01\x02\x03" * 4)
+
+    def test_truncated_frame(self):
+        self.frames = [framebuffer(8, 8, lambda x, y: (0, 0, 0, 255))[:-7]]
+
+        with self.assertRaises(screen_capture.CaptureError):
+            self.capture.capture()
+
+    def test_unsupported_pixel_format(self):
+        self.frames = [framebuffer(1, 1, lambda x, y: (0, 0), pixel_format=4)]
+
+        with self.assertRaises(screen_capture.CaptureError):
+            self.capture.capture()
+
+    def test_device_not_connected(self):
+        self.server.set_device_state(SERIAL, None)
+
+        with self.assertRaises(AdbError):
+            self.capture.capture()
+
+    def test_frame_rate_is_capped(self):
+        self.capture.max_fps = 20
+        self.capture.differ.diff = lambda frame, width, height: FrameUpdate(width, height, [Tile(0, 0, 0, 0, b"")],
+                                                                           False)
+
+        start = time.monotonic()
+        for count, _ in enumerate(self.capture.stream(), 1):
+            if count == 5:
+                self.capture.stop()
+
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
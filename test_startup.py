@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Generous for a laptop so the test is not flaky; lower it to check a Pi's real numbers
+IMPORT_BUDGET_SECONDS = float(os.environ.get("CAST_REMOTE_IMPORT_BUDGET", "0.4"))
+HEAVY_MODULES = {"pychromecast", "bleak", "zeroconf", "http.server", "http.client", "email", "argparse"}
+
+
+def profile_import(module: str):
+    """Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        The cumulative import time of the module in seconds, and every module it loaded.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    cumulative = None
+    loaded = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        loaded.add(name.strip())
+        if name.strip() == module:
+            cumulative = int(cumulative_us) / 1e6
+    return cumulative, loaded
+
+
+class TestStartupBudget(unittest.TestCase):
+
+    def assert_within_budget(self, module: str, forbidden):
+        # Take the best of a few runs, the first one may be paying for a cold disk cache
+        runs = [profile_import(module) for _ in range(3)]
+        import_time = min(cumulative for cumulative, _ in runs)
+        loaded = runs[0][1]
+
+        self.assertLess(import_time, IMPORT_BUDGET_SECONDS,
+                        f"Importing {module} took {import_time * 1000:.0f} ms")
+        self.assertEqual(sorted(name for name in loaded if name in forbidden or name.split(".")[0] in forbidden),
+                         [])
+
+    def test_auto_pair_entry_point(self):
+        self.assert_within_budget("auto_pair_to_cast_device", HEAVY_MODULES)
+
+    def test_boot_service_client(self):
+        # chromecast_auto-pair.service only has to hand the request to the daemon
+        self.assert_within_budget("controller_client", HEAVY_MODULES | {"asyncio", "device_utils", "adb_client"})
+
+    def test_optional_discovery_backends_not_imported(self):
+        self.assert_within_budget("discover_chromecasts", HEAVY_MODULES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import ipaddress
+import socket
+import struct
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import subnet_sweep
+
+
+class FakeAdbDevice:
+    """Answers the opening message of ADB connections the way a device does."""
+
+    def __init__(self, host: str, port: int, command: int = subnet_sweep.A_AUTH):
+        self.command = command
+        self.server = socket.create_server((host, port))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            with connection:
+                connection.recv(1024)
+                token = b"\x00" * 20
+                connection.sendall(struct.pack("<6I", self.command, 1, 0, len(token), sum(token),
+                                               self.command ^ 0xFFFFFFFF) + token)
+
+    def close(self):
+        self.server.close()
+
+
+class TestSweepNetworks(unittest.TestCase):
+
+    def test_networks_from_interfaces(self):
+        interfaces = [ipaddress.IPv4Interface("127.0.0.1/8"), ipaddress.IPv4Interface("169.254.10.2/16"),
+                      ipaddress.IPv4Interface("192.168.1.20/24"), ipaddress.IPv4Interface("10.8.3.7/16"),
+                      ipaddress.IPv4Interface("192.168.1.21/24"), ipaddress.IPv4Interface("172.16.4.9/22")]
+
+        self.assertEqual(subnet_sweep.sweep_networks(interfaces),
+                         [ipaddress.IPv4Network("192.168.1.0/24"), ipaddress.IPv4Network("10.8.3.0/24"),
+                          ipaddress.IPv4Network("172.16.4.0/22")])
+
+    def test_targets_exclude_own_address(self):
+        targets = subnet_sweep.sweep_targets([ipaddress.IPv4Network("192.168.1.0/24")], exclude=["192.168.1.20"])
+
+        self.assertEqual(len(targets), 253)
+        self.assertEqual(targets[0], "192.168.1.1")
+        self.assertNotIn("192.168.1.20", targets)
+        self.assertNotIn("192.168.1.255", targets)
+
+    def test_configured_networks(self):
+        with patch.dict("os.environ", {subnet_sweep.NETWORKS_ENV: "10.0.0.0/28, 10.0.1.5/30"}):
+            self.assertEqual(subnet_sweep.local_networks(),
+                             [ipaddress.IPv4Network("10.0.0.0/28"), ipaddress.IPv4Network("10.0.1.4/30")])
+
+    def test_interfaces_read(self):
+        for interface in subnet_sweep.interface_networks():
+            self.assertIsInstance(interface, ipaddress.IPv4Interface)
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakeAdbDevice("127.0.0.2", 0)
+        self.addCleanup(self.device.close)
+        self.port = self.device.port
+        # Something else listening on the port, which does not speak ADB
+        self.other = socket.create_server(("127.0.0.3", self.port))
+        self.addCleanup(self.other.close)
+
+    def test_only_adb_devices_reported(self):
+        found = asyncio.run(subnet_sweep.sweep([ipaddress.IPv4Network("127.0.0.0/29")], port=self.port,
+                                               timeout=0.3))
+
+        self.assertEqual(found, ["127.0.0.2"])
+
+    def test_handshake_answers(self):
+        self.assertEqual(asyncio.run(subnet_sweep.adb_handshake("127.0.0.2", self.port)), "unauthorized")
+        self.assertIsNone(asyncio.run(subnet_sweep.adb_handshake("127.0.0.3", self.port, timeout=0.2)))
+        self.assertIsNone(asyncio.run(subnet_sweep.adb_handshake("127.0.0.4", self.port)))
+
+        authorized = FakeAdbDevice("127.0.0.5", self.port, command=subnet_sweep.A_CNXN)
+        self.addCleanup(authorized.close)
+        self.assertEqual(asyncio.run(subnet_sweep.adb_handshake("127.0.0.5", self.port)), "device")
+
+    def test_sweep_takes_about_one_timeout(self):
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        with patch("subnet_sweep.asyncio.open_connection", side_effect=hang):
+            start = time.monotonic()
+            found = asyncio.run(subnet_sweep.sweep([ipaddress.IPv4Network("10.0.0.0/24")], timeout=0.2))
+
+        self.assertEqual(found, [])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_concurrency_capped(self):
+        active = 0
+        most_active = 0
+
+        async def slow_refusal(*args, **kwargs):
+            nonlocal active, most_active
+            active += 1
+            most_active = max(most_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            raise ConnectionRefusedError
+
+        with patch("subnet_sweep.asyncio.open_connection", side_effect=slow_refusal):
+            asyncio.run(subnet_sweep.sweep([ipaddress.IPv4Network("10.0.0.0/24")], concurrency=16))
+
+        self.assertEqual(most_active, 16)
+
+
+if __name__ == '__main__':
+    unittest.main()